@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+"""
+Benchmark for reading newline delimited JSON responses with SocketPipe,
+compared against the recv(1024) and string concatenation reader it
+replaced.  The stream mixes header chunk sized responses (~21KB of hex)
+with claim listing sized ones (~1MB).
+
+    python benchmarks/bench_socketpipe.py [megabytes]
+"""
+
+import json
+import socket
+import sys
+import threading
+import time
+
+from lbryum.util import SocketPipe, parse_json
+
+
+class LegacySocketPipe(SocketPipe):
+    def __init__(self, socket):
+        SocketPipe.__init__(self, socket)
+        self.message = ''
+
+    def get(self):
+        while True:
+            response, self.message = parse_json(self.message)
+            if response is not None:
+                return response
+            data = self.socket.recv(1024)
+            if not data:
+                return None
+            self.message += data
+
+
+def make_stream(megabytes):
+    chunk = json.dumps({'id': 1, 'result': 'ab' * (96 * 112)}) + '\n'
+    listing = json.dumps({'id': 2, 'result': ['cd' * 500] * 1000}) + '\n'
+    frames = []
+    size = 0
+    while size < megabytes * 1024 * 1024:
+        frames.extend([chunk] * 20 + [listing])
+        size += 20 * len(chunk) + len(listing)
+    return ''.join(frames), len(frames)
+
+
+def read_stream(pipe_class, data, count):
+    reader, writer = socket.socketpair()
+    sender = threading.Thread(target=lambda: (writer.sendall(data), writer.close()))
+    pipe = pipe_class(reader)
+    pipe.set_timeout(10)
+    start = time.time()
+    sender.start()
+    received = 0
+    while pipe.get() is not None:
+        received += 1
+    elapsed = time.time() - start
+    sender.join()
+    reader.close()
+    assert received == count, (received, count)
+    return elapsed
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    data, count = make_stream(megabytes)
+    print "%d frames, %.1f MB" % (count, len(data) / 1024.0 / 1024)
+    for name, pipe_class in [('legacy', LegacySocketPipe), ('SocketPipe', SocketPipe)]:
+        elapsed = min(read_stream(pipe_class, data, count) for _ in range(3))
+        print "%-12s %7.3f s %8.1f MB/s" % (name, elapsed, len(data) / 1024.0 / 1024 / elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Benchmark of a first wallet sync against the fake lbryum server of
+fake_server.py.  For each wallet size a fresh watch-only wallet with one
+transaction per address syncs the headers, the address histories and
+transactions, and their merkle proofs.  The wall time of each phase and
+the requests the server received, by method, are reported.
+
+    python benchmarks/bench_sync.py [--sizes 100,1000] [--timeout S] [--latency S] [--jitter S]
+
+The default sizes finish in about a minute.  Larger wallets are opt-in:
+the history phase grows quadratically with the number of addresses, as
+the wallet copies its state for every transaction it adds, so
+--sizes 10000 runs for about an hour and needs --timeout 3600 or more.
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+from fake_server import FakeChain, FakeServer
+from lbryum.network import Network
+from lbryum.simple_config import SimpleConfig
+from lbryum.wallet import WalletStorage, Imported_Wallet, IMPORTED_ACCOUNT
+
+
+def wait_for(condition, timeout, poll=0.01):
+    """Time at which condition became true, or None after timeout seconds"""
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return None
+        time.sleep(poll)
+    return time.time()
+
+
+def run_sync(size, args):
+    chain = FakeChain(size, args.blocks)
+    server = FakeServer(chain, latency=args.latency, jitter=args.jitter, version=args.server_version)
+    server.start()
+    path = tempfile.mkdtemp()
+    network = None
+    wallet = None
+    try:
+        # an existing headers file without a download marker skips the
+        # bootstrap download, so all headers come from the fake server
+        open(os.path.join(path, 'blockchain_headers'), 'wb').close()
+        config = SimpleConfig({
+            'portable': True,
+            'lbryum_path': path,
+            'chain': 'lbrycrd_regtest',
+            'checkpoints': chain.checkpoints,
+            'server': server.server,
+            'oneserver': True,
+            'auto_connect': False,
+            'default_servers': {},
+        })
+        wallet = Imported_Wallet(WalletStorage(os.path.join(path, 'wallet')))
+        account = wallet.accounts[IMPORTED_ACCOUNT]
+        for address in chain.addresses:
+            account.add(address, None, None, None)
+        wallet.save_accounts()
+
+        result = {'phases': []}
+        start = last = time.time()
+        network = Network(config)
+        network.start()
+        phases = [
+            ('headers', lambda: network.get_local_height() == chain.height),
+            ('history', lambda: len(wallet.transactions) == size and wallet.is_up_to_date()),
+            ('verify', lambda: len(wallet.verified_tx) == size),
+        ]
+        for name, condition in phases:
+            if name == 'history':
+                wallet.start_threads(network)
+            done = wait_for(condition, args.timeout)
+            if done is None:
+                result['timeout'] = name
+                break
+            result['phases'].append((name, done - last))
+            last = done
+        result['total'] = time.time() - start
+        result['transactions'] = len(wallet.transactions)
+        result['verified'] = len(wallet.verified_tx)
+        result['counts'] = dict(server.counts)
+        result['batches'] = server.batches
+        return result
+    finally:
+        if wallet is not None and wallet.network is not None:
+            wallet.stop_threads()
+        if network is not None:
+            network.stop()
+            network.join()
+        server.stop()
+        shutil.rmtree(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="wallet sync benchmark against a fake lbryum server")
+    parser.add_argument('--sizes', default='100,1000', help="comma separated numbers of addresses")
+    parser.add_argument('--blocks', type=int, default=1000, help="height of the synthetic chain")
+    parser.add_argument('--latency', type=float, default=0.02, help="server response delay in seconds")
+    parser.add_argument('--jitter', type=float, default=0.005, help="random variation of the delay")
+    parser.add_argument('--server-version', default='LBRYumX 0.0.0',
+                        help="server.version reply, a non-LBRYumX version turns off batching")
+    parser.add_argument('--timeout', type=float, default=600, help="seconds allowed for each phase before giving up on a size")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    print "latency %.3fs, jitter %.3fs, %d blocks" % (args.latency, args.jitter, args.blocks)
+    for size in [int(size) for size in args.sizes.split(',')]:
+        result = run_sync(size, args)
+        phases = ', '.join('%s %.2fs' % phase for phase in result['phases'])
+        print "%7d addresses: %8.2fs total, %s" % (size, result['total'], phases)
+        if 'timeout' in result:
+            print "%7s timed out in %s, %d transactions received, %d verified" % (
+                '', result['timeout'], result['transactions'], result['verified'])
+        counts = result['counts']
+        print "%7s %d requests in %d batches" % ('', sum(counts.values()), result['batches'])
+        for method, count in sorted(counts.items()):
+            print "%7s %8d %s" % ('', count, method)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Microbenchmark for LbryCrd.get_target and the ArithUint256 compact
+conversions, compared against the implementation they replaced.
+
+    python benchmarks/bench_targets.py [headers]
+"""
+
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+
+from lbryum.blockchain import LbryCrdReg, ArithUint256
+
+
+class LegacyArithUint256(ArithUint256):
+    def bits(self):
+        bn = bin(self._value)[2:]
+        for i, d in enumerate(bn):
+            if d:
+                return (len(bn) - i) + 1
+        return 0
+
+    def GetCompact(self):
+        nSize = (self.bits() + 7) // 8
+        nCompact = 0
+        if nSize <= 3:
+            nCompact = self.GetLow64() << 8 * (3 - nSize)
+        else:
+            bn = LegacyArithUint256(self._value >> 8 * (nSize - 3))
+            nCompact = bn.GetLow64()
+        if nCompact & 0x00800000:
+            nCompact >>= 8
+            nSize += 1
+        nCompact |= nSize << 24
+        return nCompact
+
+
+def legacy_get_target(blockchain, index, first, last):
+    if index == 0:
+        return blockchain.GENESIS_BITS, blockchain.MAX_TARGET
+    bits = last.get('bits')
+    blockchain.check_bits(bits)
+    nActualTimespan = last.get('timestamp') - first.get('timestamp')
+    nTargetTimespan = blockchain.N_TARGET_TIMESPAN
+    nModulatedTimespan = nTargetTimespan - (nActualTimespan - nTargetTimespan) / 8
+    nMinTimespan = nTargetTimespan - (nTargetTimespan / 8)
+    nMaxTimespan = nTargetTimespan + (nTargetTimespan / 2)
+    if nModulatedTimespan < nMinTimespan:
+        nModulatedTimespan = nMinTimespan
+    elif nModulatedTimespan > nMaxTimespan:
+        nModulatedTimespan = nMaxTimespan
+    bnOld = LegacyArithUint256(LegacyArithUint256.fromCompact(bits))
+    bnNew = LegacyArithUint256((bnOld._value * nModulatedTimespan) % 2 ** 256)
+    bnNew /= nModulatedTimespan
+    if bnNew > blockchain.MAX_TARGET:
+        bnNew = LegacyArithUint256(blockchain.MAX_TARGET)
+    return bnNew.GetCompact(), bnNew._value
+
+
+class Config(object):
+    def __init__(self, path):
+        self.path = path
+
+    def get(self, key, default=None):
+        return default
+
+
+def make_headers(count):
+    # a regtest run with constant bits, as verified during catch-up
+    return [{'block_height': height, 'timestamp': 1000 + height * 150, 'bits': 0x207fffff}
+            for height in range(count)]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    path = tempfile.mkdtemp()
+    try:
+        blockchain = LbryCrdReg(Config(path), None)
+        headers = make_headers(count)
+
+        def run(get_target):
+            for height in range(1, count):
+                get_target(height, headers[height - 1], headers[height])
+
+        for height in range(1, count):
+            first, last = headers[height - 1], headers[height]
+            assert blockchain.get_target(height, first, last) == \
+                legacy_get_target(blockchain, height, first, last)
+        # the legacy code encodes zero as 0x01000000, targets are never zero
+        values = [random.getrandbits(n) | (1 << (n - 1))
+                  for n in (random.randint(1, 256) for _ in range(count))]
+        for value in values:
+            assert ArithUint256(value).GetCompact() == LegacyArithUint256(value).GetCompact()
+
+        timings = [
+            ('get_target (legacy)', lambda: run(lambda *args: legacy_get_target(blockchain, *args))),
+            ('get_target', lambda: run(blockchain.get_target)),
+            ('GetCompact (legacy)', lambda: [LegacyArithUint256(v).GetCompact() for v in values]),
+            ('GetCompact', lambda: [ArithUint256(v).GetCompact() for v in values]),
+        ]
+        for name, func in timings:
+            elapsed = min(timeit.repeat(func, number=1, repeat=5))
+            print "%-22s %8.2f us/header" % (name, elapsed * 1e6 / count)
+        blockchain.close()
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
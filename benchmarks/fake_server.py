@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+"""
+Local stand-in for an lbryum server, serving a synthetic regtest chain
+so that network and wallet sync can be benchmarked without a lbrycrd
+node or the public servers.
+
+The chain pays one transaction to each of a set of generated addresses.
+Its headers are mined to the regtest proof of work limit, a couple of
+hashes each, but its genesis block is not the regtest one, so clients
+must take the chain's checkpoints (FakeChain.checkpoints).  Responses
+are delayed by latency seconds, plus or minus a uniformly distributed
+jitter, and requests are counted by method.
+
+    python benchmarks/fake_server.py [--addresses N] [--port P] [--latency S]
+
+prints the server to pass as --server and writes the addresses and
+checkpoints as JSON to --dump, if given.
+"""
+
+import argparse
+import hashlib
+import heapq
+import json
+import random
+import select
+import socket
+import struct
+import threading
+import time
+from collections import defaultdict
+
+from lbryum.blockchain import BLOCKS_PER_CHUNK, ArithUint256, Header
+from lbryum.lbrycrd import Hash, PoWHash, hash_encode, hash_decode, int_to_hex, hash_160_to_bc_address
+
+# bits of every header, the regtest proof of work limit
+REGTEST_BITS = 0x207fffff
+BLOCK_INTERVAL = 150
+GENESIS_TIME = 1446058291
+HEADER_STRUCT = struct.Struct('<I32s32s32sIII')
+
+
+def make_tx(h160, n, value=100000000):
+    """Raw hex of a transaction paying value to the P2PKH address of
+    h160.  Its single input is coinbase-like, n makes it unique."""
+    script_sig = '04' + int_to_hex(n, 4)
+    script_pubkey = '76a914' + h160.encode('hex') + '88ac'
+    return ('01000000' + '01' + '00' * 32 + 'ffffffff' +
+            int_to_hex(len(script_sig) / 2) + script_sig + 'ffffffff' +
+            '01' + int_to_hex(value, 8) + int_to_hex(len(script_pubkey) / 2) + script_pubkey +
+            '00000000')
+
+
+def merkle_levels(hashes):
+    """Levels of the merkle tree over binary tx hashes, from the leaves
+    up to the root.  Odd levels are padded with their last hash."""
+    levels = [hashes]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        if len(level) % 2:
+            level = level + [level[-1]]
+        levels.append([Hash(level[i] + level[i + 1]) for i in range(0, len(level), 2)])
+    return levels
+
+
+def merkle_branch(levels, pos):
+    branch = []
+    for level in levels[:-1]:
+        sibling = pos ^ 1
+        branch.append(hash_encode(level[sibling] if sibling < len(level) else level[pos]))
+        pos >>= 1
+    return branch
+
+
+class FakeChain(object):
+    """A chain of height + 1 blocks.  Every block starts with a coinbase
+    paying an address outside the wallet, followed by one transaction to
+    each of the addresses assigned to it.  Addresses are spread evenly
+    over blocks 1 to height."""
+
+    def __init__(self, address_count, height=1000, seed=0):
+        assert height > BLOCKS_PER_CHUNK, "the chain must be longer than a chunk"
+        self.height = height
+        self.addresses = []
+        self.transactions = {}
+        self.tx_heights = {}
+        self.histories = {}
+        # claimtrie.getvalue results by name, all other names are unclaimed
+        self.claims = {}
+        blocks = [[] for _ in range(height + 1)]
+        for n in range(height + 1):
+            blocks[n].append(self.add_tx(self.make_h160(seed, 'coinbase', n), n, n))
+        for i in range(address_count):
+            h160 = self.make_h160(seed, 'address', i)
+            address = hash_160_to_bc_address(h160)
+            tx_height = 1 + i % height
+            tx_hash = self.add_tx(h160, height + 1 + i, tx_height)
+            blocks[tx_height].append(tx_hash)
+            self.addresses.append(address)
+            self.histories[address] = [(tx_hash, tx_height)]
+        self.blocks = [[hash_decode(tx_hash) for tx_hash in block] for block in blocks]
+        self._merkle_cache = {}
+        self.headers = []
+        prev_hash = '\0' * 32
+        target = ArithUint256.fromCompact(REGTEST_BITS)
+        for n, block in enumerate(self.blocks):
+            merkle_root = merkle_levels(block)[-1][0]
+            nonce = 0
+            while True:
+                raw = HEADER_STRUCT.pack(1, prev_hash, merkle_root, '\0' * 32,
+                                         GENESIS_TIME + n * BLOCK_INTERVAL, REGTEST_BITS, nonce)
+                if int(hash_encode(PoWHash(raw)), 16) <= target:
+                    break
+                nonce += 1
+            self.headers.append(raw)
+            prev_hash = Hash(raw)
+
+    @staticmethod
+    def make_h160(seed, kind, n):
+        return hashlib.sha256('%s:%s:%d' % (seed, kind, n)).digest()[:20]
+
+    def add_tx(self, h160, n, tx_height):
+        raw = make_tx(h160, n)
+        tx_hash = hash_encode(Hash(raw.decode('hex')))
+        self.transactions[tx_hash] = raw
+        self.tx_heights[tx_hash] = tx_height
+        return tx_hash
+
+    @property
+    def checkpoints(self):
+        """Checkpoints on the genesis block and the tip, for the
+        'checkpoints' config option"""
+        return [(height, hash_encode(Hash(self.headers[height])), REGTEST_BITS)
+                for height in (0, self.height)]
+
+    def header(self, height):
+        return Header(self.headers[height], height).as_dict()
+
+    def chunk(self, index):
+        start = index * BLOCKS_PER_CHUNK
+        return ''.join(self.headers[start:start + BLOCKS_PER_CHUNK]).encode('hex')
+
+    def status(self, address):
+        history = self.histories.get(address)
+        if not history:
+            return None
+        status = ''.join('%s:%d:' % item for item in history)
+        return hashlib.sha256(status).hexdigest()
+
+    def history(self, address):
+        return [{'tx_hash': tx_hash, 'height': height}
+                for tx_hash, height in self.histories.get(address, [])]
+
+    def merkle(self, tx_hash):
+        height = self.tx_heights[tx_hash]
+        levels = self._merkle_cache.get(height)
+        if levels is None:
+            levels = self._merkle_cache[height] = merkle_levels(self.blocks[height])
+        pos = self.blocks[height].index(hash_decode(tx_hash))
+        return {'block_height': height, 'merkle': merkle_branch(levels, pos), 'pos': pos}
+
+
+class RPCError(Exception):
+    pass
+
+
+class FakeServer(threading.Thread):
+    """Answers newline delimited JSON-RPC requests, and batches of them,
+    for one FakeChain on a TCP port of localhost.  Every response is
+    held back for its own delay, so with jitter the answers to one
+    connection can arrive out of order, as with real servers."""
+
+    def __init__(self, chain, host='127.0.0.1', port=0, latency=0.0, jitter=0.0,
+                 version='LBRYumX 0.0.0'):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.chain = chain
+        self.latency = latency
+        self.jitter = jitter
+        self.version = version
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(5)
+        self.host, self.port = self.listener.getsockname()
+        self.buffers = {}
+        # (due time, sequence number, socket, message)
+        self.outgoing = []
+        self.sequence = 0
+        self.counts = defaultdict(int)
+        self.batches = 0
+        self.connections = 0
+        self.running = True
+        self.handlers = {
+            'server.version': lambda *client_version: self.version,
+            'server.banner': lambda: 'fake lbryum server',
+            'server.peers.subscribe': lambda: [],
+            'blockchain.estimatefee': lambda blocks: 0.0001,
+            'blockchain.relayfee': lambda: 0.00001,
+            'blockchain.headers.subscribe': lambda: self.chain.header(self.chain.height),
+            'blockchain.block.get_chunk': self.chain.chunk,
+            'blockchain.block.get_header': self.chain.header,
+            'blockchain.address.subscribe': self.chain.status,
+            'blockchain.address.get_history': self.chain.history,
+            'blockchain.transaction.get': lambda tx_hash, height=None: self.chain.transactions[tx_hash],
+            'blockchain.transaction.get_merkle': lambda tx_hash, height=None: self.chain.merkle(tx_hash),
+            'blockchain.claimtrie.getvalue': lambda name, block_hash=None: self.chain.claims.get(name, {}),
+        }
+
+    @property
+    def server(self):
+        """The server string for the 'server' config option"""
+        return '%s:%d:t' % (self.host, self.port)
+
+    def request_count(self):
+        return sum(self.counts.values())
+
+    def reset_counts(self):
+        self.counts.clear()
+        self.batches = 0
+
+    def stop(self):
+        self.running = False
+        self.join()
+
+    def delay(self):
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def answer(self, request):
+        method = request.get('method')
+        self.counts[method] += 1
+        response = {'id': request.get('id'), 'jsonrpc': '2.0'}
+        handler = self.handlers.get(method)
+        try:
+            if handler is None:
+                raise RPCError('unknown method %s' % method)
+            response['result'] = handler(*request.get('params', []))
+        except (RPCError, KeyError, IndexError, TypeError, ValueError) as e:
+            response['error'] = {'code': -32601 if handler is None else -32602,
+                                 'message': str(e)}
+        return response
+
+    def handle_line(self, sock, line):
+        try:
+            message = json.loads(line)
+        except ValueError:
+            self.send(sock, {'id': None, 'error': {'code': -32700, 'message': 'parse error'}})
+            return
+        if isinstance(message, list):
+            self.batches += 1
+            self.send(sock, [self.answer(request) for request in message])
+        else:
+            self.send(sock, self.answer(message))
+
+    def send(self, sock, message):
+        self.sequence += 1
+        heapq.heappush(self.outgoing, (time.time() + self.delay(), self.sequence, sock,
+                                       json.dumps(message) + '\n'))
+
+    def flush(self):
+        now = time.time()
+        while self.outgoing and self.outgoing[0][0] <= now:
+            _, _, sock, data = heapq.heappop(self.outgoing)
+            if sock in self.buffers:
+                try:
+                    sock.sendall(data)
+                except socket.error:
+                    self.close(sock)
+
+    def close(self, sock):
+        self.buffers.pop(sock, None)
+        sock.close()
+
+    def run(self):
+        while self.running:
+            timeout = 0.1
+            if self.outgoing:
+                timeout = max(0.0, min(timeout, self.outgoing[0][0] - time.time()))
+            readable, _, _ = select.select([self.listener] + self.buffers.keys(), [], [], timeout)
+            for sock in readable:
+                if sock is self.listener:
+                    client, _ = self.listener.accept()
+                    client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self.buffers[client] = ''
+                    self.connections += 1
+                    continue
+                try:
+                    data = sock.recv(65536)
+                except socket.error:
+                    data = ''
+                if not data:
+                    self.close(sock)
+                    continue
+                lines = (self.buffers[sock] + data).split('\n')
+                self.buffers[sock] = lines.pop()
+                for line in lines:
+                    if line.strip():
+                        self.handle_line(sock, line)
+            self.flush()
+        for sock in self.buffers.keys():
+            self.close(sock)
+        self.listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fake lbryum server on a synthetic regtest chain")
+    parser.add_argument('--addresses', type=int, default=1000)
+    parser.add_argument('--blocks', type=int, default=1000)
+    parser.add_argument('--port', type=int, default=50001)
+    parser.add_argument('--latency', type=float, default=0.0, help="response delay in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random variation of the delay")
+    parser.add_argument('--dump', help="file to write the addresses and checkpoints to")
+    args = parser.parse_args()
+    chain = FakeChain(args.addresses, args.blocks)
+    server = FakeServer(chain, port=args.port, latency=args.latency, jitter=args.jitter)
+    if args.dump:
+        with open(args.dump, 'w') as f:
+            json.dump({'addresses': chain.addresses, 'checkpoints': chain.checkpoints}, f)
+    print "serving %d blocks and %d addresses on %s" % (chain.height + 1, len(chain.addresses), server.server)
+    server.start()
+    try:
+        while server.is_alive():
+            server.join(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
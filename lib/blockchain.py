@@ -18,21 +18,261 @@
 
 
 import os
+import bisect
+import mmap
+import multiprocessing
+import struct
+import urllib
+import urllib2
+from StringIO import StringIO
 import util
 from lbryum.networks import blockchain_params
 from lbryum import lbrycrd
 
 NULL_HASH = '0000000000000000000000000000000000000000000000000000000000000000'
 HEADER_SIZE = 112
+HASH_SIZE = 32
 BLOCKS_PER_CHUNK = 96
 
 HEADERS_URL = "https://s3.amazonaws.com/lbry-blockchain-headers/blockchain_headers_latest"
+HEADERS_DOWNLOAD_TIMEOUT = 30
+
+# default number of chunks between generated checkpoints, the chunks up
+# to the next checkpoint fit in the chunk download window (CHUNK_WINDOW)
+CHECKPOINT_INTERVAL = 8
+# fork headers further than this below the tip are dropped
+MAX_FORK_DEPTH = 100
+# entries in the get_target cache before it is cleared
+TARGET_CACHE_SIZE = 4096
 
 
 class ChainValidationError(Exception):
     pass
 
 
+def check_proof_of_work(job):
+    """Check the proof of work of a run of raw headers against their targets.
+    This is the unit of work of the verification pool, so it is a plain
+    module level function. Returns (height, pow hash, target) for the first
+    failing header, or None."""
+    start_height, data, targets = job
+    for i, target in enumerate(targets):
+        pow_hash = int(lbrycrd.hash_encode(lbrycrd.PoWHash(data[i * HEADER_SIZE:(i + 1) * HEADER_SIZE])), 16)
+        if pow_hash > target:
+            return start_height + i, pow_hash, target
+
+
+class Header(object):
+    """A block header decoded from its 112 byte serialization.
+
+    The raw bytes are kept so the header can be hashed without serializing
+    it again. Item access mirrors the dicts used for headers received from
+    servers, so header['bits'] and header.get('merkle_root') work for both.
+    """
+
+    FIELDS = ('version', 'prev_block_hash', 'merkle_root', 'claim_trie_root',
+              'timestamp', 'bits', 'nonce')
+    _struct = struct.Struct('<I32s32s32sIII')
+    __slots__ = ('raw', 'block_height', 'version', '_prev_block_hash', '_merkle_root',
+                 '_claim_trie_root', 'timestamp', 'bits', 'nonce')
+
+    def __init__(self, raw, block_height=None):
+        (self.version, self._prev_block_hash, self._merkle_root, self._claim_trie_root,
+         self.timestamp, self.bits, self.nonce) = self._struct.unpack(raw)
+        self.raw = raw
+        self.block_height = block_height
+
+    @property
+    def prev_block_hash(self):
+        return lbrycrd.hash_encode(self._prev_block_hash)
+
+    @property
+    def merkle_root(self):
+        return lbrycrd.hash_encode(self._merkle_root)
+
+    @property
+    def claim_trie_root(self):
+        return lbrycrd.hash_encode(self._claim_trie_root)
+
+    def keys(self):
+        if self.block_height is None:
+            return list(self.FIELDS)
+        return list(self.FIELDS) + ['block_height']
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in self.keys()]
+
+    def as_dict(self):
+        return dict(self.items())
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, key):
+        if key not in self.keys():
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        if key not in self.keys():
+            return default
+        return getattr(self, key)
+
+    def __repr__(self):
+        return 'Header(%r)' % self.as_dict()
+
+
+class BlockHashIndex(object):
+    """Block hashes by height for the headers file.
+
+    Hashes are stored as 32 raw bytes per height in path. Heights are found
+    by hash through an open addressing table in path + '.idx': a header of
+    the number of heights already indexed, the number of dead slots and the
+    stale mark, followed by slots holding height + 1 of the hash they
+    index, or 0 when free. Slots left behind by overwritten heights are
+    dead: they are skipped when looking up, count towards the load of the
+    table, and are dropped when it is rebuilt.
+
+    The stale mark is 1 + the lowest height whose stored hash may not match
+    the headers file, or 0. It is set with mark_stale() before headers are
+    overwritten and cleared by put(), so that hashes left stale by a crash
+    in between are found by LbryCrd.sync_block_hashes.
+    """
+
+    _uint = struct.Struct('<I')
+    _header = struct.Struct('<III')
+    MIN_SLOTS = 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.index_path = path + '.idx'
+        if not os.path.exists(path):
+            open(path, 'wb').close()
+        self._hashes = None
+        self._index = None
+        self._mask = 0
+        self._dead = 0
+        self._stale = 0
+        self.map_hashes()
+        self.open_index()
+
+    def __len__(self):
+        if self._hashes is None:
+            return 0
+        return len(self._hashes) / HASH_SIZE
+
+    def map_hashes(self):
+        size = os.path.getsize(self.path)
+        if size < HASH_SIZE:
+            self._hashes = None
+            return
+        with open(self.path, 'rb') as f:
+            self._hashes = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+    def open_index(self):
+        size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        slots = (size - self._header.size) / 4
+        if slots < self.MIN_SLOTS or slots & (slots - 1):
+            return self.rebuild_index()
+        with open(self.index_path, 'rb+') as f:
+            self._index = mmap.mmap(f.fileno(), size)
+        self._mask = slots - 1
+        indexed, self._dead, self._stale = self._header.unpack_from(self._index, 0)
+        if indexed > len(self) or self.overloaded():
+            return self.rebuild_index()
+        self.index_heights(indexed)
+
+    def overloaded(self):
+        return 2 * (len(self) + self._dead) > self._mask + 1
+
+    def rebuild_index(self):
+        slots = self.MIN_SLOTS
+        while slots < 4 * len(self):
+            slots *= 2
+        if self._index is not None:
+            self._index.close()
+        size = self._header.size + 4 * slots
+        with open(self.index_path, 'wb+') as f:
+            f.truncate(size)
+            self._index = mmap.mmap(f.fileno(), size)
+        self._mask = slots - 1
+        self._dead = 0
+        self.index_heights(0)
+
+    def index_heights(self, start):
+        index, mask = self._index, self._mask
+        indexed = self._header.unpack_from(index, 0)[0]
+        base = self._header.size
+        for height in range(start, len(self)):
+            block_hash = self.get(height)
+            slot = self._uint.unpack_from(block_hash, 0)[0] & mask
+            while True:
+                entry = self._uint.unpack_from(index, base + 4 * slot)[0]
+                if entry == 0 or entry == height + 1:
+                    break
+                slot = (slot + 1) & mask
+            if entry == 0 and height < indexed:
+                # the slot of the hash this one replaces is left behind
+                self._dead += 1
+            self._uint.pack_into(index, base + 4 * slot, height + 1)
+        self._header.pack_into(index, 0, len(self), self._dead, self._stale)
+
+    def get(self, height):
+        """Raw hash of the block at height"""
+        hashes = self._hashes
+        if hashes is not None and 0 <= height and (height + 1) * HASH_SIZE <= len(hashes):
+            return hashes[height * HASH_SIZE:(height + 1) * HASH_SIZE]
+
+    def height_of(self, block_hash):
+        """Height of the block with the given raw hash, or None"""
+        index, mask = self._index, self._mask
+        base = self._header.size
+        slot = self._uint.unpack_from(block_hash, 0)[0] & mask
+        while True:
+            entry = self._uint.unpack_from(index, base + 4 * slot)[0]
+            if entry == 0:
+                return
+            if self.get(entry - 1) == block_hash:
+                return entry - 1
+            slot = (slot + 1) & mask
+
+    def put(self, height, block_hashes):
+        """Store a run of raw hashes starting at height, and clear the
+        stale mark"""
+        with open(self.path, 'rb+') as f:
+            f.seek(height * HASH_SIZE)
+            f.write(''.join(block_hashes))
+        self.map_hashes()
+        self._stale = 0
+        if self.overloaded():
+            return self.rebuild_index()
+        self.index_heights(min(height, self._header.unpack_from(self._index, 0)[0]))
+        # overwritten heights may have left enough dead slots to rebuild
+        if self.overloaded():
+            self.rebuild_index()
+
+    def mark_stale(self, height):
+        """Record that the hashes from height on are about to be replaced"""
+        if height < len(self):
+            self._stale = height + 1
+            self._header.pack_into(self._index, 0, self._header.unpack_from(self._index, 0)[0],
+                                   self._dead, self._stale)
+
+    def stale_height(self):
+        """Lowest height whose hash may be stale, or None"""
+        if self._stale:
+            return self._stale - 1
+
+    def truncate(self, count):
+        with open(self.path, 'rb+') as f:
+            f.truncate(count * HASH_SIZE)
+        self.map_hashes()
+        self.rebuild_index()
+
+
 class LbryCrd(util.PrintError):
     """Manages blockchain headers and their verification"""
 
@@ -41,15 +281,33 @@ class LbryCrd(util.PrintError):
     def __init__(self, config, network):
         self.config = config
         self.network = network
-        self.headers_url = HEADERS_URL
+        self.headers_url = config.get('headers_url', HEADERS_URL)
         self.local_height = 0
+        # read-only view of the headers file, remapped whenever it grows
+        self._headers_map = None
         self.set_local_height()
+        self.block_hashes = BlockHashIndex(os.path.join(config.path, 'blockchain_hashes'))
+        self.sync_block_hashes()
         self.retrieving_headers = False
+        self._verification_pool = None
+        self._verification_workers = 0
 
         self._MAX_TARGET = blockchain_params[self.BLOCKCHAIN_NAME]['max_target']
         self._N_TARGET_TIMESPAN = blockchain_params[self.BLOCKCHAIN_NAME]['target_timespan']
         self._GENESIS_BITS = blockchain_params[self.BLOCKCHAIN_NAME]['genesis_bits']
 
+        # checkpoints from the config replace the built in ones
+        checkpoints = config.get('checkpoints', blockchain_params[self.BLOCKCHAIN_NAME]['checkpoints'])
+        self.checkpoints = {int(h): (str(block_hash), int(bits)) for h, block_hash, bits in checkpoints}
+        self.checkpoint_heights = sorted(self.checkpoints)
+        self.checkpoint_sync = config.get('checkpoint_sync', True)
+        # 'none' leaves flushing header writes to the OS, 'fsync' syncs each batch
+        self.headers_durability = config.get('headers_durability', 'none')
+        # headers of competing branches by hash, see save_chain
+        self.fork_headers = {}
+        # (bits, modulated timespan) -> (bits, target), see get_target
+        self._target_cache = {}
+
     @property
     def MAX_TARGET(self):
         return self._MAX_TARGET
@@ -68,14 +326,18 @@ class LbryCrd(util.PrintError):
     def init(self):
         self.init_headers_file()
         self.set_local_height()
+        self.sync_block_hashes()
         self.print_error("%d blocks" % self.local_height)
 
-    def verify_header(self, header, prev_header, bits, target):
+    def verify_header_link(self, header, prev_header, bits):
         prev_hash = self.hash_header(prev_header)
         assert prev_hash == header.get('prev_block_hash'), "prev hash mismatch: %s vs %s" % (
             prev_hash, header.get('prev_block_hash'))
         assert bits == header.get('bits'), "bits mismatch: %s vs %s (hash: %s)" % (
             bits, header.get('bits'), self.hash_header(header))
+
+    def verify_header(self, header, prev_header, bits, target):
+        self.verify_header_link(header, prev_header, bits)
         _pow_hash = self.pow_hash_header(header)
         assert int('0x' + _pow_hash, 16) <= target, "insufficient proof of work: %s vs target %s" % (
         int('0x' + _pow_hash, 16), target)
@@ -84,24 +346,116 @@ class LbryCrd(util.PrintError):
         first_header = chain[0]
         height = first_header['block_height']
         prev_header = self.read_header(height - 1)
+        checkpoint_height = self.get_checkpoint_height(height, chain[-1]['block_height'])
         for header in chain:
             height = header['block_height']
-            if self.read_header(height) is not None:
+            if height <= checkpoint_height:
+                self.verify_header_link(header, prev_header, header.get('bits'))
+                self.verify_checkpoint(header)
+            elif self.read_header(height) is not None:
                 bits, target = self.get_target(height, prev_header, header)
                 self.verify_header(header, prev_header, bits, target)
             prev_header = header
 
+    def get_checkpoint_height(self, start_height, end_height):
+        """Height of the last checkpoint from start_height to end_height.
+        The checkpoint hash commits to every header below it, so a run of
+        headers reaching it is only checked for hash linkage, the headers
+        above it get the full proof of work check. Returns -1 if the run
+        reaches no checkpoint or checkpoint sync is disabled."""
+        if not self.checkpoint_sync:
+            return -1
+        i = bisect.bisect_right(self.checkpoint_heights, end_height)
+        if i and self.checkpoint_heights[i - 1] >= start_height:
+            return self.checkpoint_heights[i - 1]
+        return -1
+
+    def get_next_checkpoint_height(self, height):
+        """Height of the first checkpoint above height, or None"""
+        if not self.checkpoint_sync:
+            return None
+        i = bisect.bisect_right(self.checkpoint_heights, height)
+        if i < len(self.checkpoint_heights):
+            return self.checkpoint_heights[i]
+
+    def verify_checkpoint(self, header):
+        height = header.get('block_height')
+        checkpoint = self.checkpoints.get(height)
+        if checkpoint is not None:
+            block_hash, bits = checkpoint
+            _hash = self.hash_header(header)
+            assert _hash == block_hash, "checkpoint mismatch at height %d: %s vs %s" % (
+                height, _hash, block_hash)
+            assert bits == header.get('bits'), "checkpoint bits mismatch at height %d: %s vs %s" % (
+                height, header.get('bits'), bits)
+
     def verify_chunk(self, index, data):
+        self.verify_chunks(index, data)
+
+    def verify_chunks(self, index, data):
+        """Verify one or more consecutive chunks of headers starting at chunk
+        index. The hash and bits linkage is checked in a single sequential
+        pass, the proof of work of every header is checked afterwards and
+        is spread over the verification pool if one is configured.
+
+        Headers up to the last checkpoint in data are only checked for
+        linkage and against the checkpoints themselves."""
+        if not data or len(data) % HEADER_SIZE:
+            raise ChainValidationError("Chunk data is not a whole number of headers")
+        start_height = index * BLOCKS_PER_CHUNK
+        checkpoint_height = self.get_checkpoint_height(start_height, start_height + len(data) / HEADER_SIZE - 1)
         prev_header = None
         if index != 0:
-            prev_header = self.read_header(index * BLOCKS_PER_CHUNK - 1)
-        for i in range(BLOCKS_PER_CHUNK):
+            prev_header = self.read_header(start_height - 1)
+        targets = []
+        for i in range(len(data) / HEADER_SIZE):
+            height = start_height + i
             raw_header = data[i * HEADER_SIZE:(i + 1) * HEADER_SIZE]
-            header = self.deserialize_header(raw_header)
-            bits, target = self.get_target(index * BLOCKS_PER_CHUNK + i, prev_header, header)
-            if header is not None:
-                self.verify_header(header, prev_header, bits, target)
+            header = self.deserialize_header(raw_header, height)
+            if height <= checkpoint_height:
+                self.verify_header_link(header, prev_header, header.get('bits'))
+                self.verify_checkpoint(header)
+            else:
+                bits, target = self.get_target(height, prev_header, header)
+                self.verify_header_link(header, prev_header, bits)
+                targets.append(target)
             prev_header = header
+        if targets:
+            skipped = len(data) / HEADER_SIZE - len(targets)
+            self.verify_proof_of_work(start_height + skipped, data[skipped * HEADER_SIZE:], targets)
+
+    def get_verification_pool(self):
+        """Returns the process pool used for proof of work checks, or None if
+        verification_workers is not set and they should run in-process."""
+        workers = int(self.config.get('verification_workers', 0))
+        if workers < 2:
+            return None
+        if self._verification_pool is None:
+            self.print_error("starting %d verification workers" % workers)
+            self._verification_pool = multiprocessing.Pool(workers)
+            self._verification_workers = workers
+        return self._verification_pool
+
+    def close(self):
+        if self._verification_pool is not None:
+            self._verification_pool.terminate()
+            self._verification_pool = None
+
+    def verify_proof_of_work(self, start_height, data, targets):
+        pool = self.get_verification_pool()
+        if pool is None:
+            failures = [check_proof_of_work((start_height, data, targets))]
+        else:
+            # one chunk is split over all workers, larger batches go one chunk per job
+            step = min(BLOCKS_PER_CHUNK, -(-len(targets) // self._verification_workers))
+            jobs = [(start_height + i, data[i * HEADER_SIZE:(i + step) * HEADER_SIZE], targets[i:i + step])
+                    for i in range(0, len(targets), step)]
+            failures = pool.map(check_proof_of_work, jobs)
+        for failure in failures:
+            if failure is not None:
+                height, pow_hash, target = failure
+                raise ChainValidationError("insufficient proof of work at height %d: %s vs target %s" % (
+                    height, pow_hash, target))
 
     def get_block_hash(self, header):
         block_hash = header.get('prev_block_hash')
@@ -122,88 +476,202 @@ class LbryCrd(util.PrintError):
 
         return s
 
-    def deserialize_header(self, s):
-        hex_to_int = lambda s: int('0x' + s[::-1].encode('hex'), 16)
-        h = {}
-        h['version'] = hex_to_int(s[0:4])
-        h['prev_block_hash'] = lbrycrd.hash_encode(s[4:36])
-        h['merkle_root'] = lbrycrd.hash_encode(s[36:68])
-        h['claim_trie_root'] = lbrycrd.hash_encode(s[68:100])
-        h['timestamp'] = hex_to_int(s[100:104])
-        h['bits'] = hex_to_int(s[104:108])
-        h['nonce'] = hex_to_int(s[108:112])
-        return h
+    def deserialize_header(self, s, block_height=None):
+        return Header(s, block_height)
+
+    def raw_header(self, header):
+        if isinstance(header, Header):
+            return header.raw
+        return self.serialize_header(header).decode('hex')
 
     def hash_header(self, header):
         if header is None:
             return '0' * 64
-        return lbrycrd.hash_encode(lbrycrd.Hash(self.serialize_header(header).decode('hex')))
+        return lbrycrd.hash_encode(lbrycrd.Hash(self.raw_header(header)))
 
     def pow_hash_header(self, header):
         if header is None:
             return '0' * 64
-        return lbrycrd.hash_encode(lbrycrd.PoWHash(self.serialize_header(header).decode('hex')))
+        return lbrycrd.hash_encode(lbrycrd.PoWHash(self.raw_header(header)))
 
     def path(self):
         return os.path.join(self.config.path, 'blockchain_headers')
 
     def init_headers_file(self):
+        """Bootstrap the headers file from headers_url. A marker file is kept
+        while the download is incomplete, so an interrupted download is
+        resumed on the next start instead of syncing the rest over the wire."""
         filename = self.path()
-        if os.path.exists(filename):
+        marker = filename + '.download'
+        if os.path.exists(filename) and not os.path.exists(marker):
             return
+        if not os.path.exists(filename):
+            open(filename, 'wb+').close()
+        open(marker, 'w').close()
+        self.set_local_height()
+        self.print_error("downloading ", self.headers_url)
+        self.retrieving_headers = True
         try:
-            import urllib, socket
-            socket.setdefaulttimeout(30)
-            self.print_error("downloading ", self.headers_url)
-            self.retrieving_headers = True
-            try:
-                urllib.urlretrieve(self.headers_url, filename)
-            except:
-                raise
-            finally:
-                self.retrieving_headers = False
+            self.download_headers(self.headers_url)
+            os.unlink(marker)
             self.print_error("done.")
-        except Exception:
-            self.print_error("download failed. creating file", filename)
-            open(filename, 'wb+').close()
+        except Exception as e:
+            self.print_error("download failed, will resume at %d blocks:" % (self.local_height + 1), e)
+        finally:
+            self.retrieving_headers = False
+
+    def open_headers_source(self, url, offset):
+        """Returns a file like object reading url from offset"""
+        if url.startswith('file://'):
+            f = open(urllib.url2pathname(url[len('file://'):]), 'rb')
+            f.seek(offset)
+            return f
+        request = urllib2.Request(url)
+        if offset:
+            request.add_header('Range', 'bytes=%d-' % offset)
+        try:
+            response = urllib2.urlopen(request, timeout=HEADERS_DOWNLOAD_TIMEOUT)
+        except urllib2.HTTPError as e:
+            if e.code == 416:
+                # we already have everything
+                return StringIO()
+            raise
+        if offset and response.getcode() != 206:
+            # the server ignored the range, skip what we already have
+            while offset:
+                skipped = len(response.read(min(offset, 1024 * 1024)))
+                if not skipped:
+                    break
+                offset -= skipped
+        return response
+
+    def download_headers(self, url):
+        """Streams headers from url, verifying and saving them after the last
+        complete chunk already stored, up to the next checkpoint or one
+        chunk at a time past the last one. Stops at the first run that does
+        not verify, the rest is synced from servers."""
+        chunk_size = BLOCKS_PER_CHUNK * HEADER_SIZE
+        idx = (self.local_height + 1) / BLOCKS_PER_CHUNK
+        stream = self.open_headers_source(url, idx * chunk_size)
+        try:
+            while True:
+                count = 1
+                checkpoint_height = self.get_next_checkpoint_height(idx * BLOCKS_PER_CHUNK - 1)
+                if checkpoint_height is not None:
+                    count = checkpoint_height / BLOCKS_PER_CHUNK - idx + 1
+                data = stream.read(count * chunk_size)
+                data = data[:len(data) - len(data) % HEADER_SIZE]
+                if not data:
+                    break
+                try:
+                    self.verify_chunks(idx, data)
+                except BaseException as e:
+                    self.print_error("downloaded chunk %d does not verify:" % idx, e)
+                    break
+                self.save_chunk(idx, data)
+                if len(data) < count * chunk_size:
+                    break
+                idx += count
+        finally:
+            stream.close()
 
     def save_chunk(self, index, chunk):
-        filename = self.path()
-        f = open(filename, 'rb+')
-        f.seek(index * BLOCKS_PER_CHUNK * HEADER_SIZE)
-        h = f.write(chunk)
-        f.close()
-        self.set_local_height()
+        self.write_headers(index * BLOCKS_PER_CHUNK, chunk)
 
     def save_header(self, header):
-        data = self.serialize_header(header).decode('hex')
-        if not len(data) == HEADER_SIZE:
+        self.save_headers([header])
+
+    def save_headers(self, headers):
+        """Save a run of headers with consecutive heights in one write"""
+        data = ''.join(self.raw_header(header) for header in headers)
+        if len(data) != len(headers) * HEADER_SIZE:
             raise ChainValidationError("Header is wrong size")
-        height = header.get('block_height')
-        filename = self.path()
-        f = open(filename, 'rb+')
-        f.seek(height * HEADER_SIZE)
-        h = f.write(data)
-        f.close()
+        self.write_headers(headers[0].get('block_height'), data)
+
+    def write_headers(self, height, data):
+        """Write raw headers starting at height with a single write call,
+        then update the local height and the block hash index once. With
+        the 'fsync' headers_durability policy the write is flushed to disk
+        before returning."""
+        # hashes of overwritten headers are stale until the put below
+        self.block_hashes.mark_stale(height)
+        fd = os.open(self.path(), os.O_WRONLY)
+        try:
+            os.lseek(fd, height * HEADER_SIZE, os.SEEK_SET)
+            written = 0
+            while written < len(data):
+                written += os.write(fd, data[written:])
+            if self.headers_durability == 'fsync':
+                os.fsync(fd)
+        finally:
+            os.close(fd)
         self.set_local_height()
+        self.block_hashes.put(height, [lbrycrd.Hash(data[i:i + HEADER_SIZE])
+                                       for i in range(0, len(data), HEADER_SIZE)])
+
+    def sync_block_hashes(self):
+        """Bring the block hash index in line with the headers file, for
+        headers files written by older versions, a missing index, or a
+        crash between overwriting headers and updating their hashes."""
+        count = len(self._headers_map) / HEADER_SIZE if self._headers_map is not None else 0
+        if len(self.block_hashes) > count:
+            self.block_hashes.truncate(count)
+        stale = self.block_hashes.stale_height()
+        if stale is not None:
+            end = len(self.block_hashes)
+            self.print_error("checking block hashes from height %d" % stale)
+            self.block_hashes.put(stale, [lbrycrd.Hash(self.read_raw_header(h)) for h in range(stale, end)])
+        for height in range(len(self.block_hashes), count, BLOCKS_PER_CHUNK):
+            run = [lbrycrd.Hash(self.read_raw_header(h)) for h in range(height, min(count, height + BLOCKS_PER_CHUNK))]
+            self.block_hashes.put(height, run)
+
+    def get_block_hash_at(self, height):
+        """Hash of the stored block at height, read from the index"""
+        block_hash = self.block_hashes.get(height)
+        if block_hash is not None:
+            return lbrycrd.hash_encode(block_hash)
+
+    def get_height_of_block(self, block_hash):
+        """Height of the stored block with the given hash, or None"""
+        try:
+            raw_hash = lbrycrd.hash_decode(block_hash)
+        except (TypeError, ValueError):
+            return
+        if len(raw_hash) == HASH_SIZE:
+            return self.block_hashes.height_of(raw_hash)
 
     def set_local_height(self):
         name = self.path()
         if os.path.exists(name):
-            h = os.path.getsize(name) / HEADER_SIZE - 1
+            size = os.path.getsize(name)
+            h = size / HEADER_SIZE - 1
             if self.local_height != h:
                 self.local_height = h
+            if self._headers_map is None or len(self._headers_map) != size:
+                self.map_headers(size)
+
+    def map_headers(self, size):
+        """Map the headers file into memory so that reading a header does not
+        need any file system calls. Readers hold their own reference to the
+        old map, so it is left to be closed by the garbage collector."""
+        if size < HEADER_SIZE:
+            self._headers_map = None
+            return
+        with open(self.path(), 'rb') as f:
+            self._headers_map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+
+    def read_raw_header(self, block_height):
+        headers_map = self._headers_map
+        if headers_map is None or block_height < 0:
+            return
+        offset = block_height * HEADER_SIZE
+        if offset + HEADER_SIZE <= len(headers_map):
+            return headers_map[offset:offset + HEADER_SIZE]
 
     def read_header(self, block_height):
-        name = self.path()
-        if os.path.exists(name):
-            f = open(name, 'rb')
-            f.seek(block_height * HEADER_SIZE)
-            h = f.read(HEADER_SIZE)
-            f.close()
-            if len(h) == HEADER_SIZE:
-                h = self.deserialize_header(h)
-                return h
+        h = self.read_raw_header(block_height)
+        if h is not None:
+            return self.deserialize_header(h, block_height)
 
     def get_target(self, index, first, last, chain='main'):
         """
@@ -229,15 +697,23 @@ class LbryCrd(util.PrintError):
         elif nModulatedTimespan > nMaxTimespan:
             nModulatedTimespan = nMaxTimespan
 
-        bnOld = ArithUint256.SetCompact(bits)
-        bnNew = bnOld * nModulatedTimespan
-        # this doesn't work if it is nTargetTimespan even though that
-        # is what it looks like it should be based on reading the code
-        # in lbry.cpp
-        bnNew /= nModulatedTimespan
-        if bnNew > self.MAX_TARGET:
-            bnNew = ArithUint256(self.MAX_TARGET)
-        return bnNew.GetCompact(), bnNew._value
+        # the result only depends on these, so a run of headers with
+        # unchanged bits is a dict lookup
+        key = (bits, nModulatedTimespan)
+        result = self._target_cache.get(key)
+        if result is None:
+            # bnOld * nModulatedTimespan / nModulatedTimespan, modulo 2**256
+            # this doesn't work if it is nTargetTimespan even though that
+            # is what it looks like it should be based on reading the code
+            # in lbry.cpp
+            target = (ArithUint256.fromCompact(bits) * nModulatedTimespan % 2 ** 256) // nModulatedTimespan
+            if target > self.MAX_TARGET:
+                target = self.MAX_TARGET
+            result = (ArithUint256(target).GetCompact(), target)
+            if len(self._target_cache) >= TARGET_CACHE_SIZE:
+                self._target_cache.clear()
+            self._target_cache[key] = result
+        return result
 
     def connect_header(self, chain, header):
         '''Builds a header chain until it connects.  Returns True if it has
@@ -251,30 +727,77 @@ class LbryCrd(util.PrintError):
         return self.save_chain(chain, height)
 
     def save_chain(self, chain, height):
+        """Verify a chain of headers that connects to the main chain, directly
+        or through a stored fork. The branch it completes becomes the main
+        chain if it has more work than the main chain above the fork point,
+        otherwise it is kept as a fork."""
         # Reverse to order by increasing height
         chain.reverse()
         try:
-            self.verify_chain(chain)
+            branch = self.get_branch(chain)
+            self.verify_chain(branch)
             self.print_error("connected at height:", height)
-            for header in chain:
-                self.save_header(header)
+            fork_height = branch[0]['block_height'] - 1
+            tip_height = branch[-1]['block_height']
+            main_work = sum(get_work(self.read_header(h)['bits'])
+                            for h in range(fork_height + 1, self.local_height + 1))
+            branch_work = sum(get_work(header['bits']) for header in branch)
+            # a branch is only switched to once it reaches our tip, so the
+            # headers file never has to be truncated under readers of its map
+            if branch_work <= main_work or tip_height < self.local_height:
+                self.add_fork_headers(branch)
+                return True
+            replaced = [self.read_header(h) for h in range(fork_height + 1, self.local_height + 1)]
+            for header in branch:
+                self.fork_headers.pop(self.hash_header(header), None)
+            self.save_headers(branch)
+            if replaced:
+                self.print_error("reorg at height %d, %d blocks replaced" % (fork_height + 1, len(replaced)))
+                self.add_fork_headers(replaced)
+                if self.network:
+                    self.network.trigger_callback('reorg', fork_height + 1)
             return True
         except BaseException as e:
             self.print_error(str(e))
             return False
 
+    def get_branch(self, chain):
+        """Extend chain downwards with the stored fork headers it builds on,
+        so that the result connects to the main chain."""
+        branch = list(chain)
+        while True:
+            first = branch[0]
+            if first['block_height'] == 0 or \
+                    self.get_block_hash_at(first['block_height'] - 1) == first.get('prev_block_hash'):
+                return branch
+            prev = self.fork_headers.get(first.get('prev_block_hash'))
+            if prev is None:
+                raise ChainValidationError("chain does not connect at height %d" % first['block_height'])
+            branch.insert(0, prev)
+
+    def add_fork_headers(self, headers):
+        for header in headers:
+            self.fork_headers[self.hash_header(header)] = header
+        # forget forks too deep to ever be switched to
+        min_height = self.local_height - MAX_FORK_DEPTH
+        for block_hash, header in self.fork_headers.items():
+            if header['block_height'] < min_height:
+                del self.fork_headers[block_hash]
+
     def need_previous(self, header):
         """Return True if we're missing the block before the one we just got"""
         previous_height = header['block_height'] - 1
-        previous_header = self.read_header(previous_height)
+        prev_hash = self.get_block_hash_at(previous_height)
+        # Does it connect to my chain or to a fork of it?
+        if prev_hash == header.get('prev_block_hash'):
+            return False
+        if header.get('prev_block_hash') in self.fork_headers:
+            return False
         # Missing header, request it
-        if not previous_header:
-            return True
-        # Does it connect to my chain?
-        prev_hash = self.hash_header(previous_header)
-        if prev_hash != header.get('prev_block_hash'):
-            self.print_error("reorg")
+        if not prev_hash:
             return True
+        self.print_error("reorg")
+        return True
 
     def connect_chunk(self, idx, hexdata):
         try:
@@ -287,6 +810,23 @@ class LbryCrd(util.PrintError):
             self.print_error('verify_chunk failed', str(e))
             return idx - 1
 
+    def connect_chunks(self, idx, hexchunks):
+        '''Verifies and saves a run of consecutive chunks starting at idx as a
+        single batch.  Every chunk but the last must be complete.  Returns
+        True if all of them were connected.'''
+        try:
+            for hexdata in hexchunks[:-1]:
+                if len(hexdata) != BLOCKS_PER_CHUNK * HEADER_SIZE * 2:
+                    raise ChainValidationError("Incomplete chunk")
+            data = ''.join(hexchunks).decode('hex')
+            self.verify_chunks(idx, data)
+            self.print_error("validated chunks %d to %d" % (idx, idx + len(hexchunks) - 1))
+            self.save_chunk(idx, data)
+            return True
+        except BaseException as e:
+            self.print_error('verify_chunks failed', str(e))
+            return False
+
     def check_bits(self, bits):
         bitsN = (bits >> 24) & 0xff
         assert 0x03 <= bitsN <= 0x1f, \
@@ -307,6 +847,29 @@ class LbryCrdReg(LbryCrd):
         pass
 
 
+def get_work(bits):
+    """Expected number of hashes to find a block with the given bits"""
+    return 2 ** 256 // (ArithUint256.fromCompact(bits) + 1)
+
+
+def make_checkpoints(headers_path, interval=CHECKPOINT_INTERVAL):
+    """Build a checkpoint table from a trusted headers file. Checkpoints are
+    placed on the genesis block and on the last header of every interval-th
+    chunk, so that a checkpointed sync always ends on a chunk boundary."""
+    checkpoints = []
+    step = interval * BLOCKS_PER_CHUNK
+    with open(headers_path, 'rb') as f:
+        headers_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        count = len(headers_map) / HEADER_SIZE
+        for height in [0] + range(step - 1, count, step):
+            header = Header(headers_map[height * HEADER_SIZE:(height + 1) * HEADER_SIZE], height)
+            checkpoints.append((height, lbrycrd.hash_encode(lbrycrd.Hash(header.raw)), header.bits))
+    finally:
+        headers_map.close()
+    return checkpoints
+
+
 def get_blockchain(config, network):
     chain = config.get('chain', 'lbrycrd_main')
 
@@ -353,25 +916,19 @@ class ArithUint256(object):
         return cls(ArithUint256.fromCompact(nCompact))
 
     def bits(self):
-        """Returns the position of the highest bit set plus one."""
-        bn = bin(self._value)[2:]
-        for i, d in enumerate(bn):
-            if d:
-                return (len(bn) - i) + 1
-        return 0
+        """Returns the number of significant bits of the value, 0 for zero."""
+        return self._value.bit_length()
 
     def GetLow64(self):
         return self._value & 0xffffffffffffffff
 
     def GetCompact(self):
         """Convert a value into its compact representation"""
-        nSize = (self.bits() + 7) // 8
-        nCompact = 0
+        nSize = (self._value.bit_length() + 7) // 8
         if nSize <= 3:
-            nCompact = self.GetLow64() << 8 * (3 - nSize)
+            nCompact = (self._value << 8 * (3 - nSize)) & 0xffffffffffffffff
         else:
-            bn = ArithUint256(self._value >> 8 * (nSize - 3))
-            nCompact = bn.GetLow64()
+            nCompact = (self._value >> 8 * (nSize - 3)) & 0xffffffffffffffff
         # The 0x00800000 bit denotes the sign.
         # Thus, if it is already set, divide the mantissa by 256 and increase the exponent.
         if nCompact & 0x00800000:
@@ -0,0 +1,141 @@
+import os
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+
+import util
+
+log = logging.getLogger(__name__)
+
+
+class ResponseCache(object):
+    """Size bounded LRU cache of server results that never change.
+
+    Results are kept encoded as JSON, so every lookup hands out a fresh
+    object that callers may modify.  With a directory, entries are also
+    written to disk, one file per entry named by the SHA-256 of its key
+    and spread over 256 sub-directories.  Entries evicted from memory
+    are reloaded from disk, and the directory is trimmed to disk_size
+    bytes by dropping the least recently used files.
+    """
+
+    def __init__(self, path=None, size=8 << 20, disk_size=64 << 20):
+        self.path = path
+        self.max_size = size
+        self.max_disk_size = disk_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.disk_usage = 0
+        self.hits = 0
+        self.misses = 0
+        if path is not None:
+            if not os.path.exists(path):
+                os.makedirs(path)
+            self.disk_usage = sum(size for _, size, _ in self.disk_files())
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def key(method, params):
+        return '%s:%s' % (method, json.dumps(params))
+
+    def get(self, key):
+        """The cached result for key, or None"""
+        data = self.entries.pop(key, None)
+        if data is None and self.path is not None:
+            data = self.read(key)
+        if data is None:
+            self.misses += 1
+            return
+        self.hits += 1
+        self.remember(key, data)
+        return util.get_json_codec().loads(data)
+
+    def put(self, key, result):
+        if key in self.entries:
+            return
+        data = util.get_json_codec().dumps(result)
+        self.remember(key, data)
+        if self.path is not None:
+            self.write(key, data)
+
+    def remember(self, key, data):
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_size and self.entries:
+            _, old = self.entries.popitem(last=False)
+            self.size -= len(old)
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.entries),
+            'size': self.size,
+            'disk_size': self.disk_usage,
+        }
+
+    def file_path(self, key):
+        name = hashlib.sha256(key).hexdigest()
+        return os.path.join(self.path, name[:2], name)
+
+    def read(self, key):
+        path = self.file_path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, data = f.read().split('\n', 1)
+            # mark as recently used for trim_disk
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return
+        if stored_key == key:
+            return data
+
+    def write(self, key, data):
+        path = self.file_path(key)
+        if os.path.exists(path):
+            return
+        directory = os.path.dirname(path)
+        tmp_path = path + '.tmp'
+        try:
+            if not os.path.exists(directory):
+                os.mkdir(directory)
+            with open(tmp_path, 'wb') as f:
+                f.write(key + '\n' + data)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            log.warning("cannot write response cache entry: %s", e)
+            return
+        self.disk_usage += len(key) + 1 + len(data)
+        if self.disk_usage > self.max_disk_size:
+            self.trim_disk()
+
+    def disk_files(self):
+        """(mtime, size, path) of the entries on disk"""
+        for directory, _, names in os.walk(self.path):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def trim_disk(self):
+        """Remove least recently used files until the directory is back
+        under 90% of its limit, so that trimming is not repeated on every
+        write"""
+        target = self.max_disk_size * 9 / 10
+        usage = 0
+        files = sorted(self.disk_files(), reverse=True)
+        for mtime, size, path in files:
+            if usage + size > target:
+                try:
+                    os.remove(path)
+                    continue
+                except OSError:
+                    pass
+            usage += size
+        self.disk_usage = usage
@@ -49,6 +49,7 @@ import paymentrequest
 from paymentrequest import PR_PAID, PR_UNPAID, PR_UNKNOWN, PR_EXPIRED
 import contacts
 from claims import verify_proof, InvalidProofError
+from blockchain import make_checkpoints, CHECKPOINT_INTERVAL
 
 
 log = logging.getLogger(__name__)
@@ -56,6 +57,9 @@ log = logging.getLogger(__name__)
 known_commands = {}
 ADDRESS_LENGTH = 25
 MAX_PAGE_SIZE = 500
+# getclaimsbyids queries sent at once while paging through a channel, the
+# first window holds one query and each further window twice as many
+MAX_CHANNEL_QUERY_WINDOW = 16
 
 # Format output from lbrycrd to have consistently
 # named ditionary keys
@@ -776,7 +780,8 @@ class Commands:
             return True, certificate_claim['name']
         return False, None
 
-    def parse_and_validate_claim_result(self, claim_result, certificate=None, raw=False):
+    def parse_and_validate_claim_result(self, claim_result, certificate=None, raw=False,
+                                        certificates=None):
         if not claim_result or 'value' not in claim_result:
             return claim_result
 
@@ -795,6 +800,8 @@ class Commands:
         if decoded:
             claim_result['has_signature'] = False
             if decoded.has_signature:
+                if certificate is None and certificates:
+                    certificate = certificates.get(decoded.certificate_id)
                 if certificate is None:
                     print_msg("fetching certificate to check claim signature")
                     cached_certificate = self.getcachedcertificate()
@@ -819,6 +826,29 @@ class Commands:
 
         return claim_result
 
+    def prefetch_certificates(self, claim_results):
+        """Fetch the certificates of the signed claims among claim_results
+        at once, for parse_and_validate_claim_result.  Returns them by
+        claim id."""
+        certificate_ids = set()
+        for claim_result in claim_results:
+            if not claim_result or 'value' not in claim_result:
+                continue
+            try:
+                decoded = smart_decode(claim_result['value'])
+            except DecodeError:
+                continue
+            if decoded.has_signature:
+                certificate_ids.add(decoded.certificate_id)
+        certificate_ids = sorted(certificate_ids)
+        results = self.network.synchronous_get_many([('blockchain.claimtrie.getclaimbyid', [claim_id])
+                                                     for claim_id in certificate_ids])
+        certificates = {}
+        for claim_id, result in zip(certificate_ids, results):
+            if result:
+                certificates[claim_id] = self.parse_and_validate_claim_result(format_amount_value(result))
+        return certificates
+
     @staticmethod
     def _validate_signed_claim(claim, claim_address, certificate):
         assert claim.has_signature, "Claim is not signed"
@@ -926,7 +956,7 @@ class Commands:
 
         height = self.network.get_local_height() - RECOMMENDED_CLAIMTRIE_HASH_CONFIRMS + 1
         block_header = self.network.blockchain.read_header(height)
-        block_hash = self.network.blockchain.hash_header(block_header)
+        block_hash = self.network.blockchain.get_block_hash_at(height)
         response = self.requestvalueforname(name, block_hash)
         height, depth = None, None
         if response and 'height' in response:
@@ -1024,9 +1054,21 @@ class Commands:
         # processed them.
         # TODO: fix ^ in lbryschema
 
+        def iter_batch_results():
+            # most pages are filled by the first query, later queries are
+            # sent in growing windows
+            start, window = 0, 1
+            while start < len(queries):
+                batch = queries[start:start + window]
+                results = self.network.synchronous_get_many([("blockchain.claimtrie.getclaimsbyids", claim_ids)
+                                                             for claim_ids in batch])
+                for item in zip(batch, results):
+                    yield item
+                start += window
+                window = min(2 * window, MAX_CHANNEL_QUERY_WINDOW)
+
         def iter_validate_channel_claims():
-            for claim_ids in queries:
-                batch_result = self.network.synchronous_get(("blockchain.claimtrie.getclaimsbyids", claim_ids))
+            for claim_ids, batch_result in iter_batch_results():
                 for claim_id in claim_ids:
                     claim = batch_result[claim_id]
                     if claim['name'] == claim_names[claim_id]:
@@ -1068,7 +1110,7 @@ class Commands:
         return next(page_generator), upper_bound
 
     def _handle_resolve_uri_response(self, parsed_uri, block_header, raw, resolution, page=0,
-                                     page_size=10):
+                                     page_size=10, certificates=None):
         result = {}
         # parse an included certificate
         if 'certificate' in resolution:
@@ -1123,15 +1165,18 @@ class Commands:
                                                                 height, depth)
                     result['claim'] = self.parse_and_validate_claim_result(claim_result,
                                                                            certificate,
-                                                                           raw)
+                                                                           raw,
+                                                                           certificates)
             elif claim_resolution_type == "claim_id":
                 result['claim'] = self.parse_and_validate_claim_result(claim_response,
                                                                        certificate,
-                                                                       raw)
+                                                                       raw,
+                                                                       certificates)
             elif claim_resolution_type == "sequence":
                 result['claim'] = self.parse_and_validate_claim_result(claim_response,
                                                                        certificate,
-                                                                       raw)
+                                                                       raw,
+                                                                       certificates)
             else:
                 print_stderr("unknown response type: %s" % claim_resolution_type)
 
@@ -1197,14 +1242,21 @@ class Commands:
 
         height = self.network.get_local_height() - RECOMMENDED_CLAIMTRIE_HASH_CONFIRMS + 1
         block_header = self.network.blockchain.read_header(height)
-        block_hash = self.network.blockchain.hash_header(block_header)
+        block_hash = self.network.blockchain.get_block_hash_at(height)
         response = self.network.synchronous_get(('blockchain.claimtrie.getvaluesforuris',
                                                  (block_hash, ) + uris_to_send))
+        # fetch the channels of claims resolved without their channel at once
+        certificates = None
+        if not raw:
+            certificates = self.prefetch_certificates(
+                [resolution['claim']['result'] for resolution in response.itervalues()
+                 if 'claim' in resolution and 'certificate' not in resolution])
         result = {}
         for uri, resolution in response.iteritems():
             result[uri] = self._handle_resolve_uri_response(parse_lbry_uri(str(uri)), block_header,
                                                             raw, resolution, page=page,
-                                                            page_size=page_size)
+                                                            page_size=page_size,
+                                                            certificates=certificates)
         return result
 
     @command('n')
@@ -1319,13 +1371,24 @@ class Commands:
 
         return self.network.synchronous_get(('blockchain.block.get_block', [blockhash]))
 
+    @command('n')
+    def getblockheader(self, blockhash):
+        """
+        Get a block header from the local headers file by block hash
+        """
+        height = self.network.blockchain.get_height_of_block(blockhash)
+        if height is None:
+            return {'error': 'block not found'}
+        header = self.network.blockchain.read_header(height).as_dict()
+        header['hash'] = blockhash
+        return header
+
     @command('n')
     def getbestblockhash(self):
         height = self.network.get_local_height()
         if height < 0:
             return None
-        header = self.network.blockchain.read_header(height)
-        return self.network.blockchain.hash_header(header)
+        return self.network.blockchain.get_block_hash_at(height)
 
     @command('n')
     def getmostrecentblocktime(self):
@@ -1345,6 +1408,21 @@ class Commands:
             'retrieving_headers':self.network.blockchain.retrieving_headers}
         return out
 
+    @command('n')
+    def getnetworkmetrics(self):
+        """Request counts and latency by method, network loop timing,
+        connection counters, queue depths and traffic by server"""
+        return self.network.get_metrics()
+
+    @command('')
+    def makecheckpoints(self, headers_path=None, interval=CHECKPOINT_INTERVAL):
+        """Generate a checkpoint table from a trusted headers file. The result
+        can be set as the 'checkpoints' config variable to speed up the
+        initial header sync."""
+        if headers_path is None:
+            headers_path = os.path.join(self.config.path, 'blockchain_headers')
+        return make_checkpoints(headers_path, int(interval))
+
 
     @command('n')
     def getclaimtrie(self):
@@ -2071,6 +2149,8 @@ command_options = {
     'skip_validate_schema': (None, "--ignore_schema", "Validate the claim conforms with lbry schema"),
     'set_default_certificate': (None, "--set_default_certificate", "Set the new certificate as the default, even if there already is one"),
     'amount': ("-a", "--amount", "amount to use in updated name claim"),
+    'headers_path': (None, "--headers_path", "path of a trusted headers file"),
+    'interval': (None, "--interval", "number of chunks between checkpoints"),
     'include_abandoned': (None, "--include_abandoned", "include abandoned claims"),
     'include_supports': (None,"--include_supports", "include supports"),
     'skip_update_check': (None, "--skip_update_check", "do not check for an existing unspent claim before making a new one"),
@@ -2084,6 +2164,7 @@ command_options = {
 json_loads = lambda x: json.loads(x, parse_float=lambda x: str(Decimal(x)))
 arg_types = {
     'num': int,
+    'interval': int,
     'nbits': int,
     'entropy': long,
     'tx': json_loads,
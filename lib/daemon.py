@@ -16,12 +16,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-import ast, os
+import ast, os, sys
 
 import jsonrpclib
-from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer, SimpleJSONRPCRequestHandler
+from jsonrpclib import Fault, jsonclass
+from jsonrpclib.jsonrpc import Payload
+from jsonrpclib.SimpleJSONRPCServer import SimpleJSONRPCServer, SimpleJSONRPCRequestHandler, validate_request
 
-from util import json_decode, DaemonThread
+from util import json_decode, DaemonThread, set_json_codec, get_json_codec
 from wallet import WalletStorage, Wallet
 from wizard import WizardBase
 from commands import known_commands, Commands
@@ -59,18 +61,64 @@ class RequestHandler(SimpleJSONRPCRequestHandler):
         SimpleJSONRPCRequestHandler.end_headers(self)
 
 
+class RPCServer(SimpleJSONRPCServer):
+    """Decodes requests and encodes responses with the JSON codec chosen
+    by set_json_codec.  jsonrpclib's own json module, used by every other
+    jsonrpclib user in the process, is left alone."""
+
+    def _marshaled_dispatch(self, data, dispatch_method=None):
+        try:
+            request = get_json_codec().loads(data)
+        except Exception as e:
+            return Fault(-32700, 'Request %s invalid. (%s)' % (data, e)).response()
+        if jsonrpclib.config.use_jsonclass:
+            request = jsonclass.load(request)
+        if not request:
+            return Fault(-32600, 'Request invalid -- no request data.').response()
+        if isinstance(request, list):
+            responses = filter(None, map(self._marshaled_request, request))
+            return '[%s]' % ','.join(responses) if responses else ''
+        return self._marshaled_request(request)
+
+    def _marshaled_request(self, request):
+        result = validate_request(request)
+        if type(result) is Fault:
+            return result.response()
+        return self._marshaled_single_dispatch(request)
+
+    def _marshaled_single_dispatch(self, request):
+        try:
+            response = self._dispatch(request.get('method'), request.get('params'))
+        except:
+            exc_type, exc_value, exc_tb = sys.exc_info()
+            return Fault(-32603, '%s:%s' % (exc_type, exc_value)).response()
+        if request.get('id') is None:
+            # a notification
+            return None
+        if isinstance(response, Fault):
+            return response.response(rpcid=request['id'])
+        try:
+            if jsonrpclib.config.use_jsonclass:
+                response = jsonclass.dump(response)
+            return get_json_codec().encode(Payload(rpcid=request['id']).response(response))
+        except:
+            exc_type, exc_value, exc_tb = sys.exc_info()
+            return Fault(-32603, '%s:%s' % (exc_type, exc_value)).response()
+
+
 class Daemon(DaemonThread):
     def __init__(self, config, network):
         DaemonThread.__init__(self)
         self.config = config
         self.network = network
+        set_json_codec(config.get('json_codec', 'auto'))
         self.gui = None
         self.wallets = {}
         self.wallet = self.load_wallet(config.get_wallet_path())
         self.cmd_runner = Commands(self.config, self.wallet, self.network)
         host = config.get('rpchost', 'localhost')
         port = config.get('rpcport', 0)
-        self.server = SimpleJSONRPCServer((host, port), requestHandler=RequestHandler, logRequests=False)
+        self.server = RPCServer((host, port), requestHandler=RequestHandler, logRequests=False)
         with open(lockfile(config), 'w') as f:
             f.write(repr(self.server.socket.getsockname()))
         self.server.timeout = 0.1
@@ -99,6 +147,7 @@ class Daemon(DaemonThread):
                 'connected': self.network.is_connected(),
                 'auto_connect': p[4],
                 'wallets': dict([(k, w.is_up_to_date()) for k, w in self.wallets.items()]),
+                'metrics': self.network.get_metrics(),
             }
         elif sub == 'stop':
             self.stop()
@@ -17,6 +17,9 @@
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 
+import errno
+import heapq
+import math
 import os
 import re
 import socket
@@ -26,6 +29,7 @@ import sys
 import threading
 import time
 import traceback
+from collections import defaultdict, deque
 
 import requests.certs
 
@@ -42,6 +46,87 @@ import pem
 
 log = logging.getLogger(__name__)
 
+# seconds a Connector may spend on the TCP connect or the SSL handshake
+CONNECT_TIMEOUT = 10
+
+# seconds the addresses of a server are reused, see resolve
+DNS_TTL = 300
+# (expiry time, getaddrinfo result) by (host, port)
+_dns_cache = {}
+# (modification time, SSLContext) by CA file, see get_ssl_context
+_ssl_contexts = {}
+_cache_lock = threading.Lock()
+
+# requests an interface has on the wire at most, the rest wait in its queue
+REQUEST_WINDOW = 100
+
+# order in which queued requests are sent, lowest first.  Headers and
+# broadcasts go ahead of the bulk requests of a wallet synchronization.
+REQUEST_PRIORITIES = {
+    'blockchain.headers.subscribe': 0,
+    'blockchain.block.get_header': 0,
+    'blockchain.block.get_chunk': 0,
+    'blockchain.transaction.broadcast': 0,
+    'server.version': 1,
+    'blockchain.address.subscribe': 3,
+    'blockchain.address.get_history': 3,
+    'blockchain.transaction.get': 3,
+    'blockchain.transaction.get_merkle': 3,
+}
+DEFAULT_PRIORITY = 2
+
+# bulk requests sent as JSON-RPC batch arrays to servers that support it
+BATCH_METHODS = set([
+    'blockchain.address.subscribe',
+    'blockchain.address.get_history',
+    'blockchain.transaction.get',
+])
+BATCH_SIZE = 50
+# server software, as reported by server.version, known to answer batches
+BATCH_SERVERS = ('electrumx', 'lbryumx')
+
+
+class LatencyStats(object):
+    """Round trip time estimates for one kind of request: an exponentially
+    weighted moving average, and the 95th percentile of recent samples"""
+    ALPHA = 0.2
+    SAMPLES = 100
+    # samples needed before p95() gives an estimate
+    MIN_SAMPLES = 20
+
+    def __init__(self):
+        self.ewma = None
+        self.samples = deque(maxlen=self.SAMPLES)
+        self._p95 = None
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, rtt):
+        if self.ewma is None:
+            self.ewma = rtt
+        else:
+            self.ewma += self.ALPHA * (rtt - self.ewma)
+        self.samples.append(rtt)
+        self._p95 = None
+
+    def p95(self):
+        if len(self.samples) < self.MIN_SAMPLES:
+            return None
+        if self._p95 is None:
+            ordered = sorted(self.samples)
+            self._p95 = ordered[int(math.ceil(0.95 * len(ordered))) - 1]
+        return self._p95
+
+
+def supports_batches(server_version):
+    '''Whether a server.version result advertises JSON-RPC batch support'''
+    if isinstance(server_version, list) and server_version:
+        server_version = server_version[0]
+    if not isinstance(server_version, basestring):
+        return False
+    return server_version.lower().startswith(BATCH_SERVERS)
+
 
 def Connection(server, queue, config_path):
     """Makes asynchronous connections to a remote lbryum server.
@@ -59,12 +144,61 @@ def Connection(server, queue, config_path):
     return c
 
 
-class TcpConnection(threading.Thread, util.PrintError):
-    def __init__(self, server, queue, config_path):
-        threading.Thread.__init__(self)
-        self.daemon = True
+def resolve(host, port):
+    '''getaddrinfo for a server, remembered for DNS_TTL seconds so that
+    reconnects skip the lookup.  Raises socket.gaierror.'''
+    addresses = cached_addresses(host, port)
+    if addresses is not None:
+        return addresses
+    now = time.time()
+    addresses = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+    with _cache_lock:
+        _dns_cache[(host, port)] = (now + DNS_TTL, addresses)
+    return addresses
+
+
+def cached_addresses(host, port):
+    '''The addresses resolve() remembers for a server, or None.  Never
+    blocks on a lookup.'''
+    with _cache_lock:
+        cached = _dns_cache.get((host, port))
+    if cached and cached[0] > time.time():
+        return cached[1]
+
+
+def forget_addresses(host, port):
+    '''Look the server up again next time, none of its addresses worked'''
+    with _cache_lock:
+        _dns_cache.pop((host, port), None)
+
+
+def get_ssl_context(ca_certs):
+    '''SSL context verifying the server against the certificates in the
+    file ca_certs, or not verifying it if ca_certs is None.  Contexts are
+    shared by all connections, the CA bundle and pinned certificates are
+    parsed once rather than on every connect, and again only when their
+    file changes.'''
+    mtime = os.path.getmtime(ca_certs) if ca_certs else None
+    with _cache_lock:
+        cached = _ssl_contexts.get(ca_certs)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        if ca_certs is None:
+            context.verify_mode = ssl.CERT_NONE
+        else:
+            context.verify_mode = ssl.CERT_REQUIRED
+            context.load_verify_locations(ca_certs)
+        _ssl_contexts[ca_certs] = mtime, context
+        return context
+
+
+class ConnectionBase(util.PrintError):
+    """Server address and certificate handling shared by TcpConnection
+    and Connector"""
+
+    def __init__(self, server, config_path):
         self.config_path = config_path
-        self.queue = queue
         self.server = server
         self.host, self.port, self.protocol = self.server.split(':')
         self.host = str(self.host)
@@ -98,9 +232,58 @@ class TcpConnection(threading.Thread, util.PrintError):
                 return cn == name
         return False
 
+    def get_cert_path(self):
+        return os.path.join(self.config_path, 'certs', self.host)
+
+    def wrap_ssl(self, s, ca_certs, do_handshake_on_connect=True):
+        return get_ssl_context(ca_certs).wrap_socket(s, do_handshake_on_connect=do_handshake_on_connect)
+
+    def save_temporary_cert(self, dercert):
+        cert = ssl.DER_cert_to_PEM_cert(dercert)
+        # workaround android bug
+        cert = re.sub("([^\n])-----END CERTIFICATE-----", "\\1\n-----END CERTIFICATE-----", cert)
+        temporary_path = self.get_cert_path() + '.temp'
+        with open(temporary_path, "w") as f:
+            f.write(cert)
+        return temporary_path
+
+    def pinned_cert_failed(self, is_new, temporary_path):
+        """The server did not match the certificate we have for it"""
+        cert_path = self.get_cert_path()
+        if is_new:
+            rej = cert_path + '.rej'
+            if os.path.exists(rej):
+                os.unlink(rej)
+            os.rename(temporary_path, rej)
+        else:
+            with open(cert_path) as f:
+                cert = f.read()
+            try:
+                b = pem.dePem(cert, 'CERTIFICATE')
+                x = x509.X509(b)
+            except:
+                traceback.print_exc(file=sys.stderr)
+                self.print_error("wrong certificate")
+                return
+            try:
+                x.check_date()
+            except:
+                self.print_error("certificate has expired:", cert_path)
+                os.unlink(cert_path)
+                return
+            self.print_error("wrong certificate")
+
+
+class TcpConnection(threading.Thread, ConnectionBase):
+    def __init__(self, server, queue, config_path):
+        threading.Thread.__init__(self)
+        ConnectionBase.__init__(self, server, config_path)
+        self.daemon = True
+        self.queue = queue
+
     def get_simple_socket(self):
         try:
-            l = socket.getaddrinfo(self.host, self.port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+            l = resolve(self.host, self.port)
         except socket.gaierror:
             self.print_error("cannot resolve hostname")
             return
@@ -116,10 +299,11 @@ class TcpConnection(threading.Thread, util.PrintError):
                 continue
         else:
             self.print_error("failed to connect", str(e))
+            forget_addresses(self.host, self.port)
 
     def get_socket(self):
         if self.use_ssl:
-            cert_path = os.path.join(self.config_path, 'certs', self.host)
+            cert_path = self.get_cert_path()
             if not os.path.exists(cert_path):
                 is_new = True
                 s = self.get_simple_socket()
@@ -127,8 +311,7 @@ class TcpConnection(threading.Thread, util.PrintError):
                     return
                 # try with CA first
                 try:
-                    s = ssl.wrap_socket(s, ssl_version=ssl.PROTOCOL_SSLv23, cert_reqs=ssl.CERT_REQUIRED,
-                                        ca_certs=ca_path, do_handshake_on_connect=True)
+                    s = self.wrap_ssl(s, ca_path)
                 except ssl.SSLError, e:
                     s = None
                 if s and self.check_host_name(s.getpeercert(), self.host):
@@ -141,21 +324,17 @@ class TcpConnection(threading.Thread, util.PrintError):
                 if s is None:
                     return
                 try:
-                    s = ssl.wrap_socket(s, ssl_version=ssl.PROTOCOL_SSLv23, cert_reqs=ssl.CERT_NONE, ca_certs=None)
+                    s = self.wrap_ssl(s, None)
                 except ssl.SSLError, e:
                     self.print_error("SSL error retrieving SSL certificate:", e)
                     return
 
                 dercert = s.getpeercert(True)
                 s.close()
-                cert = ssl.DER_cert_to_PEM_cert(dercert)
-                # workaround android bug
-                cert = re.sub("([^\n])-----END CERTIFICATE-----", "\\1\n-----END CERTIFICATE-----", cert)
-                temporary_path = cert_path + '.temp'
-                with open(temporary_path, "w") as f:
-                    f.write(cert)
+                temporary_path = self.save_temporary_cert(dercert)
             else:
                 is_new = False
+                temporary_path = None
 
         s = self.get_simple_socket()
         if s is None:
@@ -163,37 +342,12 @@ class TcpConnection(threading.Thread, util.PrintError):
 
         if self.use_ssl:
             try:
-                s = ssl.wrap_socket(s,
-                                    ssl_version=ssl.PROTOCOL_SSLv23,
-                                    cert_reqs=ssl.CERT_REQUIRED,
-                                    ca_certs=(temporary_path if is_new else cert_path),
-                                    do_handshake_on_connect=True)
+                s = self.wrap_ssl(s, temporary_path if is_new else cert_path)
             except ssl.SSLError, e:
                 self.print_error("SSL error:", e)
                 if e.errno != 1:
                     return
-                if is_new:
-                    rej = cert_path + '.rej'
-                    if os.path.exists(rej):
-                        os.unlink(rej)
-                    os.rename(temporary_path, rej)
-                else:
-                    with open(cert_path) as f:
-                        cert = f.read()
-                    try:
-                        b = pem.dePem(cert, 'CERTIFICATE')
-                        x = x509.X509(b)
-                    except:
-                        traceback.print_exc(file=sys.stderr)
-                        self.print_error("wrong certificate")
-                        return
-                    try:
-                        x.check_date()
-                    except:
-                        self.print_error("certificate has expired:", cert_path)
-                        os.unlink(cert_path)
-                        return
-                    self.print_error("wrong certificate")
+                self.pinned_cert_failed(is_new, temporary_path)
                 return
             except BaseException, e:
                 self.print_error(e)
@@ -215,16 +369,211 @@ class TcpConnection(threading.Thread, util.PrintError):
         self.queue.put((self.server, socket))
 
 
+class Connector(ConnectionBase):
+    """Makes a connection to a remote lbryum server without blocking, so
+    that it can be driven by the network loop instead of a thread.
+
+    The loop selects on fileno() for writing if want_write is set and for
+    reading otherwise, and calls step() when the socket is ready.  Once
+    done is set, socket holds the connected socket, or None if the
+    connection failed.  Connections through a proxy must use
+    TcpConnection, the SOCKS negotiation blocks.
+
+    A server missing from the DNS cache is looked up by a helper thread,
+    as getaddrinfo blocks.  Until then resolving is set and there is no
+    socket to select on; the loop calls check_resolved(), and is woken
+    by on_resolved, if given, once the lookup is over.
+
+    SSL connections go through the same stages as TcpConnection: without
+    a stored certificate the server is first checked against the CA
+    bundle ('ca'), failing that its certificate is fetched ('fetch') and
+    pinned for the final connection ('pinned').
+    """
+
+    def __init__(self, server, config_path, on_resolved=None):
+        ConnectionBase.__init__(self, server, config_path)
+        self.done = False
+        self.socket = None
+        self.want_write = True
+        self.stage = None
+        self.sock = None
+        self.handshaking = False
+        self.addresses = []
+        self.pending_addresses = []
+        self.deadline = None
+        self.is_new = False
+        self.temporary_path = None
+        self.resolving = False
+        # getaddrinfo result of the lookup thread, [] if it failed
+        self.lookup_result = None
+        addresses = cached_addresses(self.host, self.port)
+        if addresses is not None:
+            self.connect(addresses)
+            return
+        self.resolving = True
+        self.deadline = time.time() + CONNECT_TIMEOUT
+        lookup = threading.Thread(target=self.lookup, args=(on_resolved,))
+        lookup.daemon = True
+        lookup.start()
+
+    def lookup(self, on_resolved):
+        try:
+            self.lookup_result = resolve(self.host, self.port)
+        except socket.gaierror:
+            self.lookup_result = []
+        if on_resolved:
+            on_resolved()
+
+    def check_resolved(self):
+        """Start connecting once the lookup thread is done"""
+        if not self.resolving or self.lookup_result is None:
+            return
+        self.resolving = False
+        if self.done:
+            return
+        if not self.lookup_result:
+            self.print_error("cannot resolve hostname")
+            self.finish(None)
+            return
+        self.connect(self.lookup_result)
+
+    def connect(self, addresses):
+        self.addresses = addresses
+        if not self.use_ssl:
+            self.begin('tcp')
+        elif os.path.exists(self.get_cert_path()):
+            self.begin('pinned')
+        else:
+            self.begin('ca')
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def begin(self, stage):
+        """Open a new TCP connection for the given stage"""
+        self.stage = stage
+        self.pending_addresses = list(self.addresses)
+        self.connect_next()
+
+    def connect_next(self):
+        self.close_sock()
+        while self.pending_addresses:
+            res = self.pending_addresses.pop(0)
+            s = socket.socket(res[0], socket.SOCK_STREAM)
+            s.setblocking(0)
+            err = s.connect_ex(res[4])
+            if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EALREADY, 10035):
+                self.sock = s
+                self.handshaking = False
+                self.want_write = True
+                self.deadline = time.time() + CONNECT_TIMEOUT
+                return
+            s.close()
+            self.print_error("failed to connect", res[4], os.strerror(err))
+        forget_addresses(self.host, self.port)
+        self.finish(None)
+
+    def step(self):
+        """Advance the connection, the socket is ready as requested"""
+        try:
+            if not self.handshaking:
+                err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if err:
+                    self.print_error("failed to connect", os.strerror(err))
+                    self.connect_next()
+                    return
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                if self.stage == 'tcp':
+                    self.finish(self.sock)
+                    return
+                self.sock = self.wrap_socket(self.sock)
+                self.handshaking = True
+                self.deadline = time.time() + CONNECT_TIMEOUT
+            self.sock.do_handshake()
+        except ssl.SSLWantReadError:
+            self.want_write = False
+        except ssl.SSLWantWriteError:
+            self.want_write = True
+        except ssl.SSLError as e:
+            self.handshake_failed(e)
+        except socket.error as e:
+            self.print_error("socket error:", e)
+            self.finish(None)
+        else:
+            self.handshake_done()
+
+    def wrap_socket(self, s):
+        if self.stage == 'ca':
+            return self.wrap_ssl(s, ca_path, False)
+        elif self.stage == 'fetch':
+            # Do not use ssl.get_server_certificate because it does not work with proxy
+            return self.wrap_ssl(s, None, False)
+        ca_certs = self.temporary_path if self.is_new else self.get_cert_path()
+        return self.wrap_ssl(s, ca_certs, False)
+
+    def handshake_done(self):
+        if self.stage == 'ca':
+            if self.check_host_name(self.sock.getpeercert(), self.host):
+                self.print_error("SSL certificate signed by CA")
+                self.finish(self.sock)
+            else:
+                self.begin('fetch')
+        elif self.stage == 'fetch':
+            self.temporary_path = self.save_temporary_cert(self.sock.getpeercert(True))
+            self.is_new = True
+            self.begin('pinned')
+        else:
+            if self.is_new:
+                self.print_error("saving certificate")
+                os.rename(self.temporary_path, self.get_cert_path())
+            self.finish(self.sock)
+
+    def handshake_failed(self, e):
+        if self.stage == 'ca':
+            self.begin('fetch')
+        elif self.stage == 'fetch':
+            self.print_error("SSL error retrieving SSL certificate:", e)
+            self.finish(None)
+        else:
+            self.print_error("SSL error:", e)
+            if e.errno == 1:
+                self.pinned_cert_failed(self.is_new, self.temporary_path)
+            self.finish(None)
+
+    def has_timed_out(self):
+        return not self.done and time.time() > self.deadline
+
+    def finish(self, s):
+        if s is None:
+            self.close_sock()
+        else:
+            self.print_error("connected")
+            self.sock = None
+        self.socket = s
+        self.done = True
+
+    def close_sock(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def close(self):
+        """Abandon the connection attempt"""
+        if not self.done:
+            self.finish(None)
+
+
 class Interface(util.PrintError):
     """The Interface class handles a socket connected to a single remote
     lbryum server.  It's exposed API is:
 
     - Member functions close(), fileno(), get_responses(), has_timed_out(),
-      ping_required(), queue_request(), send_requests()
+      in_flight(), ping_required(), queue_depth(), queue_request(),
+      send_requests(), wants_write()
     - Member variable server.
     """
 
-    def __init__(self, server, socket):
+    def __init__(self, server, socket, window=REQUEST_WINDOW):
         self.server = server
         self.host, _, _ = server.split(':')
         self.socket = socket
@@ -233,8 +582,24 @@ class Interface(util.PrintError):
         self.pipe.set_timeout(0.0)  # Don't wait for data
         # Dump network messages.  Set at runtime from the console.
         self.debug = False
+        # heap of (priority, sequence, request), see REQUEST_PRIORITIES
         self.unsent_requests = []
+        self.request_count = 0
         self.unanswered_requests = {}
+        self.window = window
+        self.server_version = None
+        # whether to send bulk requests as batches, the sets of ids of
+        # sent batches still awaiting an answer, and the set of each id
+        self.batching = False
+        self.pending_batches = []
+        self.batch_of = {}
+        # ids sent again after an unidentified batch rejection, whose
+        # other copy may still be answered, see batch_rejected
+        self.requeued_ids = set()
+        # round trip times by method, and over all requests
+        self.sent_times = {}
+        self.latency = defaultdict(LatencyStats)
+        self.rtt = LatencyStats()
         # Set last ping to zero to ensure immediate ping
         self.last_request = time.time()
         self.last_ping = 0
@@ -261,24 +626,125 @@ class Interface(util.PrintError):
         socket is available for writing.
         '''
         self.request_time = time.time()
-        self.unsent_requests.append(args)
+        priority = REQUEST_PRIORITIES.get(args[0], DEFAULT_PRIORITY)
+        heapq.heappush(self.unsent_requests, (priority, self.request_count, args))
+        self.request_count += 1
 
     def send_requests(self):
-        '''Sends all queued requests.  Returns False on failure.'''
-        make_dict = lambda (m, p, i): {'method': m, 'params': p, 'id': i}
-        wire_requests = map(make_dict, self.unsent_requests)
+        '''Sends queued requests, most urgent first, until window requests
+        are awaiting an answer.  They are written as far as the socket
+        accepts them without blocking, the rest is written by later calls
+        once select() reports the socket writable.  Returns False on
+        failure.'''
+        count = min(len(self.unsent_requests), self.window - len(self.unanswered_requests))
+        requests = [heapq.heappop(self.unsent_requests)[2] for _ in range(count)]
+        self.pipe.queue_all(self.frame_requests(requests))
+        now = time.time()
+        for request in requests:
+            if self.debug:
+                self.print_error("-->", request)
+            self.unanswered_requests[request[2]] = request
+            self.sent_times[request[2]] = now
         try:
-            self.pipe.send_all(wire_requests)
+            self.pipe.flush()
         except socket.error, e:
             self.print_error("socket error:", e)
             return False
-        for request in self.unsent_requests:
-            if self.debug:
-                self.print_error("-->", request)
-            self.unanswered_requests[request[2]] = request
-        self.unsent_requests = []
         return True
 
+    def frame_requests(self, requests):
+        '''Wire messages for requests.  With batching on, bulk requests
+        are grouped into JSON-RPC batch arrays of up to BATCH_SIZE.'''
+        make_dict = lambda (m, p, i): {'method': m, 'params': p, 'id': i}
+        if not self.batching:
+            return map(make_dict, requests)
+        messages = []
+        batch = []
+        for request in requests:
+            if request[0] not in BATCH_METHODS:
+                messages.append(make_dict(request))
+                continue
+            message = make_dict(request)
+            message['jsonrpc'] = '2.0'
+            batch.append(message)
+            if len(batch) == BATCH_SIZE:
+                messages.append(self.add_batch(batch))
+                batch = []
+        if batch:
+            messages.append(self.add_batch(batch))
+        return messages
+
+    def add_batch(self, batch):
+        ids = set(message['id'] for message in batch)
+        self.pending_batches.append(ids)
+        for wire_id in ids:
+            self.batch_of[wire_id] = ids
+        return batch
+
+    def batch_answered(self, wire_id):
+        ids = self.batch_of.pop(wire_id, None)
+        if ids is not None:
+            ids.discard(wire_id)
+            if not ids:
+                self.pending_batches.remove(ids)
+
+    def set_server_version(self, server_version):
+        self.server_version = server_version
+        batching = supports_batches(server_version)
+        if batching != self.batching:
+            self.print_error("batch requests", "on" if batching else "off")
+        self.batching = batching
+
+    def batch_rejected(self):
+        '''The server refused a batch, fall back to single requests and
+        queue the requests of the batch again.  The error does not say
+        which batch it was.  A batch is answered by one array, so it is
+        the only batch without answers if there is just one.  Otherwise
+        all of them are sent again, and the answers to their ids after
+        the first are dropped.'''
+        self.print_error("batch rejected, sending single requests")
+        self.batching = False
+        ambiguous = len(self.pending_batches) > 1
+        for ids in self.pending_batches:
+            for wire_id in sorted(ids):
+                self.batch_of.pop(wire_id, None)
+                self.sent_times.pop(wire_id, None)
+                request = self.unanswered_requests.pop(wire_id, None)
+                if request:
+                    self.queue_request(*request)
+                    if ambiguous:
+                        self.requeued_ids.add(wire_id)
+        self.pending_batches = []
+
+    def wants_write(self):
+        '''True if there is output, or requests the window lets us send'''
+        return self.pipe.has_output() or (
+            bool(self.unsent_requests) and len(self.unanswered_requests) < self.window)
+
+    def queue_depth(self):
+        '''Number of requests waiting to be sent'''
+        return len(self.unsent_requests)
+
+    def in_flight(self):
+        '''Number of requests sent and awaiting a response'''
+        return len(self.unanswered_requests)
+
+    def record_rtt(self, method, rtt):
+        self.latency[method].add(rtt)
+        self.rtt.add(rtt)
+
+    def expected_rtt(self, method=None):
+        '''Round trip time estimate for method, or for any request if
+        method is None or has no samples.  None if nothing was timed.'''
+        if method in self.latency:
+            return self.latency[method].ewma
+        return self.rtt.ewma
+
+    def rtt_p95(self, method):
+        '''95th percentile round trip time of method, or None'''
+        if method in self.latency:
+            return self.latency[method].p95()
+
     def ping_required(self):
         '''Maintains time since last ping.  Returns True if a ping should
         be sent.
@@ -304,8 +770,9 @@ class Interface(util.PrintError):
         unsolicited responses presumably as a result of prior
         subscriptions, so request is None and there is no 'id' member.
         Otherwise it is a response, which has an 'id' member and a
-        corresponding request.  If the connection was closed remotely
-        or the remote server is misbehaving, a (None, None) will appear.
+        corresponding request.  The answer to a batch is split into its
+        responses.  If the connection was closed remotely or the remote
+        server is misbehaving, a (None, None) will appear.
         '''
         responses = []
         while True:
@@ -320,17 +787,40 @@ class Interface(util.PrintError):
                 break
             if self.debug:
                 self.print_error("<--", response)
-            wire_id = response.get('id', None)
-            if wire_id is None:  # Notification
-                responses.append((None, response))
-            else:
+            # a batch is answered by an array of responses
+            batch = response if isinstance(response, list) else [response]
+            for response in batch:
+                if not isinstance(response, dict):
+                    self.print_error("malformed response", response)
+                    responses.append((None, None))  # Signal
+                    return responses
+                wire_id = response.get('id', None)
+                if wire_id is None:
+                    if response.get('method'):  # Notification
+                        responses.append((None, response))
+                    elif self.batching:
+                        # an error without id is the answer to a batch
+                        # the server could not handle
+                        self.print_error("error", response.get('error'))
+                        self.batch_rejected()
+                    else:
+                        self.print_error("error", response.get('error'))
+                    continue
                 request = self.unanswered_requests.pop(wire_id, None)
+                self.batch_answered(wire_id)
+                sent_time = self.sent_times.pop(wire_id, None)
+                if request is None and wire_id in self.requeued_ids:
+                    # the other copy of a request sent twice was answered
+                    self.requeued_ids.discard(wire_id)
+                    continue
                 if request:
+                    if sent_time is not None:
+                        self.record_rtt(request[0], time.time() - sent_time)
                     responses.append((request, response))
                 else:
                     self.print_error("unknown wire ID", wire_id)
                     responses.append((None, None))  # Signal
-                    break
+                    return responses
 
         return responses
 
@@ -0,0 +1,96 @@
+import bisect
+import time
+from collections import defaultdict
+
+
+class Histogram(object):
+    """Distribution of durations in seconds, counted in fixed buckets"""
+    # upper bounds of the buckets, the last bucket holds everything slower
+    BOUNDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.buckets[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q quantile, or the
+        largest sample for the last bucket"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.BOUNDS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        labels = ['<=%g' % bound for bound in self.BOUNDS] + ['>%g' % self.BOUNDS[-1]]
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': dict((label, count) for label, count in zip(labels, self.buckets) if count),
+        }
+
+
+class NetworkMetrics(object):
+    """Counters and timings of a Network, see Network.get_metrics.
+
+    Client requests are timed from Network.send, so that the time spent
+    waiting in pending_sends for the network loop is included, until
+    their callbacks have run.  They are keyed by Network.get_request_key
+    so that retries and hedged copies count as one request."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.latency = defaultdict(Histogram)
+        self.errors = defaultdict(int)
+        self.cache_hits = defaultdict(int)
+        self.loop = Histogram()
+        self.connects = 0
+        self.connect_failures = 0
+        self.disconnects = 0
+        self.switches = 0
+        self.request_times = {}
+
+    def request_sent(self, key, sent=None):
+        self.request_times.setdefault(key, sent if sent is not None else time.time())
+
+    def request_answered(self, key, method, error):
+        sent = self.request_times.pop(key, None)
+        if sent is not None:
+            self.latency[method].add(time.time() - sent)
+        if error:
+            self.errors[method] += 1
+
+    def as_dict(self):
+        methods = {}
+        for method, histogram in self.latency.items():
+            methods[method] = histogram.as_dict()
+            methods[method]['errors'] = self.errors.get(method, 0)
+            methods[method]['cache_hits'] = self.cache_hits.get(method, 0)
+        for method, hits in self.cache_hits.items():
+            if method not in methods:
+                methods[method] = {'count': 0, 'errors': 0, 'cache_hits': hits}
+        return {
+            'uptime': time.time() - self.started,
+            'methods': methods,
+            'loop': self.loop.as_dict(),
+            'connects': self.connects,
+            'connect_failures': self.connect_failures,
+            'disconnects': self.disconnects,
+            'switches': self.switches,
+        }
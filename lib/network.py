@@ -6,6 +6,7 @@ import re
 import random
 import select
 import traceback
+import heapq
 from collections import defaultdict, deque
 from threading import Lock
 
@@ -16,8 +17,12 @@ import logging
 
 import util
 from lbryum import lbrycrd
-from interface import Connection, Interface
-from blockchain import get_blockchain, BLOCKS_PER_CHUNK
+from interface import Connection, Connector, Interface, REQUEST_WINDOW
+from blockchain import get_blockchain, BLOCKS_PER_CHUNK, MAX_FORK_DEPTH
+from cache import ResponseCache
+from peers import PeerDB
+from metrics import NetworkMetrics
+from transaction import Transaction
 from version import LBRYUM_VERSION, PROTOCOL_VERSION
 
 log = logging.getLogger(__name__)
@@ -39,6 +44,41 @@ def is_online(host, ports):
 
 NODES_RETRY_INTERVAL = 60
 SERVER_RETRY_INTERVAL = 10
+# number of chunks being downloaded or waiting to be connected during catch-up
+CHUNK_WINDOW = 8
+CHUNK_TIMEOUT = 30
+# seconds between updates of the peer database from connected servers
+PEER_DB_INTERVAL = 60
+
+# client requests that do not depend on the state of a particular server,
+# and whose answers are verified or can be, see Network.route_request
+STATELESS_METHODS = set([
+    'blockchain.transaction.get',
+    'blockchain.transaction.get_merkle',
+    'blockchain.block.get_header',
+])
+STATELESS_PREFIXES = ('blockchain.claimtrie.',)
+# round trip time assumed for servers that have not answered anything yet
+DEFAULT_RTT = 0.5
+# shortest wait before a hedged request is sent to a second server
+HEDGE_MIN_DELAY = 0.05
+# client requests whose results never change, see Network.cache_response.
+# Merkle branches and headers only once their block is deeper than a
+# reorganisation can reach.
+CACHED_METHODS = set([
+    'blockchain.transaction.get',
+    'blockchain.transaction.get_merkle',
+    'blockchain.block.get_header',
+])
+# cached results the network cannot check itself, they are cached by
+# whoever verifies them, like the SPV verifier for merkle branches
+VERIFIED_METHODS = set([
+    'blockchain.transaction.get_merkle',
+])
+
+
+def is_stateless(method):
+    return method in STATELESS_METHODS or method.startswith(STATELESS_PREFIXES)
 
 
 def parse_servers(result):
@@ -127,11 +167,157 @@ def serialize_server(host, port, protocol):
     return str(':'.join([host, port, protocol]))
 
 
+class ChunkCatchup(util.PrintError):
+    """Downloads chunks of headers from all connected interfaces at once.
+
+    Up to window get_chunk requests are kept outstanding, each sent to the
+    interface with the fewest chunk requests in flight among those high
+    enough to serve it.  Chunks arriving out of order are buffered and
+    connected to the blockchain in order, in runs reaching the next
+    checkpoint where the window can hold them, so that their proof of
+    work need not be checked.  Chunks requested from an
+    interface that goes down or times out are requested again elsewhere.
+    """
+
+    def __init__(self, network, window=CHUNK_WINDOW):
+        self.network = network
+        self.window = window
+        # next chunk to connect and last chunk to download
+        self.next_idx = 0
+        self.end_idx = -1
+        # the chunk the current catch-up started from
+        self.first_idx = 0
+        # heap of chunk indexes waiting for an interface
+        self.unassigned = []
+        # idx -> (interface, request time)
+        self.outstanding = {}
+        # idx -> (interface, hexdata)
+        self.buffered = {}
+
+    def is_active(self):
+        return self.next_idx <= self.end_idx
+
+    def extend(self, height):
+        """Schedule every complete chunk up to height"""
+        end_idx = (height + 1) / BLOCKS_PER_CHUNK - 1
+        if not self.is_active():
+            self.next_idx = self.first_idx = (self.network.get_local_height() + 1) / BLOCKS_PER_CHUNK
+            self.end_idx = self.next_idx - 1
+            self.unassigned = []
+            self.outstanding = {}
+            self.buffered = {}
+        for idx in range(self.end_idx + 1, end_idx + 1):
+            heapq.heappush(self.unassigned, idx)
+        self.end_idx = max(self.end_idx, end_idx)
+
+    def requests_in_flight(self, interface):
+        return len([i for i, _ in self.outstanding.values() if i == interface])
+
+    def pick_interface(self, idx):
+        last_height = (idx + 1) * BLOCKS_PER_CHUNK - 1
+        candidates = [interface for server, interface in self.network.interfaces.items()
+                      if self.network.heights.get(server, 0) >= last_height]
+        if candidates:
+            return min(candidates, key=self.requests_in_flight)
+
+    def reassign(self, idx):
+        self.outstanding.pop(idx, None)
+        if idx not in self.unassigned:
+            heapq.heappush(self.unassigned, idx)
+
+    def interface_down(self, interface):
+        for idx, (i, _) in self.outstanding.items():
+            if i == interface:
+                self.reassign(idx)
+
+    def maintain(self):
+        """Re-request timed out chunks and fill the request window"""
+        now = time.time()
+        for idx, (interface, req_time) in self.outstanding.items():
+            if idx in self.outstanding and now - req_time > CHUNK_TIMEOUT:
+                interface.print_error("chunk %d request timed out" % idx)
+                self.reassign(idx)
+                self.network.connection_down(interface.server)
+        while self.unassigned and len(self.outstanding) + len(self.buffered) < self.window:
+            idx = self.unassigned[0]
+            interface = self.pick_interface(idx)
+            if interface is None:
+                break
+            heapq.heappop(self.unassigned)
+            log.debug("requesting chunk %d from %s", idx, interface.server)
+            self.network.queue_request('blockchain.block.get_chunk', [idx], interface)
+            self.outstanding[idx] = (interface, now)
+
+    def on_chunk(self, interface, idx, response):
+        """Returns False if the chunk was not requested from interface"""
+        request = self.outstanding.get(idx)
+        if request is None or request[0] != interface:
+            return False
+        del self.outstanding[idx]
+        if response.get('error') or not response.get('result'):
+            interface.print_error("chunk %d error: %s" % (idx, response.get('error')))
+            self.reassign(idx)
+        else:
+            self.buffered[idx] = (interface, response['result'])
+            self.connect_buffered()
+        self.maintain()
+        return True
+
+    def connect_buffered(self):
+        start = self.next_idx
+        run = []
+        while start + len(run) in self.buffered:
+            run.append(self.buffered.pop(start + len(run)))
+        if not run:
+            return
+        blockchain = self.network.blockchain
+        checkpoint_idx = self.checkpoint_idx(start)
+        if checkpoint_idx is not None and start + len(run) <= checkpoint_idx:
+            # wait for the rest of the run up to the checkpoint
+            for i, chunk in enumerate(run):
+                self.buffered[start + i] = chunk
+            return
+        if blockchain.connect_chunks(start, [hexdata for _, hexdata in run]):
+            self.next_idx = start + len(run)
+            return
+        # find the chunk that failed and keep the ones after it
+        for i, (interface, hexdata) in enumerate(run):
+            idx = start + i
+            if blockchain.connect_chunk(idx, hexdata) != idx + 1:
+                for j in range(i + 1, len(run)):
+                    self.buffered[start + j] = run[j]
+                self.chunk_failed(idx, interface)
+                return
+            self.next_idx = idx + 1
+
+    def checkpoint_idx(self, idx):
+        """Chunk of the next checkpoint from chunk idx on, if it is to be
+        downloaded in this catch-up and the chunks up to it fit in the
+        window"""
+        height = self.network.blockchain.get_next_checkpoint_height(idx * BLOCKS_PER_CHUNK - 1)
+        if height is None:
+            return None
+        checkpoint_idx = height / BLOCKS_PER_CHUNK
+        if checkpoint_idx <= self.end_idx and checkpoint_idx - idx < self.window:
+            return checkpoint_idx
+
+    def chunk_failed(self, idx, interface):
+        if idx == self.first_idx and idx > 0:
+            # does not connect to our chain, step back like header catch-up does
+            self.first_idx = self.next_idx = idx - 1
+            heapq.heappush(self.unassigned, idx - 1)
+        else:
+            interface.print_error("chunk %d didn't verify, dismissing interface" % idx)
+            self.network.connection_down(interface.server)
+        self.reassign(idx)
+
+
 class Network(util.DaemonThread):
     """The Network class manages a set of connections to remote lbryum
     servers, each connected socket is handled by an Interface() object.
-    Connections are initiated by a Connection() thread which stops once
-    the connection succeeds or fails.
+    Connections are made without blocking by a Connector() driven from
+    the select loop in run(), or by a Connection() thread when going
+    through a proxy, which stops once the connection succeeds or fails.
 
     Our external API:
 
@@ -145,10 +331,13 @@ class Network(util.DaemonThread):
             config = {}  # Do not use mutables as default values!
         util.DaemonThread.__init__(self)
         self.config = SimpleConfig(config) if type(config) == type({}) else config
+        util.set_json_codec(self.config.get('json_codec', 'auto'))
         self.num_server = 8 if not self.config.get('oneserver') else 0
         self.blockchain = get_blockchain(self.config, self)
         # A deque of interface header requests, processed left-to-right
         self.bc_requests = deque()
+        # Chunk downloads spread over all interfaces
+        self.catchup = ChunkCatchup(self, self.config.get('chunk_window', CHUNK_WINDOW))
         # Server for addresses and transactions
         self.default_server = self.config.get('server')
         # Sanitize default server
@@ -156,14 +345,19 @@ class Network(util.DaemonThread):
             deserialize_server(self.default_server)
         except:
             self.default_server = None
+        # health of the servers we connected to, across restarts
+        self.peer_db = PeerDB(os.path.join(self.config.path, 'peers'))
+        self.peer_db_time = time.time()
         if not self.default_server:
             default_servers = self.config.get('default_servers')
             if not default_servers:
                 raise ValueError('No servers have been specified')
-            self.default_server = pick_random_server(default_servers)
+            self.default_server = self.peer_db.choose(filter_protocol(default_servers, 't'))
 
         self.lock = Lock()
         self.pending_sends = []
+        # wakes up the loop in run() when another thread calls send()
+        self.waker = util.Waker()
         self.message_id = 0
         self.debug = False
         self.irc_servers = {} # returned by interface (list from irc)
@@ -188,10 +382,26 @@ class Network(util.DaemonThread):
         if not os.path.exists(dir_path):
             os.mkdir(dir_path)
 
+        # results of client requests that never change
+        self.response_cache = None
+        if self.config.get('response_cache', True):
+            cache_path = None
+            if self.config.get('response_cache_disk', True):
+                cache_path = os.path.join(self.config.path, 'response_cache')
+            self.response_cache = ResponseCache(cache_path,
+                                                self.config.get('response_cache_size', 8 << 20),
+                                                self.config.get('response_cache_disk_size', 64 << 20))
+
         # subscriptions and requests
         self.subscribed_addresses = set()
         # Requests from client we've not seen a response to
         self.unanswered_requests = {}
+        # callbacks of client requests waiting for the answer to an
+        # identical request already sent, by get_request_key
+        self.inflight_requests = {}
+        self.coalesced_count = 0
+        # request latency, loop timing and connection counters
+        self.metrics = NetworkMetrics()
         # retry times
         self.server_retry_time = time.time()
         self.nodes_retry_time = time.time()
@@ -201,7 +411,20 @@ class Network(util.DaemonThread):
         self.interface = None
         self.interfaces = {}
         self.auto_connect = self.config.get('auto_connect', False)
+        # send stateless requests to any connected server, see route_request
+        self.load_balance = self.config.get('load_balance', True)
+        # ask a second server when the first is slow, see send_hedges
+        self.hedge_requests = self.config.get('hedge_requests', False)
+        # message ids of the two copies of hedged requests, mapped to each other
+        self.hedges = {}
+        # heap of (time, message id) at which to hedge a request
+        self.hedge_deadlines = []
+        self.hedge_count = 0
         self.connecting = set()
+        # start times of connection attempts by server
+        self.connect_times = {}
+        # non-blocking connection attempts by server
+        self.connectors = {}
         self.socket_queue = Queue.Queue()
         self.online_servers = {}
         self._set_online_servers()
@@ -249,7 +472,7 @@ class Network(util.DaemonThread):
         return self.connection_status == 'connecting'
 
     def is_up_to_date(self):
-        return self.unanswered_requests == {}
+        return self.unanswered_requests == {} and not self.pending_sends
 
     def queue_request(self, method, params, interface=None):
         # If you want to queue a request on any interface it must go
@@ -265,15 +488,11 @@ class Network(util.DaemonThread):
 
     def send_subscriptions(self):
         log.info(
-            'sending subscriptions to %s. Unanswered requests: %s, Subscribed addresses: %s',
-            self.interface.server, len(self.unanswered_requests), len(self.subscribed_addresses))
+            'sending subscriptions to %s. Pending requests: %s, Subscribed addresses: %s',
+            self.interface.server, len(self.pending_sends), len(self.subscribed_addresses))
         self.sub_cache.clear()
-        # Resend unanswered requests
-        requests = self.unanswered_requests.values()
-        self.unanswered_requests = {}
-        for request in requests:
-            message_id = self.queue_request(request[0], request[1])
-            self.unanswered_requests[message_id] = request
+        # Unanswered requests of the previous interface were put back
+        # into pending_sends by close_interface
         for addr in self.subscribed_addresses:
             self.queue_request('blockchain.address.subscribe', [addr])
         self.queue_request('server.banner', [])
@@ -306,6 +525,86 @@ class Network(util.DaemonThread):
         host, port, protocol = deserialize_server(self.default_server)
         return host, port, protocol, self.proxy, self.auto_connect
 
+    def get_metrics(self):
+        '''Request latency by method, network loop timing, connection
+        counters, queue depths, and traffic and load by server'''
+        metrics = self.metrics.as_dict()
+        with self.lock:
+            metrics['pending_sends'] = len(self.pending_sends)
+        metrics['unanswered_requests'] = len(self.unanswered_requests)
+        metrics['coalesced'] = self.coalesced_count
+        metrics['hedged'] = self.hedge_count
+        metrics['cache'] = self.get_cache_stats()
+        servers = self.get_request_stats()
+        for server, interface in self.interfaces.items():
+            if server in servers:
+                servers[server]['bytes_received'] = interface.pipe.bytes_received
+                servers[server]['bytes_sent'] = interface.pipe.bytes_sent
+        metrics['servers'] = servers
+        return metrics
+
+    def get_cache_stats(self):
+        '''Hits, misses and size of the response cache'''
+        if self.response_cache is None:
+            return {}
+        return self.response_cache.stats()
+
+    def cached_response(self, method, params):
+        if self.response_cache is None or method not in CACHED_METHODS:
+            return
+        result = self.response_cache.get(ResponseCache.key(method, params))
+        if result is not None:
+            return {'method': method, 'params': params, 'result': result}
+
+    def cache_response(self, method, params, response, verified=False):
+        '''Keep the result of a client request if it can never change.
+        Results of VERIFIED_METHODS are only kept when the caller has
+        verified them, all others are checked here.'''
+        if self.response_cache is None or method not in CACHED_METHODS:
+            return
+        if method in VERIFIED_METHODS and not verified:
+            return
+        result = response.get('result')
+        if response.get('error') or result is None:
+            return
+        if method == 'blockchain.transaction.get':
+            # the server could send any transaction, check it is the
+            # one asked for
+            try:
+                if Transaction(result).hash() != params[0]:
+                    return
+            except Exception:
+                return
+        else:
+            # get_merkle takes [tx_hash, height], get_header [height]
+            try:
+                height = int(params[-1])
+            except (IndexError, TypeError, ValueError):
+                return
+            if self.get_local_height() - height < MAX_FORK_DEPTH:
+                return
+            if method == 'blockchain.block.get_header' and not self.is_local_header(height, result):
+                return
+        self.response_cache.put(ResponseCache.key(method, params), result)
+
+    def is_local_header(self, height, header):
+        '''Whether header is the one saved at height'''
+        local = self.blockchain.read_header(height)
+        if local is None:
+            return False
+        try:
+            return self.blockchain.hash_header(header) == self.blockchain.hash_header(local)
+        except Exception:
+            return False
+
+    def get_request_stats(self):
+        '''Number of queued and in-flight requests, and the round trip
+        time estimate, by server'''
+        return dict((server, {'queued': interface.queue_depth(),
+                              'in_flight': interface.in_flight(),
+                              'rtt': interface.expected_rtt()})
+                    for server, interface in self.interfaces.items())
+
     def get_interfaces(self):
         '''The interfaces that are in connected state'''
         return self.interfaces.keys()
@@ -313,16 +612,20 @@ class Network(util.DaemonThread):
     #Do an initial pruning of lbryum servers that don't have the specified port open
     def _set_online_servers(self):
         servers = self.config.get('default_servers', {}).iteritems()
+        # servers that connected lately are not probed again
         self.online_servers = {
             host: ports for host, ports in servers
-            if is_online(host, ports)
+            if self.peer_db.recently_connected(serialize_server(host, ports.get('t'), 't'))
+            or is_online(host, ports)
         }
 
     def get_servers(self):
         if self.irc_servers:
             out = self.irc_servers
         else:
-            out = self.online_servers
+            # servers learnt in earlier sessions
+            out = dict(self.peer_db.hosts)
+            out.update(self.online_servers)
         return out
 
     def start_interface(self, server):
@@ -331,11 +634,18 @@ class Network(util.DaemonThread):
                 log.info("connecting to %s as new interface", server)
                 self.set_status('connecting')
             self.connecting.add(server)
-            c = Connection(server, self.socket_queue, self.config.path)
+            self.connect_times[server] = time.time()
+            if self.proxy:
+                Connection(server, self.socket_queue, self.config.path)
+            else:
+                self.connectors[server] = Connector(server, self.config.path, self.waker.wake)
 
     def start_random_interface(self):
+        '''Connect to a server picked by the peer database, favouring
+        those that were reliable, fast and up to date before'''
         exclude_set = self.disconnected_servers.union(set(self.interfaces))
-        server = pick_random_server(self.get_servers(), self.protocol, exclude_set)
+        eligible = set(filter_protocol(self.get_servers(), self.protocol)) - exclude_set
+        server = self.peer_db.choose(sorted(eligible))
         if server:
             self.start_interface(server)
 
@@ -359,7 +669,7 @@ class Network(util.DaemonThread):
 
     def start_network(self, protocol, proxy):
         assert not self.interface and not self.interfaces
-        assert not self.connecting and self.socket_queue.empty()
+        assert not self.connecting and not self.connectors and self.socket_queue.empty()
         log.info('starting network')
         self.disconnected_servers = set([])
         self.protocol = protocol
@@ -368,10 +678,14 @@ class Network(util.DaemonThread):
 
     def stop_network(self):
         log.info("stopping network")
+        self.update_peer_db()
         for interface in self.interfaces.values():
             self.close_interface(interface)
         assert self.interface is None
         assert not self.interfaces
+        for connector in self.connectors.values():
+            connector.close()
+        self.connectors = {}
         self.connecting = set()
         # Get a new queue - no old pending connections thanks!
         self.socket_queue = Queue.Queue()
@@ -398,12 +712,22 @@ class Network(util.DaemonThread):
             self.switch_lagging_interface()
 
     def switch_to_random_interface(self):
-        '''Switch to a random connected server other than the current one'''
+        '''Switch to the fastest connected server other than the current
+        one among those at the best height.  If none of them has answered
+        a request yet, let the peer database pick one.'''
         servers = self.get_interfaces()    # Those in connected state
         if self.default_server in servers:
             servers.remove(self.default_server)
-        if servers:
-            self.switch_to_interface(random.choice(servers))
+        if not servers:
+            return
+        height = max(self.heights.get(server, 0) for server in servers)
+        servers = [server for server in servers if self.heights.get(server, 0) == height]
+        timed = [server for server in servers if self.interfaces[server].expected_rtt() is not None]
+        if timed:
+            server = min(timed, key=lambda server: self.interfaces[server].expected_rtt())
+        else:
+            server = self.peer_db.choose(sorted(servers))
+        self.switch_to_interface(server)
 
     def switch_lagging_interface(self, suggestion = None):
         '''If auto_connect and lagging, switch interface'''
@@ -426,6 +750,7 @@ class Network(util.DaemonThread):
         i = self.interfaces[server]
         if self.interface != i:
             log.info("switching to %s", server)
+            self.metrics.switches += 1
             # stop any current interface in order to terminate subscriptions
             self.close_interface(self.interface)
             self.interface = i
@@ -438,8 +763,34 @@ class Network(util.DaemonThread):
             self.interfaces.pop(interface.server)
             if interface.server == self.default_server:
                 self.interface = None
+            self.catchup.interface_down(interface)
+            self.requeue_requests(interface)
             interface.close()
 
+    def requeue_requests(self, interface):
+        '''Put the unanswered client requests sent to interface back into
+        pending_sends, to be sent again once there is an interface'''
+        requeued = []
+        for message_id, request in sorted(self.unanswered_requests.items()):
+            method, params, callback, req_interface = request
+            if req_interface == interface:
+                del self.unanswered_requests[message_id]
+                twin = self.hedges.pop(message_id, None)
+                self.hedges.pop(twin, None)
+                if twin in self.unanswered_requests:
+                    # the other copy of the hedged request is still out
+                    continue
+                # sent again with the time of the first send, which the
+                # latency of the request is measured from
+                key = self.get_request_key(method, params)
+                queued = self.metrics.request_times.get(key, time.time())
+                requeued.append(([(method, params)], callback, queued))
+                waiting = self.inflight_requests.pop(key, [])
+                requeued.extend(([(method, params)], other, queued) for other in waiting)
+        if requeued:
+            with self.lock:
+                self.pending_sends[0:0] = requeued
+
     def process_response(self, interface, response, callbacks):
         if self.debug:
             log.debug("<-- %s", response)
@@ -450,13 +801,15 @@ class Network(util.DaemonThread):
 
         # We handle some responses; return the rest to the client.
         if method == 'server.version':
-            interface.server_version = result
+            if error is None:
+                interface.set_server_version(result)
         elif method == 'blockchain.headers.subscribe':
             if error is None:
                 self.on_header(interface, result)
         elif method == 'server.peers.subscribe':
             if error is None:
                 self.irc_servers = parse_servers(result)
+                self.peer_db.add_hosts(self.irc_servers)
                 self.notify('servers')
         elif method == 'server.banner':
             if error is None:
@@ -483,19 +836,45 @@ class Network(util.DaemonThread):
         """ hashable index for subscriptions and cache"""
         return str(method) + (':' + str(params[0]) if params  else '')
 
+    def get_request_key(self, method, params):
+        """ hashable index of a request with all its params, for
+        coalescing identical requests"""
+        return ResponseCache.key(method, params)
+
     def process_responses(self, interface):
         responses = interface.get_responses()
         for request, response in responses:
+            answered = None
             if request:
                 method, params, message_id = request
                 k = self.get_index(method, params)
                 # client requests go through self.send() with a
-                # callback, are only sent to the current interface,
-                # and are placed in the unanswered_requests dictionary
+                # callback, are sent to the interface picked by
+                # route_request, and are placed in the unanswered_requests
+                # dictionary
                 client_req = self.unanswered_requests.pop(message_id, None)
+                twin = self.hedges.pop(message_id, None)
+                self.hedges.pop(twin, None)
                 if client_req:
-                    assert interface == self.interface
-                    callbacks = [client_req[2]]
+                    callback = client_req[2]
+                    if response.get('error') and twin in self.unanswered_requests:
+                        # the other copy of the hedged request may succeed
+                        callbacks = []
+                    elif response.get('error') and self.interface and interface != self.interface:
+                        # the server we picked may be missing something the
+                        # main server has, like a mempool transaction
+                        interface.print_error("routed request failed, asking main server", method)
+                        message_id = self.queue_request(method, params)
+                        self.unanswered_requests[message_id] = method, params, callback, self.interface
+                        callbacks = []
+                    else:
+                        # the answer also goes to identical requests made
+                        # while this one was in flight
+                        answered = self.get_request_key(method, params)
+                        callbacks = [callback] + self.inflight_requests.pop(answered, [])
+                        # first answer of a hedged request wins
+                        self.unanswered_requests.pop(twin, None)
+                        self.cache_response(method, params, response)
                 else:
                     callbacks = []
                 # Copy the request method and params to the response
@@ -526,11 +905,14 @@ class Network(util.DaemonThread):
                 self.sub_cache[k] = response
             # Response is now in canonical form
             self.process_response(interface, response, callbacks)
+            if answered is not None:
+                self.metrics.request_answered(answered, method, response.get('error'))
 
     def send(self, messages, callback):
         '''Messages is a list of (method, params) tuples'''
         with self.lock:
-            self.pending_sends.append((messages, callback))
+            self.pending_sends.append((messages, callback, time.time()))
+        self.waker.wake()
 
     def process_pending_sends(self):
         # Requests needs connectivity.  If we don't have an interface,
@@ -542,11 +924,12 @@ class Network(util.DaemonThread):
             sends = self.pending_sends
             self.pending_sends = []
 
-        for messages, callback in sends:
+        routed = set([self.interface])
+        for messages, callback, queued in sends:
             for method, params in messages:
                 r = None
+                k = self.get_index(method, params)
                 if method.endswith('.subscribe'):
-                    k = self.get_index(method, params)
                     # add callback to list
                     l = self.subscriptions.get(k, [])
                     if callback not in l:
@@ -554,12 +937,83 @@ class Network(util.DaemonThread):
                     self.subscriptions[k] = l
                     # check cached response for subscriptions
                     r = self.sub_cache.get(k)
+                else:
+                    r = self.cached_response(method, params)
                 if r is not None:
                     util.print_error("cache hit", k)
+                    self.metrics.cache_hits[method] += 1
                     callback(r)
-                else:
-                    message_id = self.queue_request(method, params)
-                    self.unanswered_requests[message_id] = method, params, callback
+                    continue
+                if not method.endswith('.subscribe'):
+                    # share the answer of an identical request in flight
+                    key = self.get_request_key(method, params)
+                    if key in self.inflight_requests:
+                        self.inflight_requests[key].append(callback)
+                        self.coalesced_count += 1
+                        continue
+                    self.inflight_requests[key] = []
+                    self.metrics.request_sent(key, queued)
+                interface = self.route_request(method)
+                message_id = self.queue_request(method, params, interface)
+                self.unanswered_requests[message_id] = method, params, callback, interface
+                routed.add(interface)
+                if self.hedge_requests and is_stateless(method):
+                    self.schedule_hedge(message_id, interface, method)
+        # write right away rather than after the next select
+        for interface in routed:
+            if interface.wants_write():
+                interface.send_requests()
+
+    def route_request(self, method, exclude=None):
+        '''The interface to send a client request to.  Stateless requests
+        whose answers we can verify go to the interface expected to answer
+        first that is not behind the main server, everything else,
+        subscriptions in particular, to the main interface.  With exclude
+        given, returns another interface for a stateless request, or None.'''
+        if exclude is None and (not self.load_balance or not is_stateless(method)):
+            return self.interface
+        height = self.get_server_height()
+        candidates = [i for server, i in self.interfaces.items()
+                      if self.heights.get(server, 0) >= height and i != exclude]
+        if not candidates:
+            return self.interface if exclude is None else None
+        # ties go to the main interface
+        return min(candidates, key=lambda i: (self.expected_wait(i, method), i != self.interface))
+
+    def expected_wait(self, interface, method):
+        '''Estimated time for interface to answer a new method request'''
+        rtt = interface.expected_rtt(method)
+        if rtt is None:
+            rtt = DEFAULT_RTT
+        return (interface.queue_depth() + interface.in_flight() + 1) * rtt
+
+    def schedule_hedge(self, message_id, interface, method):
+        p95 = interface.rtt_p95(method)
+        if p95 is not None:
+            heapq.heappush(self.hedge_deadlines, (time.time() + max(p95, HEDGE_MIN_DELAY), message_id))
+
+    def send_hedges(self):
+        '''Send stateless requests that were not answered within the 95th
+        percentile round trip time of their server to a second server as
+        well.  The first answer goes to the callback, see
+        process_responses.'''
+        now = time.time()
+        while self.hedge_deadlines and self.hedge_deadlines[0][0] <= now:
+            _, message_id = heapq.heappop(self.hedge_deadlines)
+            request = self.unanswered_requests.get(message_id)
+            if request is None or message_id in self.hedges:
+                continue
+            method, params, callback, interface = request
+            other = self.route_request(method, exclude=interface)
+            if other is None:
+                continue
+            hedge_id = self.queue_request(method, params, other)
+            self.unanswered_requests[hedge_id] = method, params, callback, other
+            self.hedges[message_id] = hedge_id
+            self.hedges[hedge_id] = message_id
+            self.hedge_count += 1
+            if other.wants_write():
+                other.send_requests()
 
     def unsubscribe(self, callback):
         '''Unsubscribe a callback to free object references to enable GC.'''
@@ -578,26 +1032,57 @@ class Network(util.DaemonThread):
         if server == self.default_server:
             self.set_status('disconnected')
         if server in self.interfaces:
+            self.metrics.disconnects += 1
             self.close_interface(self.interfaces[server])
             self.heights.pop(server, None)
             self.notify('interfaces')
 
     def new_interface(self, server, socket):
-        self.interfaces[server] = interface = Interface(server, socket)
+        window = self.config.get('request_window', REQUEST_WINDOW)
+        self.interfaces[server] = interface = Interface(server, socket, window)
         self.queue_request('blockchain.headers.subscribe', [], interface)
         if server == self.default_server:
             self.switch_to_interface(server)
         self.notify('interfaces')
 
+    def maintain_connectors(self):
+        '''Hand finished non-blocking connections over to the socket queue'''
+        for server, connector in self.connectors.items():
+            connector.check_resolved()
+            if connector.has_timed_out():
+                connector.print_error("connection timed out")
+                connector.close()
+            if connector.done:
+                del self.connectors[server]
+                self.socket_queue.put((server, connector.socket))
+
+    def update_peer_db(self):
+        '''Record the round trip times and height lag of the connected
+        servers and save the peer database'''
+        best_height = max(self.heights.values()) if self.heights else 0
+        for server, interface in self.interfaces.items():
+            if server in self.heights:
+                self.peer_db.update(server, interface.expected_rtt(),
+                                    best_height - self.heights[server])
+        self.peer_db.save()
+        self.peer_db_time = time.time()
+
     def maintain_sockets(self):
         '''Socket maintenance.'''
+        self.maintain_connectors()
         # Responses to connection attempts?
         while not self.socket_queue.empty():
             server, socket = self.socket_queue.get()
             self.connecting.remove(server)
+            started = self.connect_times.pop(server, None)
             if socket:
+                if started is not None:
+                    self.peer_db.connected(server, time.time() - started)
+                self.metrics.connects += 1
                 self.new_interface(server, socket)
             else:
+                self.peer_db.failed(server)
+                self.metrics.connect_failures += 1
                 self.connection_down(server)
 
         # Send pings and shut down stale interfaces
@@ -609,6 +1094,8 @@ class Network(util.DaemonThread):
                 self.queue_request('server.version', params, interface)
 
         now = time.time()
+        if now - self.peer_db_time > PEER_DB_INTERVAL:
+            self.update_peer_db()
         # nodes
         if len(self.interfaces) + len(self.connecting) < self.num_server:
             self.start_random_interface()
@@ -630,34 +1117,11 @@ class Network(util.DaemonThread):
                 else:
                     self.switch_to_interface(self.default_server)
 
-    def request_chunk(self, interface, data, idx):
-        log.debug("requesting chunk %d" % idx)
-        self.queue_request('blockchain.block.get_chunk', [idx], interface)
-        data['chunk_idx'] = idx
-        data['req_time'] = time.time()
-
-
-    def _caught_up_to_interface(self, data):
-        return self.get_local_height() >= data['if_height']
-
-    def _need_chunk_from_interface(self, data):
-        return self.get_local_height() + BLOCKS_PER_CHUNK <= data['if_height']
-
     def on_get_chunk(self, interface, response):
         '''Handle receiving a chunk of block headers'''
-        if self.bc_requests:
-            req_if, data = self.bc_requests[0]
-            req_idx = data.get('chunk_idx')
-            # Ignore unsolicited chunks
-            if req_if == interface and req_idx == response['params'][0]:
-                idx = self.blockchain.connect_chunk(req_idx, response['result'])
-                if idx < 0 or self._caught_up_to_interface(data):
-                    self.bc_requests.popleft()
-                    self.notify('updated')
-                elif self._need_chunk_from_interface(data):
-                    self.request_chunk(interface, data, idx)
-                else:
-                    self.request_header(interface, data, data['if_height'])
+        if self.catchup.on_chunk(interface, response['params'][0], response):
+            if not self.catchup.is_active():
+                self.notify('updated')
 
     def request_header(self, interface, data, height):
         log.debug("requesting header %d" % height)
@@ -697,7 +1161,10 @@ class Network(util.DaemonThread):
         if if_height < local_height:
             return False
         elif if_height > local_height + BLOCKS_PER_CHUNK:
-            self.request_chunk(interface, data, (local_height + 1) / BLOCKS_PER_CHUNK)
+            # hand the complete chunks over to the catch-up scheduler
+            self.catchup.extend(if_height)
+            self.catchup.maintain()
+            data['catchup'] = True
         else:
             self.request_header(interface, data, if_height)
         return True
@@ -713,7 +1180,15 @@ class Network(util.DaemonThread):
                 continue
 
             req_time = data.get('req_time')
-            if not req_time:
+            if data.get('catchup'):
+                if self.catchup.is_active():
+                    self.catchup.maintain()
+                else:
+                    # Chunks are done, get the remaining headers
+                    del data['catchup']
+                    if not self.bc_request_headers(interface, data):
+                        continue
+            elif not req_time:
                 # No requests sent yet.  This interface has a new height.
                 # Request headers if it is ahead of our blockchain
                 if not self.bc_request_headers(interface, data):
@@ -727,38 +1202,59 @@ class Network(util.DaemonThread):
             break
 
     def wait_on_sockets(self):
-        # Python docs say Windows doesn't like empty selects.
-        # Sleep to prevent busy looping
-        if not self.interfaces:
-            time.sleep(0.1)
-            return
-        rin = [i for i in self.interfaces.values()]
-        win = [i for i in self.interfaces.values() if i.unsent_requests]
+        connectors = [c for c in self.connectors.values() if not c.done and not c.resolving]
+        # The waker keeps the select from being empty, which Windows does
+        # not like, and ends it as soon as send() is called
+        rin = [self.waker] + self.interfaces.values()
+        rin += [c for c in connectors if not c.want_write]
+        win = [i for i in self.interfaces.values() if i.wants_write()]
+        win += [c for c in connectors if c.want_write]
+        timeout = 0.2 if self.interfaces or connectors else 0.1
+        if self.hedge_deadlines:
+            timeout = max(0, min(timeout, self.hedge_deadlines[0][0] - time.time()))
         try:
-            rout, wout, xout = select.select(rin, win, [], 0.2)
+            rout, wout, xout = select.select(rin, win, [], timeout)
         except socket.error as (code, msg):
             if code == errno.EINTR:
                 return
             raise
         assert not xout
+        if self.waker in rout:
+            # pending sends are processed later in this loop iteration
+            self.waker.clear()
+            rout.remove(self.waker)
         for interface in wout:
-            interface.send_requests()
+            if isinstance(interface, Connector):
+                interface.step()
+            else:
+                interface.send_requests()
         for interface in rout:
-            self.process_responses(interface)
+            if isinstance(interface, Connector):
+                interface.step()
+            elif interface.server in self.interfaces:
+                self.process_responses(interface)
 
     def run(self):
         log.info('Initializing the blockchain')
         self.blockchain.init()
         log.info('Blockchain initialized, starting run loop')
         while self.is_running():
+            start = time.time()
             self.maintain_sockets()
+            waited = time.time()
             self.wait_on_sockets()
+            start += time.time() - waited
             self.handle_bc_requests()
             self.run_jobs()    # Synchronizer and Verifier
             self.process_pending_sends()
+            self.send_hedges()
+            # time spent working, not waiting in select
+            self.metrics.loop.add(time.time() - start)
 
         log.info('Stopping network')
         self.stop_network()
+        self.blockchain.close()
+        self.waker.close()
         log.info("stopped")
 
     def on_header(self, i, header):
@@ -795,13 +1291,27 @@ class Network(util.DaemonThread):
             return 0
 
     def synchronous_get(self, request, timeout=30):
+        return self.synchronous_get_many([request], timeout)[0]
+
+    def synchronous_get_many(self, requests, timeout=30):
+        '''Send all requests at once and wait for their results, returned
+        in the order of requests.  The timeout applies to the whole set.'''
         queue = Queue.Queue()
-        self.send([request], queue.put)
-        try:
-            r = queue.get(True, timeout)
-        except Queue.Empty:
-            msg='Failed to get response from server within timeout of {}'.format(timeout)
-            raise BaseException(msg)
-        if r.get('error'):
-            raise BaseException(r.get('error'))
-        return r.get('result')
+        now = time.time()
+        sends = [([request], lambda r, i=i: queue.put((i, r)), now)
+                 for i, request in enumerate(requests)]
+        with self.lock:
+            self.pending_sends.extend(sends)
+        self.waker.wake()
+        results = [None] * len(requests)
+        deadline = time.time() + timeout
+        for _ in requests:
+            try:
+                i, r = queue.get(True, max(0, deadline - time.time()))
+            except Queue.Empty:
+                msg='Failed to get response from server within timeout of {}'.format(timeout)
+                raise BaseException(msg)
+            if r.get('error'):
+                raise BaseException(r.get('error'))
+            results[i] = r.get('result')
+        return results
@@ -3,6 +3,10 @@ Main network and testnet3 definitions
 """
 
 # these values follow the parameters in lbrycrd/src/chainparams.cpp
+#
+# checkpoints are (height, block hash, bits) entries of trusted blocks, headers synced
+# in a run that reaches a checkpoint are only checked for hash linkage. They can be
+# regenerated from a trusted headers file with the makecheckpoints command.
 
 blockchain_params = {
     'lbrycrd_main': {
@@ -13,7 +17,10 @@ blockchain_params = {
         'genesis_hash': '9c89283ba0f3227f6c03b70216b9f665f0118d5e0fa729cedf4fb34d6a34f463',
         'max_target': 0x0000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF,
         'genesis_bits': 0x1f00ffff,
-        'target_timespan': 150
+        'target_timespan': 150,
+        'checkpoints': [
+            (0, '9c89283ba0f3227f6c03b70216b9f665f0118d5e0fa729cedf4fb34d6a34f463', 0x1f00ffff),
+        ]
     },
     'lbrycrd_test': {
         'pubkey_address': 0,
@@ -23,7 +30,10 @@ blockchain_params = {
         'genesis_hash': '9c89283ba0f3227f6c03b70216b9f665f0118d5e0fa729cedf4fb34d6a34f463',
         'max_target': 0x0000FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF,
         'genesis_bits': 0x1f00ffff,
-        'target_timespan': 150
+        'target_timespan': 150,
+        'checkpoints': [
+            (0, '9c89283ba0f3227f6c03b70216b9f665f0118d5e0fa729cedf4fb34d6a34f463', 0x1f00ffff),
+        ]
     },
     'lbrycrd_regtest': {
         'pubkey_address': 0,
@@ -33,6 +43,9 @@ blockchain_params = {
         'genesis_hash': '6e3fcf1299d4ec5d79c3a4c91d624a4acf9e2e173d95a1a0504f677669687556',
         'max_target': 0x7FFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFF,
         'genesis_bits': 0x207fffff,
-        'target_timespan': 1
+        'target_timespan': 1,
+        'checkpoints': [
+            (0, '6e3fcf1299d4ec5d79c3a4c91d624a4acf9e2e173d95a1a0504f677669687556', 0x207fffff),
+        ]
     }
 }
@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import random
+import logging
+
+import util
+
+log = logging.getLogger(__name__)
+
+# records of servers not connected to for this long are dropped
+PEER_EXPIRY = 14 * 24 * 3600
+# a server that connected within this time is assumed to be up
+RECENT_SUCCESS = 24 * 3600
+# seconds assumed for servers that have not been timed yet
+DEFAULT_HANDSHAKE = 1.0
+DEFAULT_RTT = 0.5
+# weight of the latest sample in the handshake and rtt averages
+ALPHA = 0.3
+
+
+class PeerRecord(object):
+    """Connection history of one server"""
+    __slots__ = ('attempts', 'successes', 'handshake', 'rtt', 'lag',
+                 'last_seen', 'last_failure')
+
+    def __init__(self, attempts=0, successes=0, handshake=None, rtt=None,
+                 lag=0, last_seen=0, last_failure=0):
+        self.attempts = attempts
+        self.successes = successes
+        self.handshake = handshake
+        self.rtt = rtt
+        self.lag = lag
+        self.last_seen = last_seen
+        self.last_failure = last_failure
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def score(self):
+        """Relative chance of picking this server.  The success rate
+        counts as if there had been one more success and one more
+        failure, so that new and rarely tried servers get a fair share.
+        It is divided by the expected time until the server is usable,
+        and by how many blocks behind it was last seen."""
+        success_rate = (self.successes + 1.0) / (self.attempts + 2.0)
+        handshake = self.handshake if self.handshake is not None else DEFAULT_HANDSHAKE
+        rtt = self.rtt if self.rtt is not None else DEFAULT_RTT
+        return success_rate / (1 + handshake + rtt) / (1 + self.lag)
+
+
+def average(old, sample):
+    if old is None:
+        return sample
+    return old + ALPHA * (sample - old)
+
+
+class PeerDB(object):
+    """Servers seen so far and their connection health, kept in a JSON
+    file so that a restarted daemon prefers servers that worked before.
+
+    hosts holds the port map of every server learnt from
+    server.peers.subscribe, in the format of parse_servers.  records
+    holds a PeerRecord by serialized server."""
+
+    def __init__(self, path):
+        self.path = path
+        self.hosts = {}
+        self.records = {}
+        self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = util.get_json_codec().loads(f.read())
+            now = time.time()
+            for server, record in data.get('servers', {}).items():
+                record = PeerRecord(**record)
+                if now - max(record.last_seen, record.last_failure) < PEER_EXPIRY:
+                    self.records[str(server)] = record
+            self.hosts = data.get('hosts', {})
+        except (IOError, ValueError, TypeError) as e:
+            log.warning("cannot read peer database %s: %s", self.path, e)
+
+    def save(self):
+        if self.path is None:
+            return
+        data = {
+            'hosts': self.hosts,
+            'servers': dict((server, record.as_dict())
+                            for server, record in self.records.items()),
+        }
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(data, indent=2, sort_keys=True))
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as e:
+            log.warning("cannot save peer database %s: %s", self.path, e)
+
+    def get(self, server):
+        record = self.records.get(server)
+        if record is None:
+            record = self.records[server] = PeerRecord()
+        return record
+
+    def add_hosts(self, hostmap):
+        self.hosts.update(hostmap)
+
+    def connected(self, server, handshake):
+        record = self.get(server)
+        record.attempts += 1
+        record.successes += 1
+        record.handshake = average(record.handshake, handshake)
+        record.last_seen = time.time()
+
+    def failed(self, server):
+        record = self.get(server)
+        record.attempts += 1
+        record.last_failure = time.time()
+
+    def update(self, server, rtt, lag):
+        """Record the round trip time and the number of blocks behind the
+        best known height of a connected server"""
+        record = self.get(server)
+        if rtt is not None:
+            record.rtt = average(record.rtt, rtt)
+        record.lag = max(0, lag)
+        record.last_seen = time.time()
+
+    def recently_connected(self, server):
+        record = self.records.get(server)
+        return (record is not None and record.last_seen > record.last_failure and
+                time.time() - record.last_seen < RECENT_SUCCESS)
+
+    def score(self, server):
+        record = self.records.get(server)
+        return (record or PeerRecord()).score()
+
+    def choose(self, servers):
+        """Pick one of servers at random, weighted by score, or None"""
+        servers = list(servers)
+        if not servers:
+            return None
+        weights = [self.score(server) for server in servers]
+        point = random.uniform(0, sum(weights))
+        for server, weight in zip(servers, weights):
+            point -= weight
+            if point <= 0:
+                return server
+        return servers[-1]
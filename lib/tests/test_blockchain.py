@@ -0,0 +1,546 @@
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from lib import blockchain, lbrycrd, ripemd
+from lib.blockchain import HEADER_SIZE, BLOCKS_PER_CHUNK
+
+
+class FakeConfig(object):
+    def __init__(self, path, options=None):
+        self.path = path
+        self.options = options or {}
+
+    def get(self, key, default=None):
+        return self.options.get(key, default)
+
+
+def make_raw_header(height):
+    # not a valid chain, only distinct and well formed records
+    return struct.pack('<I32s32s32sIII', 1, chr(height % 256) * 32, 'm' * 32, 'c' * 32,
+                       1000 + height, 0x207fffff, height)
+
+
+class BlockchainTestCase(unittest.TestCase):
+    def setUp(self):
+        super(BlockchainTestCase, self).setUp()
+        self.lbryum_dir = tempfile.mkdtemp()
+        self.config = FakeConfig(self.lbryum_dir)
+
+    def tearDown(self):
+        super(BlockchainTestCase, self).tearDown()
+        shutil.rmtree(self.lbryum_dir)
+
+    def write_headers(self, count):
+        with open(os.path.join(self.lbryum_dir, 'blockchain_headers'), 'wb') as f:
+            for height in range(count):
+                f.write(make_raw_header(height))
+
+    def write_raw_headers(self, raws):
+        with open(os.path.join(self.lbryum_dir, 'blockchain_headers'), 'wb') as f:
+            f.write(''.join(raws))
+
+
+class TestHeaderStore(BlockchainTestCase):
+    def test_read_header_from_file(self):
+        self.write_headers(3)
+        chain = blockchain.LbryCrdReg(self.config, None)
+        self.assertEqual(2, chain.height())
+        self.assertEqual(make_raw_header(1), chain.read_raw_header(1))
+        self.assertEqual(1002, chain.read_header(2)['timestamp'])
+        self.assertIsNone(chain.read_header(3))
+        self.assertIsNone(chain.read_header(-1))
+
+    def test_read_header_without_file(self):
+        chain = blockchain.LbryCrdReg(self.config, None)
+        self.assertIsNone(chain.read_header(0))
+
+    def test_read_header_after_save_chunk(self):
+        self.write_headers(BLOCKS_PER_CHUNK)
+        chain = blockchain.LbryCrdReg(self.config, None)
+        self.assertIsNone(chain.read_header(BLOCKS_PER_CHUNK))
+        chunk = ''.join(make_raw_header(h) for h in range(BLOCKS_PER_CHUNK, 2 * BLOCKS_PER_CHUNK))
+        chain.save_chunk(1, chunk)
+        self.assertEqual(2 * BLOCKS_PER_CHUNK - 1, chain.height())
+        self.assertEqual(make_raw_header(BLOCKS_PER_CHUNK + 5),
+                         chain.read_raw_header(BLOCKS_PER_CHUNK + 5))
+        self.assertEqual(HEADER_SIZE, len(chain.read_raw_header(2 * BLOCKS_PER_CHUNK - 1)))
+
+
+class TestHeader(BlockchainTestCase):
+    def test_decode_header(self):
+        raw = make_raw_header(7)
+        header = blockchain.Header(raw, 7)
+        self.assertEqual(1, header['version'])
+        self.assertEqual(('07' * 32), header['prev_block_hash'])
+        self.assertEqual(('6d' * 32), header.get('merkle_root'))
+        self.assertEqual(('63' * 32), header.get('claim_trie_root'))
+        self.assertEqual(1007, header['timestamp'])
+        self.assertEqual(0x207fffff, header['bits'])
+        self.assertEqual(7, header['nonce'])
+        self.assertEqual(7, header['block_height'])
+        self.assertIsNone(header.get('utxo_root'))
+        self.assertRaises(KeyError, lambda: header['utxo_root'])
+
+    def test_header_without_height(self):
+        header = blockchain.Header(make_raw_header(7))
+        self.assertNotIn('block_height', header)
+        self.assertEqual(7, len(header.as_dict()))
+
+    def test_hash_header_matches_serialized_dict(self):
+        chain = blockchain.LbryCrdReg(self.config, None)
+        header = chain.deserialize_header(make_raw_header(3), 3)
+        as_dict = header.as_dict()
+        self.assertEqual(make_raw_header(3), chain.serialize_header(as_dict).decode('hex'))
+        self.assertEqual(chain.hash_header(as_dict), chain.hash_header(header))
+
+
+def make_linked_chain(count, start=0, prev_hash='\0' * 32, timestamp=1000):
+    raws = []
+    for height in range(start, start + count):
+        raw = struct.pack('<I32s32s32sIII', 1, prev_hash, 'm' * 32, 'c' * 32,
+                          timestamp + height, 0x207fffff, height)
+        raws.append(raw)
+        prev_hash = lbrycrd.Hash(raw)
+    return raws
+
+
+class TestVerifyChunks(BlockchainTestCase):
+    def test_broken_link_is_rejected_before_proof_of_work(self):
+        chain = blockchain.LbryCrdReg(FakeConfig(self.lbryum_dir, {'checkpoint_sync': False}), None)
+        raws = make_linked_chain(2 * BLOCKS_PER_CHUNK)
+        raws[BLOCKS_PER_CHUNK + 3] = make_raw_header(BLOCKS_PER_CHUNK + 3)
+        self.assertRaises(AssertionError, chain.verify_chunks, 0, ''.join(raws))
+
+    def test_partial_header_is_rejected(self):
+        chain = blockchain.LbryCrdReg(self.config, None)
+        data = ''.join(make_linked_chain(3))[:-1]
+        self.assertRaises(blockchain.ChainValidationError, chain.verify_chunks, 0, data)
+
+    def test_no_pool_by_default(self):
+        chain = blockchain.LbryCrdReg(self.config, None)
+        self.assertIsNone(chain.get_verification_pool())
+
+
+def pow_passes(raw, target):
+    return int(lbrycrd.hash_encode(blockchain.lbrycrd.PoWHash(raw)), 16) <= target
+
+
+def make_mined_chain(count, bits=0x207fffff, start=0, prev_hash='\0' * 32, timestamp=1000):
+    """A linked chain whose nonces meet the proof of work target of bits"""
+    target = blockchain.ArithUint256.fromCompact(bits)
+    raws = []
+    for height in range(start, start + count):
+        nonce = 0
+        while True:
+            raw = struct.pack('<I32s32s32sIII', 1, prev_hash, 'm' * 32, 'c' * 32,
+                              timestamp + height, bits, nonce)
+            if pow_passes(raw, target):
+                break
+            nonce += 1
+        raws.append(raw)
+        prev_hash = lbrycrd.Hash(raw)
+    return raws
+
+
+class ProofOfWorkTestCase(BlockchainTestCase):
+    def setUp(self):
+        super(ProofOfWorkTestCase, self).setUp()
+        # the lbrycrd module blockchain checks the proof of work with
+        self.lbrycrd = blockchain.lbrycrd
+        self.ripemd160 = self.lbrycrd.ripemd160
+        try:
+            hashlib.new('ripemd160')
+        except ValueError:
+            # hashlib may be built without ripemd160, use the pure python
+            # version lbrycrd.hash_160 falls back to.  Pool workers are
+            # forked after this, so they see it too.
+            self.lbrycrd.ripemd160 = lambda x: ripemd.new(x).digest()
+
+    def tearDown(self):
+        self.lbrycrd.ripemd160 = self.ripemd160
+        super(ProofOfWorkTestCase, self).tearDown()
+
+
+class TestProofOfWork(ProofOfWorkTestCase):
+    def setUp(self):
+        super(TestProofOfWork, self).setUp()
+        self.target = blockchain.ArithUint256.fromCompact(0x207fffff)
+        self.raws = make_mined_chain(2 * BLOCKS_PER_CHUNK)
+        self.chains = []
+
+    def tearDown(self):
+        for chain in self.chains:
+            chain.close()
+        super(TestProofOfWork, self).tearDown()
+
+    def make_chain(self, workers):
+        chain = blockchain.LbryCrdReg(FakeConfig(self.lbryum_dir, {
+            'checkpoint_sync': False, 'verification_workers': workers}), None)
+        self.chains.append(chain)
+        return chain
+
+    def with_bad_nonce(self):
+        raws = list(self.raws)
+        raw = raws[-1]
+        nonce = struct.unpack('<I', raw[-4:])[0]
+        while True:
+            nonce += 1
+            raw = raw[:-4] + struct.pack('<I', nonce)
+            if not pow_passes(raw, self.target):
+                break
+        raws[-1] = raw
+        return ''.join(raws)
+
+    def rejection(self, chain, data):
+        try:
+            chain.verify_chunks(0, data)
+        except (AssertionError, blockchain.ChainValidationError) as e:
+            return type(e), str(e)
+        self.fail("chain was not rejected")
+
+    def test_check_proof_of_work(self):
+        data = ''.join(self.raws[:3])
+        self.assertIsNone(blockchain.check_proof_of_work((5, data, [self.target] * 3)))
+        height, pow_hash, target = blockchain.check_proof_of_work((5, data, [self.target, 0, 0]))
+        self.assertEqual((6, 0), (height, target))
+        self.assertGreater(pow_hash, 0)
+
+    def test_pool_matches_serial(self):
+        serial = self.make_chain(0)
+        pooled = self.make_chain(2)
+        data = ''.join(self.raws)
+        serial.verify_chunks(0, data)
+        pooled.verify_chunks(0, data)
+        self.assertIsNone(serial.get_verification_pool())
+        self.assertIsNotNone(pooled.get_verification_pool())
+
+    def test_bad_nonce_is_rejected(self):
+        data = self.with_bad_nonce()
+        serial = self.rejection(self.make_chain(0), data)
+        pooled = self.rejection(self.make_chain(2), data)
+        self.assertEqual(blockchain.ChainValidationError, serial[0])
+        self.assertIn('at height %d' % (2 * BLOCKS_PER_CHUNK - 1), serial[1])
+        self.assertEqual(serial, pooled)
+
+    def test_bad_bits_are_rejected(self):
+        # the target is taken from the bits, so the header is held to a
+        # target 256 times lower, which its nonce does not meet
+        raws = list(self.raws)
+        raws[-1] = raws[-1][:-8] + struct.pack('<I', 0x1f7fffff) + raws[-1][-4:]
+        data = ''.join(raws)
+        serial = self.rejection(self.make_chain(0), data)
+        pooled = self.rejection(self.make_chain(2), data)
+        self.assertEqual(blockchain.ChainValidationError, serial[0])
+        self.assertIn('at height %d' % (2 * BLOCKS_PER_CHUNK - 1), serial[1])
+        self.assertEqual(serial, pooled)
+
+
+class TestCheckpoints(ProofOfWorkTestCase):
+    def setUp(self):
+        super(TestCheckpoints, self).setUp()
+        self.raws = make_linked_chain(3 * BLOCKS_PER_CHUNK)
+        self.headers_path = os.path.join(self.lbryum_dir, 'trusted_headers')
+        with open(self.headers_path, 'wb') as f:
+            f.write(''.join(self.raws))
+
+    def test_make_checkpoints(self):
+        checkpoints = blockchain.make_checkpoints(self.headers_path, 2)
+        self.assertEqual([0, 2 * BLOCKS_PER_CHUNK - 1], [c[0] for c in checkpoints])
+        height, block_hash, bits = checkpoints[1]
+        self.assertEqual(lbrycrd.hash_encode(lbrycrd.Hash(self.raws[height])), block_hash)
+        self.assertEqual(0x207fffff, bits)
+
+    def test_linkage_only_up_to_checkpoint(self):
+        checkpoints = blockchain.make_checkpoints(self.headers_path, 1)
+        chain = blockchain.LbryCrdReg(FakeConfig(self.lbryum_dir, {'checkpoints': checkpoints}), None)
+        self.assertEqual(3 * BLOCKS_PER_CHUNK - 1, chain.get_checkpoint_height(0, 3 * BLOCKS_PER_CHUNK - 1))
+        self.assertEqual(BLOCKS_PER_CHUNK - 1, chain.get_checkpoint_height(0, 2 * BLOCKS_PER_CHUNK - 2))
+        # no proof of work is checked, none of these headers were mined
+        chain.verify_chunks(0, ''.join(self.raws))
+
+    def test_proof_of_work_is_checked_short_of_the_checkpoint(self):
+        # a run that does not reach a checkpoint could be made up by the
+        # server, it is only accepted with valid proof of work
+        checkpoints = blockchain.make_checkpoints(self.headers_path, 3)
+        chain = blockchain.LbryCrdReg(FakeConfig(self.lbryum_dir, {'checkpoints': checkpoints}), None)
+        self.assertEqual(0, chain.get_checkpoint_height(0, 2 * BLOCKS_PER_CHUNK - 1))
+        self.assertRaises(blockchain.ChainValidationError,
+                          chain.verify_chunks, 0, ''.join(self.raws[:2 * BLOCKS_PER_CHUNK]))
+        mined = make_mined_chain(2 * BLOCKS_PER_CHUNK)
+        checkpoints[0] = (0, lbrycrd.hash_encode(lbrycrd.Hash(mined[0])), 0x207fffff)
+        chain = blockchain.LbryCrdReg(FakeConfig(self.lbryum_dir, {'checkpoints': checkpoints}), None)
+        chain.verify_chunks(0, ''.join(mined))
+
+    def test_next_checkpoint_height(self):
+        checkpoints = blockchain.make_checkpoints(self.headers_path, 1)
+        chain = blockchain.LbryCrdReg(FakeConfig(self.lbryum_dir, {'checkpoints': checkpoints}), None)
+        self.assertEqual(0, chain.get_next_checkpoint_height(-1))
+        self.assertEqual(BLOCKS_PER_CHUNK - 1, chain.get_next_checkpoint_height(0))
+        self.assertEqual(2 * BLOCKS_PER_CHUNK - 1, chain.get_next_checkpoint_height(BLOCKS_PER_CHUNK - 1))
+        self.assertIsNone(chain.get_next_checkpoint_height(3 * BLOCKS_PER_CHUNK - 1))
+
+    def test_checkpoint_mismatch(self):
+        checkpoints = blockchain.make_checkpoints(self.headers_path, 1)
+        checkpoints[1] = (checkpoints[1][0], '00' * 32, checkpoints[1][2])
+        chain = blockchain.LbryCrdReg(FakeConfig(self.lbryum_dir, {'checkpoints': checkpoints}), None)
+        self.assertRaises(AssertionError, chain.verify_chunks, 0, ''.join(self.raws))
+
+    def test_checkpoint_sync_disabled(self):
+        config = FakeConfig(self.lbryum_dir, {'checkpoint_sync': False})
+        chain = blockchain.LbryCrdReg(config, None)
+        self.assertEqual(-1, chain.get_checkpoint_height(0, 3 * BLOCKS_PER_CHUNK - 1))
+        self.assertIsNone(chain.get_next_checkpoint_height(-1))
+
+
+class TestHeadersBootstrap(BlockchainTestCase):
+    def setUp(self):
+        super(TestHeadersBootstrap, self).setUp()
+        self.raws = make_linked_chain(3 * BLOCKS_PER_CHUNK + 10)
+        self.source = os.path.join(self.lbryum_dir, 'headers_source')
+        with open(self.source, 'wb') as f:
+            f.write(''.join(self.raws))
+        self.headers_path = os.path.join(self.lbryum_dir, 'blockchain_headers')
+        checkpoints = blockchain.make_checkpoints(self.source, 1)
+        # cover the trailing partial chunk too, so that no proof of work is checked
+        last = len(self.raws) - 1
+        checkpoints.append((last, lbrycrd.hash_encode(lbrycrd.Hash(self.raws[last])), 0x207fffff))
+        self.config = FakeConfig(self.lbryum_dir, {'checkpoints': checkpoints,
+                                                   'headers_url': 'file://' + self.source})
+
+    def test_download_from_file_url(self):
+        chain = blockchain.LbryCrdReg(self.config, None)
+        chain.init()
+        self.assertEqual(len(self.raws) - 1, chain.height())
+        self.assertEqual(self.raws[-1], chain.read_raw_header(len(self.raws) - 1))
+        self.assertFalse(os.path.exists(self.headers_path + '.download'))
+        self.assertFalse(chain.retrieving_headers)
+
+    def test_resume_interrupted_download(self):
+        with open(self.headers_path, 'wb') as f:
+            f.write(''.join(self.raws[:BLOCKS_PER_CHUNK + 5]))
+        open(self.headers_path + '.download', 'w').close()
+        chain = blockchain.LbryCrdReg(self.config, None)
+        chain.init()
+        self.assertEqual(len(self.raws) - 1, chain.height())
+        with open(self.headers_path, 'rb') as f:
+            self.assertEqual(''.join(self.raws), f.read())
+
+    def test_complete_file_is_not_downloaded(self):
+        with open(self.headers_path, 'wb') as f:
+            f.write(''.join(self.raws[:5]))
+        chain = blockchain.LbryCrdReg(self.config, None)
+        chain.init()
+        self.assertEqual(4, chain.height())
+
+    def test_download_stops_at_invalid_chunk(self):
+        self.raws[BLOCKS_PER_CHUNK + 3] = make_raw_header(7)
+        with open(self.source, 'wb') as f:
+            f.write(''.join(self.raws))
+        chain = blockchain.LbryCrdReg(self.config, None)
+        chain.init()
+        self.assertEqual(BLOCKS_PER_CHUNK - 1, chain.height())
+        self.assertFalse(os.path.exists(self.headers_path + '.download'))
+
+    def test_failed_download_keeps_marker(self):
+        self.config.options['headers_url'] = 'file://' + os.path.join(self.lbryum_dir, 'missing')
+        chain = blockchain.LbryCrdReg(self.config, None)
+        chain.init()
+        self.assertEqual(-1, chain.height())
+        self.assertTrue(os.path.exists(self.headers_path + '.download'))
+
+
+class TestBlockHashIndex(BlockchainTestCase):
+    def setUp(self):
+        super(TestBlockHashIndex, self).setUp()
+        self.path = os.path.join(self.lbryum_dir, 'blockchain_hashes')
+        self.hashes = [lbrycrd.Hash(str(height)) for height in range(1500)]
+
+    def test_lookup_by_height_and_hash(self):
+        index = blockchain.BlockHashIndex(self.path)
+        index.put(0, self.hashes[:700])
+        index.put(700, self.hashes[700:])
+        self.assertEqual(1500, len(index))
+        for height in (0, 1, 699, 700, 1499):
+            self.assertEqual(self.hashes[height], index.get(height))
+            self.assertEqual(height, index.height_of(self.hashes[height]))
+        self.assertIsNone(index.get(1500))
+        self.assertIsNone(index.height_of(lbrycrd.Hash('missing')))
+
+    def test_index_is_persistent(self):
+        blockchain.BlockHashIndex(self.path).put(0, self.hashes)
+        index = blockchain.BlockHashIndex(self.path)
+        self.assertEqual(1234, index.height_of(self.hashes[1234]))
+
+    def test_overwritten_height(self):
+        index = blockchain.BlockHashIndex(self.path)
+        index.put(0, self.hashes[:10])
+        replacement = lbrycrd.Hash('replacement')
+        index.put(5, [replacement])
+        self.assertEqual(5, index.height_of(replacement))
+        self.assertIsNone(index.height_of(self.hashes[5]))
+
+    def test_overwritten_slots_count_as_dead(self):
+        index = blockchain.BlockHashIndex(self.path)
+        index.put(0, self.hashes[:400])
+        for n in range(200):
+            index.put(399, [lbrycrd.Hash('replacement %d' % n)])
+        # dead slots forced a rebuild, which dropped them
+        self.assertLess(index._dead, 200)
+        self.assertLessEqual(2 * (len(index) + index._dead), index._mask + 1)
+        self.assertEqual(399, index.height_of(lbrycrd.Hash('replacement 199')))
+        self.assertIsNone(index.height_of(lbrycrd.Hash('replacement 198')))
+        self.assertEqual(398, index.height_of(self.hashes[398]))
+
+    def test_old_index_format_is_rebuilt(self):
+        blockchain.BlockHashIndex(self.path).put(0, self.hashes[:10])
+        with open(self.path + '.idx', 'wb') as f:
+            f.write('\0' * (4 + 4 * 1024))
+        index = blockchain.BlockHashIndex(self.path)
+        self.assertEqual(7, index.height_of(self.hashes[7]))
+
+    def test_truncate(self):
+        index = blockchain.BlockHashIndex(self.path)
+        index.put(0, self.hashes[:10])
+        index.truncate(4)
+        self.assertEqual(4, len(index))
+        self.assertIsNone(index.height_of(self.hashes[6]))
+        self.assertEqual(3, index.height_of(self.hashes[3]))
+
+    def test_index_built_for_existing_headers(self):
+        raws = make_linked_chain(BLOCKS_PER_CHUNK + 3)
+        with open(os.path.join(self.lbryum_dir, 'blockchain_headers'), 'wb') as f:
+            f.write(''.join(raws))
+        chain = blockchain.LbryCrdReg(self.config, None)
+        block_hash = lbrycrd.hash_encode(lbrycrd.Hash(raws[50]))
+        self.assertEqual(block_hash, chain.get_block_hash_at(50))
+        self.assertEqual(50, chain.get_height_of_block(block_hash))
+        self.assertIsNone(chain.get_height_of_block('not a hash'))
+        self.assertEqual(chain.hash_header(chain.read_header(BLOCKS_PER_CHUNK + 2)),
+                         chain.get_block_hash_at(BLOCKS_PER_CHUNK + 2))
+
+    def test_save_chunk_updates_index(self):
+        raws = make_linked_chain(2 * BLOCKS_PER_CHUNK)
+        chain = blockchain.LbryCrdReg(self.config, None)
+        open(os.path.join(self.lbryum_dir, 'blockchain_headers'), 'wb').close()
+        chain.save_chunk(0, ''.join(raws[:BLOCKS_PER_CHUNK]))
+        chain.save_chunk(1, ''.join(raws[BLOCKS_PER_CHUNK:]))
+        block_hash = lbrycrd.hash_encode(lbrycrd.Hash(raws[-1]))
+        self.assertEqual(2 * BLOCKS_PER_CHUNK - 1, chain.get_height_of_block(block_hash))
+
+    def test_crash_after_reorg_is_repaired_on_open(self):
+        raws = make_linked_chain(20)
+        self.write_raw_headers(raws)
+        chain = blockchain.LbryCrdReg(self.config, None)
+        fork = make_linked_chain(5, 15, lbrycrd.Hash(raws[14]), timestamp=5000)
+
+        def crash(height, block_hashes):
+            raise KeyboardInterrupt
+        chain.block_hashes.put = crash
+        self.assertRaises(KeyboardInterrupt, chain.write_headers, 15, ''.join(fork))
+
+        chain = blockchain.LbryCrdReg(self.config, None)
+        for height in range(15, 20):
+            block_hash = lbrycrd.hash_encode(lbrycrd.Hash(fork[height - 15]))
+            self.assertEqual(block_hash, chain.get_block_hash_at(height))
+            self.assertEqual(height, chain.get_height_of_block(block_hash))
+            self.assertIsNone(chain.get_height_of_block(lbrycrd.hash_encode(lbrycrd.Hash(raws[height]))))
+        self.assertEqual(14, chain.get_height_of_block(lbrycrd.hash_encode(lbrycrd.Hash(raws[14]))))
+        self.assertIsNone(chain.block_hashes.stale_height())
+
+
+class FakeNetwork(object):
+    def __init__(self):
+        self.events = []
+
+    def trigger_callback(self, event, *args):
+        self.events.append((event,) + args)
+
+
+class TestForks(ProofOfWorkTestCase):
+    def setUp(self):
+        super(TestForks, self).setUp()
+        self.raws = make_mined_chain(10)
+        self.write_raw_headers(self.raws)
+        checkpoints = [(0, lbrycrd.hash_encode(lbrycrd.Hash(self.raws[0])), 0x207fffff)]
+        self.network = FakeNetwork()
+        self.chain = blockchain.LbryCrdReg(FakeConfig(self.lbryum_dir, {'checkpoints': checkpoints}),
+                                           self.network)
+        # a competing branch on top of height 7
+        self.fork = make_mined_chain(3, start=8, prev_hash=lbrycrd.Hash(self.raws[7]), timestamp=5000)
+
+    def headers(self, raws, start):
+        return [self.chain.deserialize_header(raw, start + i) for i, raw in enumerate(raws)]
+
+    def test_branch_with_equal_work_is_kept_as_fork(self):
+        self.assertTrue(self.chain.save_chain(self.headers(self.fork[:2], 8)[::-1], 8))
+        self.assertEqual(9, self.chain.height())
+        self.assertEqual(self.raws[9], self.chain.read_raw_header(9))
+        self.assertEqual(2, len(self.chain.fork_headers))
+        self.assertEqual([], self.network.events)
+
+    def test_switch_to_branch_with_more_work(self):
+        self.chain.save_chain(self.headers(self.fork[:2], 8)[::-1], 8)
+        tip = self.chain.deserialize_header(self.fork[2], 10)
+        self.assertFalse(self.chain.need_previous(tip))
+        self.assertTrue(self.chain.save_chain([tip], 10))
+        self.assertEqual(10, self.chain.height())
+        self.assertEqual(self.fork[0], self.chain.read_raw_header(8))
+        self.assertEqual(lbrycrd.hash_encode(lbrycrd.Hash(self.fork[2])),
+                         self.chain.get_block_hash_at(10))
+        self.assertEqual([('reorg', 8)], self.network.events)
+        # the replaced headers are kept in case the old chain comes back
+        self.assertEqual(set(lbrycrd.hash_encode(lbrycrd.Hash(raw)) for raw in self.raws[8:]),
+                         set(self.chain.fork_headers))
+
+    def test_unconnected_chain_is_rejected(self):
+        orphan = make_linked_chain(1, 11, 'x' * 32)
+        self.assertTrue(self.chain.need_previous(self.headers(orphan, 11)[0]))
+        self.assertFalse(self.chain.save_chain(self.headers(orphan, 11), 11))
+        self.assertEqual(9, self.chain.height())
+
+
+class TestTargets(BlockchainTestCase):
+    def test_compact_round_trip(self):
+        for bits in (0x1d00ffff, 0x1b0404cb, 0x207fffff, 0x03123456, 0x04008000):
+            self.assertEqual(bits, blockchain.ArithUint256.SetCompact(bits).GetCompact())
+
+    def test_compact_sign_bit(self):
+        self.assertEqual(0x04008000, blockchain.ArithUint256(0x800000).GetCompact())
+        self.assertEqual(0x01120000, blockchain.ArithUint256(0x12).GetCompact())
+        self.assertEqual(0x02008000, blockchain.ArithUint256(0x80).GetCompact())
+
+    def test_bits(self):
+        self.assertEqual([0, 1, 8, 9, 256],
+                         [blockchain.ArithUint256(v).bits() for v in (0, 1, 0x80, 0x100, 2 ** 256 - 1)])
+
+    def test_target_is_cached(self):
+        chain = blockchain.LbryCrdReg(self.config, None)
+        first = {'timestamp': 1000, 'bits': 0x207fffff}
+        last = {'timestamp': 1150, 'bits': 0x207fffff}
+        result = chain.get_target(1, first, last)
+        self.assertEqual((0x207fffff, blockchain.ArithUint256.fromCompact(0x207fffff)), result)
+        self.assertEqual(1, len(chain._target_cache))
+        self.assertEqual(result, chain.get_target(2, last, {'timestamp': 1300, 'bits': 0x207fffff}))
+        self.assertEqual(1, len(chain._target_cache))
+
+
+class TestSaveHeaders(BlockchainTestCase):
+    def test_save_run_of_headers(self):
+        raws = make_linked_chain(10)
+        self.write_raw_headers(raws[:4])
+        chain = blockchain.LbryCrdReg(FakeConfig(self.lbryum_dir, {'headers_durability': 'fsync'}), None)
+        chain.save_headers([chain.deserialize_header(raw, h) for h, raw in enumerate(raws[4:], 4)])
+        self.assertEqual(9, chain.height())
+        self.assertEqual(''.join(raws), open(chain.path(), 'rb').read())
+        self.assertEqual(lbrycrd.hash_encode(lbrycrd.Hash(raws[7])), chain.get_block_hash_at(7))
+
+    def test_wrong_size_header_is_rejected(self):
+        chain = blockchain.LbryCrdReg(self.config, None)
+        open(chain.path(), 'wb').close()
+        header = chain.deserialize_header(make_raw_header(0), 0)
+        header = dict(header.items(), prev_block_hash='00')
+        self.assertRaises(blockchain.ChainValidationError, chain.save_headers, [header])
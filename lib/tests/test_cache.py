@@ -0,0 +1,58 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lib.cache import ResponseCache
+
+
+class TestResponseCache(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_hits_and_misses(self):
+        cache = ResponseCache()
+        key = ResponseCache.key('blockchain.transaction.get', ['ab'])
+        self.assertIsNone(cache.get(key))
+        cache.put(key, '0100')
+        self.assertEqual('0100', cache.get(key))
+        self.assertEqual(1, cache.hits)
+        self.assertEqual(1, cache.misses)
+
+    def test_results_are_copies(self):
+        cache = ResponseCache()
+        cache.put('k', {'merkle': ['a'], 'pos': 1})
+        cache.get('k')['merkle'].append('b')
+        self.assertEqual({'merkle': ['a'], 'pos': 1}, cache.get('k'))
+
+    def test_least_recently_used_is_evicted(self):
+        cache = ResponseCache(size=30)
+        cache.put('a', 'x' * 8)
+        cache.put('b', 'x' * 8)
+        cache.get('a')
+        cache.put('c', 'x' * 8)
+        self.assertEqual(['a', 'c'], list(cache.entries))
+        self.assertLessEqual(cache.size, 30)
+
+    def test_disk_tier(self):
+        cache = ResponseCache(self.cache_dir, size=30)
+        cache.put('a', 'x' * 20)
+        cache.put('b', 'y' * 20)
+        self.assertNotIn('a', cache.entries)
+        self.assertEqual('x' * 20, cache.get('a'))
+        reopened = ResponseCache(self.cache_dir)
+        self.assertEqual('y' * 20, reopened.get('b'))
+        self.assertEqual(cache.disk_usage, reopened.disk_usage)
+
+    def test_disk_is_trimmed(self):
+        cache = ResponseCache(self.cache_dir, disk_size=100)
+        for n in range(10):
+            cache.put('key%d' % n, 'x' * 20)
+            path = cache.file_path('key%d' % n)
+            os.utime(path, (n, n))
+        self.assertLessEqual(cache.disk_usage, 100)
+        self.assertTrue(os.path.exists(cache.file_path('key9')))
+        self.assertFalse(os.path.exists(cache.file_path('key0')))
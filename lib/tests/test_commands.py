@@ -26,6 +26,17 @@ class MocNetwork(object):
     pass
 
 
+class ClaimsNetwork(object):
+    def __init__(self, claims):
+        self.claims = claims
+        self.calls = []
+
+    def synchronous_get_many(self, requests):
+        self.calls.append(len(requests))
+        return [dict((claim_id, dict(self.claims[claim_id])) for claim_id in claim_ids)
+                for method, claim_ids in requests]
+
+
 class MocCommands(commands.Commands):
     def __init__(self,wallet,network):
         self.wallet = wallet
@@ -54,6 +65,20 @@ class Test_Commands(unittest.TestCase):
         self.assertEqual(False, out['success'])
         self.assertEqual('Not enough funds', out['reason'])
 
+    def test_channel_queries_are_sent_in_growing_windows(self):
+        claims = dict((claim_id, {'claim_id': claim_id, 'name': 'other'}) for claim_id in 'abc')
+        claims['d'] = {'claim_id': 'd', 'name': 'name'}
+        network = ClaimsNetwork(claims)
+        cmds = MocCommands(MocWallet(), network)
+        queries = [('a',), ('b',), ('c',), ('d',)]
+        positions = dict((claim_id, n) for n, claim_id in enumerate('abcd'))
+        names = dict((claim_id, 'name') for claim_id in 'abcd')
+        pages = cmds.iter_channel_claims_pages(queries, positions, names, None, page_size=1)
+        page = next(pages)
+        self.assertEqual(['d'], [claim['claim_id'] for claim in page])
+        self.assertEqual(3, page[0]['absolute_channel_position'])
+        self.assertEqual([1, 2, 1], network.calls)
+
     def test_format_lbrycrd_keys(self):
         a = {'test': 1,
          'nOut': 1}
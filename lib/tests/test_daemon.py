@@ -0,0 +1,45 @@
+import json
+import unittest
+
+import jsonrpclib
+
+from lib import util
+from lib.daemon import RPCServer
+
+
+class TestRPCServer(unittest.TestCase):
+    def setUp(self):
+        util.set_json_codec('json')
+        self.server = RPCServer(('localhost', 0), logRequests=False)
+        self.server.register_function(lambda a, b: a + b, 'add')
+        self.server.register_function(lambda: 0.1 + 0.2, 'fee')
+
+    def tearDown(self):
+        self.server.server_close()
+
+    def dispatch(self, request):
+        return self.server._marshaled_dispatch(json.dumps(request))
+
+    def test_response_is_encoded_with_the_codec(self):
+        response = self.dispatch({'jsonrpc': '2.0', 'id': 1, 'method': 'add', 'params': [2, 3]})
+        self.assertNotIn(', ', response)
+        self.assertEqual({'jsonrpc': '2.0', 'id': 1, 'result': 5}, json.loads(response))
+        response = self.dispatch({'jsonrpc': '2.0', 'id': 2, 'method': 'fee', 'params': []})
+        self.assertEqual(0.1 + 0.2, json.loads(response)['result'])
+
+    def test_batch(self):
+        response = self.dispatch([{'jsonrpc': '2.0', 'id': 1, 'method': 'add', 'params': [1, 1]},
+                                  {'jsonrpc': '2.0', 'method': 'add', 'params': [1, 2]},
+                                  {'jsonrpc': '2.0', 'id': 3, 'method': 'add', 'params': [1, 3]}])
+        self.assertEqual([2, 4], [r['result'] for r in json.loads(response)])
+
+    def test_errors(self):
+        self.assertEqual(-32700, json.loads(self.server._marshaled_dispatch('{'))['error']['code'])
+        response = self.dispatch({'jsonrpc': '2.0', 'id': 1, 'method': 'add', 'params': [1]})
+        self.assertEqual(-32603, json.loads(response)['error']['code'])
+        self.assertEqual(1, json.loads(response)['id'])
+        response = self.dispatch({'jsonrpc': '2.0', 'id': 2, 'method': 'nosuchmethod', 'params': []})
+        self.assertEqual(-32601, json.loads(response)['error']['code'])
+
+    def test_jsonrpclib_json_module_is_untouched(self):
+        self.assertIs(json, jsonrpclib.jsonrpc.json)
@@ -1,3 +1,11 @@
+import json
+import os
+import select
+import shutil
+import socket
+import ssl
+import tempfile
+import time
 import unittest
 
 from lib import interface
@@ -24,3 +32,321 @@ class TestInterface(unittest.TestCase):
         self.assertTrue(i.check_host_name(
             peercert={'subject': [('commonName', 'foo.bar.com')]},
             name='foo.bar.com'))
+
+
+def drive(connector, timeout=5):
+    deadline = time.time() + timeout
+    while not connector.done and time.time() < deadline:
+        if connector.resolving:
+            connector.check_resolved()
+            time.sleep(0.01)
+            continue
+        if connector.want_write:
+            _, ready, _ = select.select([], [connector], [], 0.1)
+        else:
+            ready, _, _ = select.select([connector], [], [], 0.1)
+        if ready:
+            connector.step()
+    return connector.socket
+
+
+class TestConnector(unittest.TestCase):
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+
+    def test_tcp_connect(self):
+        connector = interface.Connector('127.0.0.1:%d:t' % self.port, None)
+        s = drive(connector)
+        self.assertIsNotNone(s)
+        peer, _ = self.listener.accept()
+        s.send('ping')
+        self.assertEqual('ping', peer.recv(4))
+        peer.close()
+        s.close()
+
+    def test_connection_refused(self):
+        self.listener.close()
+        connector = interface.Connector('127.0.0.1:%d:t' % self.port, None)
+        self.assertIsNone(drive(connector))
+        self.assertTrue(connector.done)
+
+    def test_close_abandons_connection(self):
+        connector = interface.Connector('127.0.0.1:%d:t' % self.port, None)
+        connector.close()
+        self.assertTrue(connector.done)
+        self.assertIsNone(connector.socket)
+
+    def test_slow_lookup_does_not_block(self):
+        getaddrinfo = socket.getaddrinfo
+        def slow_getaddrinfo(*args):
+            time.sleep(0.5)
+            return getaddrinfo(*args)
+        woken = []
+        interface.forget_addresses('localhost', self.port)
+        socket.getaddrinfo = slow_getaddrinfo
+        try:
+            start = time.time()
+            connector = interface.Connector('localhost:%d:t' % self.port, None,
+                                            lambda: woken.append(True))
+            self.assertLess(time.time() - start, 0.25)
+            self.assertTrue(connector.resolving)
+            connector.check_resolved()
+            self.assertTrue(connector.resolving)
+            s = drive(connector)
+        finally:
+            socket.getaddrinfo = getaddrinfo
+            interface.forget_addresses('localhost', self.port)
+        self.assertEqual([True], woken)
+        self.assertIsNotNone(s)
+        s.close()
+
+    def test_failed_lookup(self):
+        getaddrinfo = socket.getaddrinfo
+        def failing_getaddrinfo(*args):
+            raise socket.gaierror(-2, 'Name or service not known')
+        socket.getaddrinfo = failing_getaddrinfo
+        try:
+            connector = interface.Connector('nosuchhost.invalid:%d:t' % self.port, None)
+            self.assertIsNone(drive(connector))
+        finally:
+            socket.getaddrinfo = getaddrinfo
+        self.assertTrue(connector.done)
+
+
+class TestConnectionCaches(unittest.TestCase):
+    def setUp(self):
+        self.lookups = []
+        self.getaddrinfo = socket.getaddrinfo
+        def getaddrinfo(host, port, *args):
+            self.lookups.append(host)
+            return self.getaddrinfo(host, port, *args)
+        socket.getaddrinfo = getaddrinfo
+        interface.forget_addresses('127.0.0.1', 1)
+
+    def tearDown(self):
+        socket.getaddrinfo = self.getaddrinfo
+        interface.forget_addresses('127.0.0.1', 1)
+
+    def test_addresses_are_reused(self):
+        first = interface.resolve('127.0.0.1', 1)
+        self.assertEqual(first, interface.resolve('127.0.0.1', 1))
+        self.assertEqual(['127.0.0.1'], self.lookups)
+        interface.forget_addresses('127.0.0.1', 1)
+        interface.resolve('127.0.0.1', 1)
+        self.assertEqual(2, len(self.lookups))
+
+    def test_ssl_contexts_are_shared(self):
+        cert_dir = tempfile.mkdtemp()
+        try:
+            cert_path = os.path.join(cert_dir, 'cert')
+            shutil.copy(interface.ca_path, cert_path)
+            context = interface.get_ssl_context(cert_path)
+            self.assertIs(context, interface.get_ssl_context(cert_path))
+            self.assertEqual(ssl.CERT_REQUIRED, context.verify_mode)
+            os.utime(cert_path, (1, 1))
+            self.assertIsNot(context, interface.get_ssl_context(cert_path))
+            self.assertEqual(ssl.CERT_NONE, interface.get_ssl_context(None).verify_mode)
+        finally:
+            shutil.rmtree(cert_dir)
+
+
+class TestInterfaceSend(unittest.TestCase):
+    def test_send_does_not_block_on_full_socket(self):
+        local, remote = socket.socketpair()
+        i = interface.Interface('localhost:1:t', local, window=5000)
+        for n in range(2000):
+            i.queue_request('blockchain.address.get_history', ['x' * 500], n)
+        self.assertTrue(i.send_requests())
+        self.assertEqual(2000, len(i.unanswered_requests))
+        self.assertTrue(i.wants_write())
+        received = ''
+        while i.wants_write():
+            received += remote.recv(1 << 16)
+            i.send_requests()
+        local.close()
+        while True:
+            data = remote.recv(1 << 16)
+            if not data:
+                break
+            received += data
+        remote.close()
+        lines = received.splitlines()
+        self.assertEqual(2000, len(lines))
+        self.assertEqual(1999, json.loads(lines[-1])['id'])
+
+
+class TestRequestWindow(unittest.TestCase):
+    def setUp(self):
+        self.local, self.remote = socket.socketpair()
+        self.interface = interface.Interface('localhost:1:t', self.local, window=3)
+
+    def tearDown(self):
+        self.local.close()
+        self.remote.close()
+
+    def sent_ids(self):
+        return [json.loads(line)['id'] for line in self.remote.recv(1 << 16).splitlines()]
+
+    def test_window_limits_requests_in_flight(self):
+        for n in range(5):
+            self.interface.queue_request('blockchain.transaction.get', ['tx%d' % n], n)
+        self.interface.send_requests()
+        self.assertEqual([0, 1, 2], self.sent_ids())
+        self.assertEqual(3, self.interface.in_flight())
+        self.assertEqual(2, self.interface.queue_depth())
+        self.assertFalse(self.interface.wants_write())
+        # a response makes room for the next request
+        self.remote.send(json.dumps({'id': 1, 'result': 'raw'}) + '\n')
+        time.sleep(0.05)
+        self.assertEqual(1, len(self.interface.get_responses()))
+        self.assertTrue(self.interface.wants_write())
+        self.interface.send_requests()
+        self.assertEqual([3], self.sent_ids())
+        self.assertEqual(1, self.interface.queue_depth())
+
+    def test_headers_and_broadcasts_go_first(self):
+        self.interface.queue_request('blockchain.address.get_history', ['a'], 0)
+        self.interface.queue_request('blockchain.transaction.get', ['t'], 1)
+        self.interface.queue_request('blockchain.transaction.broadcast', ['raw'], 2)
+        self.interface.queue_request('server.banner', [], 3)
+        self.interface.queue_request('blockchain.block.get_header', [10], 4)
+        self.interface.send_requests()
+        self.assertEqual([2, 4, 3], self.sent_ids())
+
+
+class TestBatchRequests(unittest.TestCase):
+    def setUp(self):
+        self.local, self.remote = socket.socketpair()
+        self.interface = interface.Interface('localhost:1:t', self.local)
+
+    def tearDown(self):
+        self.local.close()
+        self.remote.close()
+
+    def sent_messages(self):
+        return [json.loads(line) for line in self.remote.recv(1 << 16).splitlines()]
+
+    def receive(self, message):
+        self.remote.send(json.dumps(message) + '\n')
+        time.sleep(0.05)
+        return self.interface.get_responses()
+
+    def queue_bulk(self, count):
+        for n in range(count):
+            self.interface.queue_request('blockchain.address.get_history', ['addr%d' % n], n)
+
+    def test_supports_batches(self):
+        self.assertTrue(interface.supports_batches(['ElectrumX 1.2', '1.1']))
+        self.assertTrue(interface.supports_batches('LBRYumX 0.0.1'))
+        self.assertFalse(interface.supports_batches('LBRYum 1.0'))
+        self.assertFalse(interface.supports_batches(None))
+
+    def test_single_requests_by_default(self):
+        self.queue_bulk(3)
+        self.interface.send_requests()
+        self.assertEqual([0, 1, 2], [m['id'] for m in self.sent_messages()])
+
+    def test_bulk_requests_are_batched(self):
+        self.interface.set_server_version(['LBRYumX 0.0.1', '1.1'])
+        self.queue_bulk(interface.BATCH_SIZE + 2)
+        self.interface.queue_request('server.banner', [], 100)
+        self.interface.send_requests()
+        messages = self.sent_messages()
+        self.assertEqual(100, messages[0]['id'])
+        self.assertEqual(interface.BATCH_SIZE, len(messages[1]))
+        self.assertEqual(2, len(messages[2]))
+        responses = self.receive([{'id': 1, 'result': []}, {'id': 0, 'result': []}])
+        self.assertEqual([('blockchain.address.get_history', ['addr1'], 1),
+                          ('blockchain.address.get_history', ['addr0'], 0)],
+                         [request for request, _ in responses])
+
+    def test_rejected_batch_is_sent_again_as_single_requests(self):
+        self.interface.set_server_version('ElectrumX 1.2')
+        self.queue_bulk(3)
+        self.interface.send_requests()
+        self.assertEqual(1, len(self.sent_messages()))
+        self.assertEqual([], self.receive({'id': None, 'error': 'invalid request'}))
+        self.assertFalse(self.interface.batching)
+        self.interface.send_requests()
+        self.assertEqual([0, 1, 2], [m['id'] for m in self.sent_messages()])
+
+    def test_only_the_rejected_batch_is_sent_again(self):
+        self.interface.set_server_version('ElectrumX 1.2')
+        self.queue_bulk(interface.BATCH_SIZE + 2)
+        self.interface.send_requests()
+        first, second = self.sent_messages()
+        answers = [{'id': m['id'], 'result': []} for m in first]
+        self.assertEqual(interface.BATCH_SIZE, len(self.receive(answers)))
+        self.assertEqual([], self.receive({'id': None, 'error': 'invalid request'}))
+        self.interface.send_requests()
+        self.assertEqual([m['id'] for m in second], [m['id'] for m in self.sent_messages()])
+        self.assertEqual(2, len(self.interface.unanswered_requests))
+        self.assertEqual(set(m['id'] for m in second), set(self.interface.sent_times))
+        self.assertEqual(set(), self.interface.requeued_ids)
+
+    def test_late_answers_to_unidentified_batch_are_dropped(self):
+        self.interface.set_server_version('ElectrumX 1.2')
+        self.queue_bulk(interface.BATCH_SIZE + 2)
+        self.interface.send_requests()
+        first, second = self.sent_messages()
+        # either batch may have been rejected, both are sent again
+        self.assertEqual([], self.receive({'id': None, 'error': 'invalid request'}))
+        self.assertEqual({}, self.interface.sent_times)
+        self.interface.send_requests()
+        self.assertEqual(interface.BATCH_SIZE + 2, len(self.sent_messages()))
+        answers = [{'id': m['id'], 'result': []} for m in first]
+        self.assertEqual(interface.BATCH_SIZE, len(self.receive(answers)))
+        # the single requests of the accepted batch are answered again
+        for m in first:
+            self.assertEqual([], self.receive({'id': m['id'], 'result': []}))
+        responses = self.receive([{'id': m['id'], 'result': []} for m in second])
+        self.assertEqual(2, len(responses))
+        self.assertNotIn((None, None), responses)
+        self.assertEqual({}, self.interface.unanswered_requests)
+
+
+class TestLatency(unittest.TestCase):
+    def test_ewma(self):
+        stats = interface.LatencyStats()
+        self.assertIsNone(stats.ewma)
+        stats.add(1.0)
+        self.assertEqual(1.0, stats.ewma)
+        stats.add(2.0)
+        self.assertAlmostEqual(1.2, stats.ewma)
+
+    def test_p95_needs_enough_samples(self):
+        stats = interface.LatencyStats()
+        for n in range(stats.MIN_SAMPLES - 1):
+            stats.add(0.1)
+        self.assertIsNone(stats.p95())
+        stats.add(0.1)
+        self.assertEqual(0.1, stats.p95())
+
+    def test_p95(self):
+        stats = interface.LatencyStats()
+        for n in range(1, 101):
+            stats.add(n / 100.0)
+        self.assertEqual(0.95, stats.p95())
+
+    def test_round_trip_is_recorded(self):
+        local, remote = socket.socketpair()
+        try:
+            i = interface.Interface('localhost:1:t', local)
+            self.assertIsNone(i.expected_rtt())
+            i.queue_request('blockchain.transaction.get', ['tx'], 7)
+            i.send_requests()
+            remote.send(json.dumps({'id': 7, 'result': 'raw'}) + '\n')
+            time.sleep(0.05)
+            i.get_responses()
+            self.assertIsNotNone(i.expected_rtt('blockchain.transaction.get'))
+            self.assertEqual(i.expected_rtt(), i.expected_rtt('blockchain.block.get_header'))
+            self.assertIsNone(i.rtt_p95('blockchain.transaction.get'))
+        finally:
+            local.close()
+            remote.close()
@@ -0,0 +1,44 @@
+import unittest
+
+from lib.metrics import Histogram, NetworkMetrics
+
+
+class TestHistogram(unittest.TestCase):
+    def test_empty(self):
+        histogram = Histogram()
+        self.assertIsNone(histogram.quantile(0.5))
+        self.assertEqual({'count': 0, 'mean': None, 'max': 0.0, 'p50': None, 'p95': None,
+                          'p99': None, 'buckets': {}}, histogram.as_dict())
+
+    def test_quantiles(self):
+        histogram = Histogram()
+        for n in range(90):
+            histogram.add(0.002)
+        for n in range(10):
+            histogram.add(0.3)
+        self.assertEqual(0.0025, histogram.quantile(0.5))
+        self.assertEqual(0.3, histogram.quantile(0.95))
+        self.assertEqual({'<=0.0025': 90, '<=0.5': 10}, histogram.as_dict()['buckets'])
+        self.assertAlmostEqual(0.0318, histogram.as_dict()['mean'])
+
+    def test_slow_samples(self):
+        histogram = Histogram()
+        histogram.add(100)
+        self.assertEqual(100, histogram.quantile(0.5))
+        self.assertEqual({'>30': 1}, histogram.as_dict()['buckets'])
+
+
+class TestNetworkMetrics(unittest.TestCase):
+    def test_request_is_timed_once(self):
+        metrics = NetworkMetrics()
+        metrics.request_sent('k')
+        metrics.request_sent('k')
+        metrics.request_answered('k', 'blockchain.transaction.get', None)
+        metrics.request_answered('k', 'blockchain.transaction.get', None)
+        self.assertEqual(1, metrics.latency['blockchain.transaction.get'].count)
+
+    def test_cache_hits_without_requests(self):
+        metrics = NetworkMetrics()
+        metrics.cache_hits['blockchain.transaction.get'] += 2
+        methods = metrics.as_dict()['methods']
+        self.assertEqual(2, methods['blockchain.transaction.get']['cache_hits'])
@@ -0,0 +1,579 @@
+import random
+import socket
+import threading
+import time
+import unittest
+
+from lib import util
+from lib.blockchain import BLOCKS_PER_CHUNK
+from lib.cache import ResponseCache
+from lib.metrics import NetworkMetrics
+from lib.network import ChunkCatchup, Network
+from lib.peers import PeerDB
+from lib.verifier import SPV
+
+
+class FakeInterface(object):
+    def __init__(self, server):
+        self.server = server
+        self.requests = []
+
+    def print_error(self, *msg):
+        pass
+
+
+class FakeBlockchain(object):
+    def __init__(self, bad_chunks=(), checkpoints=()):
+        self.local_height = -1
+        self.bad_chunks = set(bad_chunks)
+        self.checkpoints = sorted(checkpoints)
+        self.connected = []
+
+    def get_next_checkpoint_height(self, height):
+        for checkpoint in self.checkpoints:
+            if checkpoint > height:
+                return checkpoint
+
+    def connect_chunks(self, idx, hexchunks):
+        if self.bad_chunks.intersection(range(idx, idx + len(hexchunks))):
+            return False
+        for i in range(len(hexchunks)):
+            self.connect_chunk(idx + i, hexchunks[i])
+        return True
+
+    def connect_chunk(self, idx, hexdata):
+        if idx in self.bad_chunks:
+            return idx - 1
+        self.connected.append((idx, hexdata))
+        self.local_height = (idx + 1) * BLOCKS_PER_CHUNK - 1
+        return idx + 1
+
+
+class FakeNetwork(object):
+    def __init__(self, heights, blockchain=None):
+        self.interfaces = {server: FakeInterface(server) for server in heights}
+        self.heights = dict(heights)
+        self.blockchain = blockchain or FakeBlockchain()
+        self.down = []
+
+    def get_local_height(self):
+        return self.blockchain.local_height
+
+    def queue_request(self, method, params, interface):
+        interface.requests.append((method, params))
+
+    def connection_down(self, server):
+        self.down.append(server)
+        interface = self.interfaces.pop(server, None)
+        if interface:
+            self.catchup.interface_down(interface)
+
+
+# pays one coin to an address, with a coinbase-like input
+RAW_TX = ('01000000010000000000000000000000000000000000000000000000000000000000000000'
+          'ffffffff050401000000ffffffff0100e1f505000000001976a914111111111111111111'
+          '111111111111111111111188ac00000000')
+TX_HASH = '5bda5ef4d8866a70d2fbd490426579b8f7644cc17004e90c24ec20cbb4727284'
+
+
+class VerifiedWallet(object):
+    def __init__(self):
+        self.verified = []
+
+    def add_verified_tx(self, tx_hash, info):
+        self.verified.append(tx_hash)
+
+
+def chunk_response(idx):
+    return {'params': [idx], 'result': 'chunk%d' % idx}
+
+
+class TestChunkCatchup(unittest.TestCase):
+    def make_catchup(self, heights, blockchain=None, window=4):
+        network = FakeNetwork(heights, blockchain)
+        network.catchup = ChunkCatchup(network, window)
+        return network, network.catchup
+
+    def test_requests_spread_over_interfaces(self):
+        network, catchup = self.make_catchup({'a': 1000, 'b': 1000})
+        catchup.extend(1000)
+        catchup.maintain()
+        self.assertEqual(4, len(catchup.outstanding))
+        self.assertEqual(2, len(network.interfaces['a'].requests))
+        self.assertEqual(2, len(network.interfaces['b'].requests))
+
+    def test_only_complete_chunks_are_scheduled(self):
+        network, catchup = self.make_catchup({'a': 3 * BLOCKS_PER_CHUNK - 2})
+        catchup.extend(3 * BLOCKS_PER_CHUNK - 2)
+        self.assertEqual(1, catchup.end_idx)
+
+    def test_out_of_order_chunks_are_connected_in_order(self):
+        network, catchup = self.make_catchup({'a': 1000, 'b': 1000})
+        catchup.extend(4 * BLOCKS_PER_CHUNK - 1)
+        catchup.maintain()
+        by_idx = dict((idx, i) for idx, (i, _) in catchup.outstanding.items())
+        self.assertTrue(catchup.on_chunk(by_idx[2], 2, chunk_response(2)))
+        self.assertTrue(catchup.on_chunk(by_idx[1], 1, chunk_response(1)))
+        self.assertEqual([], network.blockchain.connected)
+        self.assertTrue(catchup.on_chunk(by_idx[0], 0, chunk_response(0)))
+        self.assertEqual([0, 1, 2], [idx for idx, _ in network.blockchain.connected])
+        self.assertTrue(catchup.on_chunk(by_idx[3], 3, chunk_response(3)))
+        self.assertFalse(catchup.is_active())
+
+    def test_chunks_wait_for_the_run_up_to_the_checkpoint(self):
+        blockchain = FakeBlockchain(checkpoints=[0, 3 * BLOCKS_PER_CHUNK - 1, 10 * BLOCKS_PER_CHUNK - 1])
+        network, catchup = self.make_catchup({'a': 1000}, blockchain)
+        catchup.extend(1000)
+        catchup.maintain()
+        catchup.on_chunk(network.interfaces['a'], 0, chunk_response(0))
+        self.assertEqual([0], [idx for idx, _ in blockchain.connected])
+        catchup.on_chunk(network.interfaces['a'], 1, chunk_response(1))
+        self.assertEqual([0], [idx for idx, _ in blockchain.connected])
+        catchup.on_chunk(network.interfaces['a'], 2, chunk_response(2))
+        self.assertEqual([0, 1, 2], [idx for idx, _ in blockchain.connected])
+        # the next checkpoint is further away than the window reaches
+        catchup.on_chunk(network.interfaces['a'], 3, chunk_response(3))
+        self.assertEqual([0, 1, 2, 3], [idx for idx, _ in blockchain.connected])
+
+    def test_unsolicited_chunk_is_ignored(self):
+        network, catchup = self.make_catchup({'a': 1000, 'b': 1000})
+        catchup.extend(1000)
+        catchup.maintain()
+        idx, (interface, _) = sorted(catchup.outstanding.items())[0]
+        other = [i for i in network.interfaces.values() if i != interface][0]
+        self.assertFalse(catchup.on_chunk(other, idx, chunk_response(idx)))
+        self.assertFalse(catchup.on_chunk(interface, 50, chunk_response(50)))
+
+    def test_chunks_are_reassigned_when_interface_goes_down(self):
+        network, catchup = self.make_catchup({'a': 1000, 'b': 1000})
+        catchup.extend(1000)
+        catchup.maintain()
+        network.connection_down('a')
+        catchup.maintain()
+        self.assertEqual(4, len(catchup.outstanding))
+        self.assertTrue(all(i.server == 'b' for i, _ in catchup.outstanding.values()))
+
+    def test_bad_chunk_dismisses_interface(self):
+        network, catchup = self.make_catchup({'a': 1000, 'b': 1000}, FakeBlockchain(bad_chunks=[1]))
+        catchup.extend(1000)
+        catchup.maintain()
+        by_idx = dict((idx, i) for idx, (i, _) in catchup.outstanding.items())
+        catchup.on_chunk(by_idx[0], 0, chunk_response(0))
+        catchup.on_chunk(by_idx[1], 1, chunk_response(1))
+        self.assertEqual([by_idx[1].server], network.down)
+        self.assertEqual(1, catchup.next_idx)
+        self.assertIn(1, catchup.outstanding)
+
+
+class RoutingInterface(FakeInterface):
+    def __init__(self, server, load=0, rtt=None):
+        FakeInterface.__init__(self, server)
+        self.load = load
+        self.rtt = rtt
+        self.responses = []
+
+    def queue_depth(self):
+        return self.load
+
+    def in_flight(self):
+        return 0
+
+    def expected_rtt(self, method=None):
+        return self.rtt
+
+    def rtt_p95(self, method):
+        return self.rtt
+
+    def wants_write(self):
+        return False
+
+    def queue_request(self, method, params, message_id):
+        self.requests.append((message_id, method, params))
+
+    def send_requests(self):
+        pass
+
+    def get_responses(self):
+        responses, self.responses = self.responses, []
+        return responses
+
+
+def make_network(heights, loads, rtts=None):
+    rtts = rtts or {}
+    network = Network.__new__(Network)
+    network.interfaces = dict((server, RoutingInterface(server, loads[server], rtts.get(server)))
+                              for server in heights)
+    network.heights = dict(heights)
+    network.default_server = 'main'
+    network.interface = network.interfaces['main']
+    network.load_balance = True
+    network.response_cache = None
+    network.peer_db = PeerDB(None)
+    network.metrics = NetworkMetrics()
+    network.hedge_requests = True
+    network.hedges = {}
+    network.hedge_deadlines = []
+    network.hedge_count = 0
+    network.message_id = 0
+    network.debug = False
+    network.subscriptions = {}
+    network.unanswered_requests = {}
+    network.inflight_requests = {}
+    network.coalesced_count = 0
+    network.pending_sends = []
+    network.lock = threading.Lock()
+    return network
+
+
+class TestRequestRouting(unittest.TestCase):
+    def test_stateless_request_goes_to_least_loaded(self):
+        network = make_network({'main': 100, 'a': 100, 'b': 100}, {'main': 5, 'a': 1, 'b': 3})
+        self.assertEqual('a', network.route_request('blockchain.transaction.get').server)
+        self.assertEqual('a', network.route_request('blockchain.claimtrie.getvaluesforuris').server)
+
+    def test_subscriptions_stay_on_main(self):
+        network = make_network({'main': 100, 'a': 100}, {'main': 5, 'a': 0})
+        self.assertEqual('main', network.route_request('blockchain.address.subscribe').server)
+        self.assertEqual('main', network.route_request('blockchain.address.get_history').server)
+
+    def test_lagging_interface_is_skipped(self):
+        network = make_network({'main': 100, 'a': 99}, {'main': 5, 'a': 0})
+        self.assertEqual('main', network.route_request('blockchain.transaction.get').server)
+
+    def test_ties_go_to_main(self):
+        network = make_network({'main': 100, 'a': 100}, {'main': 0, 'a': 0})
+        self.assertEqual('main', network.route_request('blockchain.transaction.get').server)
+
+    def test_requests_of_closed_interface_are_requeued(self):
+        network = make_network({'main': 100, 'a': 100}, {'main': 0, 'a': 0})
+        callback = lambda response: None
+        network.unanswered_requests = {
+            1: ('blockchain.transaction.get', ['tx1'], callback, network.interfaces['a']),
+            2: ('blockchain.transaction.get', ['tx2'], callback, network.interfaces['main']),
+        }
+        network.requeue_requests(network.interfaces['a'])
+        self.assertEqual([2], network.unanswered_requests.keys())
+        self.assertEqual([([('blockchain.transaction.get', ['tx1'])], callback)],
+                         [send[:2] for send in network.pending_sends])
+        self.assertFalse(network.is_up_to_date())
+
+    def test_faster_server_is_preferred(self):
+        network = make_network({'main': 100, 'a': 100}, {'main': 1, 'a': 1}, {'main': 0.4, 'a': 0.1})
+        self.assertEqual('a', network.route_request('blockchain.transaction.get').server)
+
+    def test_slow_server_loses_to_busy_fast_one(self):
+        network = make_network({'main': 100, 'a': 100}, {'main': 3, 'a': 0}, {'main': 0.05, 'a': 1.0})
+        self.assertEqual('main', network.route_request('blockchain.transaction.get').server)
+
+    def test_switch_picks_fastest_server_at_best_height(self):
+        network = make_network({'main': 100, 'a': 100, 'b': 100, 'c': 99},
+                               {'main': 0, 'a': 0, 'b': 0, 'c': 0},
+                               {'main': 0.01, 'a': 0.3, 'b': 0.2, 'c': 0.01})
+        network.get_interfaces = lambda: list(network.interfaces)
+        switched = []
+        network.switch_to_interface = switched.append
+        network.switch_to_random_interface()
+        self.assertEqual(['b'], switched)
+
+    def test_switch_without_timings_uses_peer_db(self):
+        random.seed(1)
+        network = make_network({'main': 100, 'a': 100, 'b': 100}, {'main': 0, 'a': 0, 'b': 0})
+        network.get_interfaces = lambda: list(network.interfaces)
+        for n in range(50):
+            network.peer_db.failed('a')
+        network.peer_db.connected('b', 0.1)
+        switched = []
+        network.switch_to_interface = switched.append
+        for n in range(20):
+            network.switch_to_random_interface()
+        self.assertGreater(switched.count('b'), 15)
+
+
+class TestHedgedRequests(unittest.TestCase):
+    def setUp(self):
+        self.network = make_network({'main': 100, 'a': 100}, {'main': 0, 'a': 0}, {'main': 0.1, 'a': 0.2})
+        self.answers = []
+        self.network.pending_sends = [([('blockchain.transaction.get', ['tx'])], self.answers.append, time.time())]
+        self.network.process_pending_sends()
+        self.main = self.network.interfaces['main']
+        self.other = self.network.interfaces['a']
+
+    def expire_deadlines(self):
+        self.network.hedge_deadlines = [(0, message_id) for _, message_id in self.network.hedge_deadlines]
+
+    def test_request_is_not_hedged_before_deadline(self):
+        self.network.send_hedges()
+        self.assertEqual([], self.other.requests)
+        self.assertEqual(1, len(self.network.hedge_deadlines))
+
+    def test_slow_request_is_sent_to_second_server(self):
+        self.expire_deadlines()
+        self.network.send_hedges()
+        self.assertEqual([(1, 'blockchain.transaction.get', ['tx'])], self.other.requests)
+        self.assertEqual({0: 1, 1: 0}, self.network.hedges)
+        self.assertEqual(1, self.network.hedge_count)
+
+    def respond(self, interface, message_id, response):
+        response['id'] = message_id
+        interface.responses.append((('blockchain.transaction.get', ['tx'], message_id), response))
+        self.network.process_responses(interface)
+
+    def test_first_answer_wins(self):
+        self.expire_deadlines()
+        self.network.send_hedges()
+        self.respond(self.other, 1, {'result': 'raw'})
+        self.assertEqual(1, len(self.answers))
+        self.assertEqual({}, self.network.unanswered_requests)
+        self.assertEqual({}, self.network.hedges)
+        self.respond(self.main, 0, {'result': 'raw'})
+        self.assertEqual(1, len(self.answers))
+
+    def test_error_waits_for_other_copy(self):
+        self.expire_deadlines()
+        self.network.send_hedges()
+        self.respond(self.other, 1, {'error': 'busy'})
+        self.assertEqual([], self.answers)
+        self.assertEqual([0], self.network.unanswered_requests.keys())
+
+
+class CacheBlockchain(object):
+    def __init__(self, headers):
+        self.headers = headers
+
+    def read_header(self, height):
+        return self.headers.get(height)
+
+    def hash_header(self, header):
+        return header['block_hash']
+
+
+class TestResponseCaching(unittest.TestCase):
+    def setUp(self):
+        self.network = make_network({'main': 100}, {'main': 0})
+        self.network.response_cache = ResponseCache()
+        self.network.get_local_height = lambda: 1000
+        self.network.blockchain = CacheBlockchain({800: {'block_hash': 'aa', 'merkle_root': None}})
+        self.network.bc_requests = []
+        self.answers = []
+
+    def request(self, method, params):
+        self.network.pending_sends = [([(method, params)], self.answers.append, time.time())]
+        self.network.process_pending_sends()
+
+    def answer(self, method, params, result):
+        main = self.network.interfaces['main']
+        message_id = main.requests[-1][0]
+        main.responses.append(((method, params, message_id), {'id': message_id, 'result': result}))
+        self.network.process_responses(main)
+
+    def verify_merkle(self, tx_hash, merkle_root):
+        spv = SPV.__new__(SPV)
+        spv.network = self.network
+        spv.wallet = VerifiedWallet()
+        spv.merkle_roots = {}
+        spv.print_error = lambda *msg: None
+        self.network.blockchain.headers[800]['merkle_root'] = merkle_root
+        spv.verify_merkle(self.answers[-1])
+        return spv.wallet.verified
+
+    def test_transaction_is_served_from_cache(self):
+        self.request('blockchain.transaction.get', [TX_HASH])
+        self.answer('blockchain.transaction.get', [TX_HASH], RAW_TX)
+        self.request('blockchain.transaction.get', [TX_HASH])
+        self.assertEqual(1, len(self.network.interfaces['main'].requests))
+        self.assertEqual([RAW_TX, RAW_TX], [r['result'] for r in self.answers])
+        self.assertEqual(1, self.network.get_cache_stats()['hits'])
+
+    def test_wrong_transaction_is_not_cached(self):
+        other_hash = '00' * 32
+        self.request('blockchain.transaction.get', [other_hash])
+        self.answer('blockchain.transaction.get', [other_hash], RAW_TX)
+        self.request('blockchain.transaction.get', [other_hash])
+        self.assertEqual(2, len(self.network.interfaces['main'].requests))
+        self.request('blockchain.transaction.get', [TX_HASH])
+        self.answer('blockchain.transaction.get', [TX_HASH], 'not a transaction')
+        self.request('blockchain.transaction.get', [TX_HASH])
+        self.assertEqual(4, len(self.network.interfaces['main'].requests))
+
+    def test_unverified_merkle_branch_is_not_cached(self):
+        self.request('blockchain.transaction.get_merkle', [TX_HASH, 800])
+        self.answer('blockchain.transaction.get_merkle', [TX_HASH, 800],
+                    {'block_height': 800, 'merkle': [], 'pos': 0})
+        self.request('blockchain.transaction.get_merkle', [TX_HASH, 800])
+        self.assertEqual(2, len(self.network.interfaces['main'].requests))
+
+    def test_verified_merkle_branch_is_cached(self):
+        self.request('blockchain.transaction.get_merkle', [TX_HASH, 800])
+        self.answer('blockchain.transaction.get_merkle', [TX_HASH, 800],
+                    {'block_height': 800, 'merkle': [], 'pos': 0})
+        # a lone transaction is the merkle root of its block
+        self.assertEqual([TX_HASH], self.verify_merkle(TX_HASH, TX_HASH))
+        self.request('blockchain.transaction.get_merkle', [TX_HASH, 800])
+        self.assertEqual(1, len(self.network.interfaces['main'].requests))
+
+    def test_rejected_merkle_branch_is_not_cached(self):
+        self.request('blockchain.transaction.get_merkle', [TX_HASH, 800])
+        self.answer('blockchain.transaction.get_merkle', [TX_HASH, 800],
+                    {'block_height': 800, 'merkle': [], 'pos': 0})
+        self.assertEqual([], self.verify_merkle(TX_HASH, '11' * 32))
+        self.request('blockchain.transaction.get_merkle', [TX_HASH, 800])
+        self.assertEqual(2, len(self.network.interfaces['main'].requests))
+
+    def test_shallow_merkle_branch_is_not_cached(self):
+        response = {'result': {'block_height': 990, 'merkle': [], 'pos': 0}}
+        self.network.cache_response('blockchain.transaction.get_merkle', [TX_HASH, 990], response, verified=True)
+        self.request('blockchain.transaction.get_merkle', [TX_HASH, 990])
+        self.assertEqual(1, len(self.network.interfaces['main'].requests))
+
+    def test_only_local_headers_are_cached(self):
+        self.request('blockchain.block.get_header', [800])
+        self.answer('blockchain.block.get_header', [800], {'block_hash': 'bb'})
+        self.request('blockchain.block.get_header', [800])
+        self.assertEqual(2, len(self.network.interfaces['main'].requests))
+        self.answer('blockchain.block.get_header', [800], {'block_hash': 'aa'})
+        self.request('blockchain.block.get_header', [800])
+        self.assertEqual(2, len(self.network.interfaces['main'].requests))
+
+    def test_errors_are_not_cached(self):
+        self.request('blockchain.transaction.get', [TX_HASH])
+        self.answer('blockchain.transaction.get', [TX_HASH], None)
+        self.request('blockchain.transaction.get', [TX_HASH])
+        self.assertEqual(2, len(self.network.interfaces['main'].requests))
+
+
+class ClientRequestTestCase(unittest.TestCase):
+    def setUp(self):
+        self.network = make_network({'main': 100, 'a': 100}, {'main': 0, 'a': 1})
+        self.main = self.network.interfaces['main']
+        self.answers = []
+
+    def send(self, method, params, count=1, queued=None):
+        queued = queued or time.time()
+        self.network.pending_sends = [([(method, params)], self.answers.append, queued)
+                                      for n in range(count)]
+        self.network.process_pending_sends()
+
+    def respond(self, interface, message_id, response):
+        method, params = interface.requests[-1][1:]
+        response['id'] = message_id
+        interface.responses.append(((method, params, message_id), response))
+        self.network.process_responses(interface)
+
+
+class TestRequestCoalescing(ClientRequestTestCase):
+    def test_identical_requests_share_one_answer(self):
+        self.send('blockchain.claimtrie.getclaimbyid', ['abc'], 3)
+        self.assertEqual(1, len(self.main.requests))
+        self.assertEqual(2, self.network.coalesced_count)
+        self.respond(self.main, 0, {'result': {'name': 'x'}})
+        self.assertEqual(3, len(self.answers))
+        self.assertEqual({}, self.network.inflight_requests)
+
+    def test_different_params_are_not_coalesced(self):
+        now = time.time()
+        self.network.pending_sends = [([('blockchain.transaction.get_merkle', ['tx', 1])], self.answers.append, now),
+                                      ([('blockchain.transaction.get_merkle', ['tx', 2])], self.answers.append, now)]
+        self.network.process_pending_sends()
+        self.assertEqual(2, len(self.main.requests))
+
+    def test_request_after_answer_is_sent_again(self):
+        self.send('blockchain.claimtrie.getclaimbyid', ['abc'])
+        self.respond(self.main, 0, {'result': {}})
+        self.send('blockchain.claimtrie.getclaimbyid', ['abc'])
+        self.assertEqual(2, len(self.main.requests))
+
+    def test_waiting_requests_are_requeued(self):
+        self.send('blockchain.claimtrie.getclaimbyid', ['abc'], 2)
+        self.network.requeue_requests(self.main)
+        self.assertEqual(2, len(self.network.pending_sends))
+        self.assertEqual({}, self.network.inflight_requests)
+        self.network.process_pending_sends()
+        self.assertEqual(2, len(self.main.requests))
+        self.assertEqual(1, len(self.network.inflight_requests))
+
+
+class TestNetworkMetrics(ClientRequestTestCase):
+    def setUp(self):
+        super(TestNetworkMetrics, self).setUp()
+        self.sockets = []
+        for interface in self.network.interfaces.values():
+            s = socket.socket()
+            self.sockets.append(s)
+            interface.pipe = util.SocketPipe(s)
+
+    def tearDown(self):
+        for s in self.sockets:
+            s.close()
+        super(TestNetworkMetrics, self).tearDown()
+
+    def test_request_metrics(self):
+        self.send('blockchain.claimtrie.getclaimbyid', ['abc'], 2)
+        self.respond(self.main, 0, {'result': {}})
+        self.send('blockchain.transaction.get', ['tx'])
+        self.respond(self.main, 1, {'error': 'unknown'})
+        metrics = self.network.get_metrics()
+        self.assertEqual(1, metrics['methods']['blockchain.claimtrie.getclaimbyid']['count'])
+        self.assertEqual(0, metrics['methods']['blockchain.claimtrie.getclaimbyid']['errors'])
+        self.assertEqual(1, metrics['methods']['blockchain.transaction.get']['errors'])
+        self.assertEqual(1, metrics['coalesced'])
+        self.assertEqual(0, metrics['unanswered_requests'])
+        self.assertEqual(0, metrics['servers']['main']['bytes_sent'])
+
+    def test_latency_includes_time_in_pending_sends(self):
+        self.send('blockchain.transaction.get', ['tx'], queued=time.time() - 5)
+        self.respond(self.main, 0, {'result': '00'})
+        latency = self.network.get_metrics()['methods']['blockchain.transaction.get']
+        self.assertGreaterEqual(latency['max'], 5)
+
+    def test_requeued_request_keeps_queued_time(self):
+        queued = time.time() - 5
+        self.send('blockchain.transaction.get', ['tx'], queued=queued)
+        self.network.requeue_requests(self.main)
+        self.assertEqual([queued], [send[2] for send in self.network.pending_sends])
+
+    def test_send_records_queued_time(self):
+        self.network.waker = util.Waker()
+        try:
+            before = time.time()
+            self.network.send([('blockchain.transaction.get', ['tx'])], self.answers.append)
+            queued = self.network.pending_sends[0][2]
+            self.assertTrue(before <= queued <= time.time())
+        finally:
+            self.network.waker.close()
+
+
+class TestSynchronousGetMany(unittest.TestCase):
+    def setUp(self):
+        self.network = make_network({'main': 100}, {'main': 0})
+        self.network.waker = util.Waker()
+
+    def tearDown(self):
+        self.network.waker.close()
+
+    def answer_in_reverse(self):
+        while not self.network.pending_sends:
+            time.sleep(0.01)
+        with self.network.lock:
+            sends, self.network.pending_sends = self.network.pending_sends, []
+        for messages, callback, _ in reversed(sends):
+            method, params = messages[0]
+            if params == ['bad']:
+                callback({'method': method, 'params': params, 'error': 'unknown'})
+            else:
+                callback({'method': method, 'params': params, 'result': params[0].upper()})
+
+    def test_results_are_in_request_order(self):
+        threading.Thread(target=self.answer_in_reverse).start()
+        requests = [('blockchain.transaction.get', [tx]) for tx in ('a', 'b', 'c')]
+        self.assertEqual(['A', 'B', 'C'], self.network.synchronous_get_many(requests))
+
+    def test_error_is_raised(self):
+        threading.Thread(target=self.answer_in_reverse).start()
+        requests = [('blockchain.transaction.get', [tx]) for tx in ('a', 'bad')]
+        self.assertRaises(BaseException, self.network.synchronous_get_many, requests)
+
+    def test_shared_deadline(self):
+        start = time.time()
+        requests = [('blockchain.transaction.get', [tx]) for tx in ('a', 'b', 'c')]
+        self.assertRaises(BaseException, self.network.synchronous_get_many, requests, 0.2)
+        self.assertLess(time.time() - start, 0.5)
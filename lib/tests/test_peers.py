@@ -0,0 +1,69 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+from lib import peers
+from lib.peers import PeerDB, PeerRecord
+
+
+class TestPeerDB(unittest.TestCase):
+    def setUp(self):
+        self.lbryum_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.lbryum_dir, 'peers')
+
+    def tearDown(self):
+        shutil.rmtree(self.lbryum_dir)
+
+    def test_reliable_server_scores_higher(self):
+        db = PeerDB(None)
+        for n in range(5):
+            db.connected('good:50001:t', 0.2)
+            db.failed('bad:50001:t')
+        self.assertGreater(db.score('good:50001:t'), db.score('new:50001:t'))
+        self.assertGreater(db.score('new:50001:t'), db.score('bad:50001:t'))
+
+    def test_lagging_and_slow_servers_score_lower(self):
+        db = PeerDB(None)
+        for server in ('a', 'b', 'c'):
+            db.connected(server, 0.2)
+        db.update('a', 0.1, 0)
+        db.update('b', 0.1, 3)
+        db.update('c', 2.0, 0)
+        self.assertGreater(db.score('a'), db.score('b'))
+        self.assertGreater(db.score('a'), db.score('c'))
+
+    def test_choose_is_weighted(self):
+        random.seed(1)
+        db = PeerDB(None)
+        for n in range(20):
+            db.failed('bad')
+            db.connected('good', 0.1)
+        picks = [db.choose(['bad', 'good']) for n in range(200)]
+        self.assertGreater(picks.count('good'), 180)
+        self.assertIsNone(db.choose([]))
+
+    def test_saved_and_loaded(self):
+        db = PeerDB(self.path)
+        db.connected('a:50001:t', 0.5)
+        db.add_hosts({'a': {'t': '50001', 'pruning': '-', 'version': '1.0'}})
+        db.save()
+        loaded = PeerDB(self.path)
+        self.assertEqual(db.records['a:50001:t'].as_dict(), loaded.records['a:50001:t'].as_dict())
+        self.assertEqual(db.hosts, loaded.hosts)
+        self.assertTrue(loaded.recently_connected('a:50001:t'))
+        self.assertFalse(loaded.recently_connected('b:50001:t'))
+
+    def test_old_records_expire(self):
+        db = PeerDB(self.path)
+        db.records['old'] = PeerRecord(attempts=1, last_failure=time.time() - peers.PEER_EXPIRY - 1)
+        db.connected('new', 0.1)
+        db.save()
+        self.assertEqual(['new'], PeerDB(self.path).records.keys())
+
+    def test_corrupt_file_is_ignored(self):
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+        self.assertEqual({}, PeerDB(self.path).records)
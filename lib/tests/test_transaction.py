@@ -150,3 +150,6 @@ class NetworkMock(object):
 
     def synchronous_get(self, arg):
         return self.unspent
+
+    def synchronous_get_many(self, requests):
+        return [self.unspent for request in requests]
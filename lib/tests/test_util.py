@@ -1,5 +1,17 @@
+import json
+import logging
+import select
+import socket
+import threading
+import time
 import unittest
-from lib.util import format_satoshis, parse_URI
+from lib import util
+from lib.util import format_satoshis, parse_URI, Waker, SocketPipe, RECV_SIZE, timeout
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
 
 class TestUtil(unittest.TestCase):
@@ -71,3 +83,169 @@ class TestUtil(unittest.TestCase):
     def test_parse_URI_parameter_polution(self):
         self.assertRaises(Exception, parse_URI,
                           'bitcoin:bFnNVhPUNRWiA6Y2hbd1KBAMgQBrFsc5u3?amount=0.0003&label=test&amount=30.0')
+
+
+class TestWaker(unittest.TestCase):
+    def setUp(self):
+        self.waker = Waker()
+
+    def tearDown(self):
+        self.waker.close()
+
+    def readable(self, timeout=0):
+        return bool(select.select([self.waker], [], [], timeout)[0])
+
+    def test_wake_and_clear(self):
+        self.assertFalse(self.readable())
+        self.waker.wake()
+        self.waker.wake()
+        self.assertTrue(self.readable())
+        self.waker.clear()
+        self.assertFalse(self.readable())
+        self.waker.wake()
+        self.assertTrue(self.readable())
+
+    def test_wake_from_other_thread_ends_select(self):
+        timer = threading.Timer(0.05, self.waker.wake)
+        timer.start()
+        start = time.time()
+        self.assertTrue(self.readable(5))
+        self.assertLess(time.time() - start, 1)
+        timer.join()
+
+    def test_wake_during_clear_is_not_lost(self):
+        waker = self.waker
+
+        class WakingReader(object):
+            '''Reader that calls wake() from inside clear()'''
+            def __init__(self, reader):
+                self.reader = reader
+                self.woken = False
+
+            def fileno(self):
+                return self.reader.fileno()
+
+            def recv(self, size):
+                if not self.woken:
+                    self.woken = True
+                    waker.wake()
+                return self.reader.recv(size)
+
+            def close(self):
+                self.reader.close()
+
+        waker.wake()
+        waker.reader = WakingReader(waker.reader)
+        waker.clear()
+        self.assertFalse(waker.pending)
+        waker.wake()
+        self.assertTrue(self.readable())
+
+
+class TestSocketPipe(unittest.TestCase):
+    def setUp(self):
+        self.local, self.remote = socket.socketpair()
+        self.pipe = SocketPipe(self.local)
+
+    def tearDown(self):
+        self.local.close()
+        self.remote.close()
+
+    def test_frames_split_over_reads(self):
+        self.remote.send('{"id": 1, "res')
+        self.assertRaises(timeout, self.pipe.get)
+        self.remote.send('ult": 2}\n{"id": 2}\n{"id"')
+        self.assertEqual({'id': 1, 'result': 2}, self.pipe.get())
+        self.assertEqual({'id': 2}, self.pipe.get())
+        self.assertRaises(timeout, self.pipe.get)
+        self.remote.send(': 3}\n')
+        self.assertEqual({'id': 3}, self.pipe.get())
+
+    def test_frame_larger_than_read_size(self):
+        result = 'ab' * RECV_SIZE * 2
+        writer = threading.Thread(target=self.remote.sendall,
+                                  args=(json.dumps({'id': 1, 'result': result}) + '\n{"id": 2}\n',))
+        writer.start()
+        self.pipe.set_timeout(5)
+        self.assertEqual(result, self.pipe.get()['result'])
+        self.assertEqual({'id': 2}, self.pipe.get())
+        writer.join()
+
+    def test_malformed_frame_is_skipped(self):
+        self.remote.send('{"id": \n{"id": 4}\n')
+        self.assertEqual({'id': 4}, self.pipe.get())
+
+    def test_closed_remotely(self):
+        self.remote.close()
+        self.assertIsNone(self.pipe.get())
+
+
+class TestJSONCodec(unittest.TestCase):
+    def tearDown(self):
+        util.set_json_codec('json')
+
+    def test_select_stdlib(self):
+        codec = util.set_json_codec('json')
+        self.assertEqual('json', codec.name)
+        self.assertIs(codec, util.get_json_codec())
+
+    def test_auto_picks_an_installed_codec(self):
+        codec = util.set_json_codec('auto')
+        self.assertIn(codec.name, [c.name for c in util.JSON_CODECS])
+        self.assertEqual({u'id': 1, u'result': [1.5, u'x']}, codec.loads('{"id": 1, "result": [1.5, "x"]}'))
+
+    def test_unknown_codec_keeps_current_and_warns(self):
+        records = []
+        handler = logging.Handler()
+        handler.emit = records.append
+        util.log.addHandler(handler)
+        try:
+            util.set_json_codec('json')
+            self.assertEqual('json', util.set_json_codec('nosuchcodec').name)
+        finally:
+            util.log.removeHandler(handler)
+        self.assertEqual(1, len(records))
+        self.assertEqual(logging.WARNING, records[0].levelno)
+        self.assertIn('nosuchcodec', records[0].getMessage())
+
+    @unittest.skipIf(ujson is None, "ujson is not installed")
+    def test_select_ujson(self):
+        codec = util.set_json_codec('ujson')
+        self.assertEqual('ujson', codec.name)
+        self.assertIs(codec, util.get_json_codec())
+        self.assertEqual({u'id': 1, u'result': [1.5, u'x']}, codec.loads('{"id": 1, "result": [1.5, "x"]}'))
+        # integers beyond 64 bits fall back to json
+        self.assertEqual([2 ** 70], codec.loads('[%d]' % 2 ** 70))
+        self.assertEqual('{"id": 1}', codec.dumps({'id': 1}))
+
+    def test_encoding_matches_stdlib(self):
+        data = {'method': 'blockchain.address.get_history', 'params': ['bTest/1'], 'id': 7, 'fee': 0.1}
+        for codec_class in util.JSON_CODECS:
+            try:
+                codec = codec_class()
+            except ImportError:
+                continue
+            self.assertEqual(json.dumps(data), codec.dumps(data))
+            self.assertEqual(data, codec.loads(json.dumps(data)))
+
+    def test_compact_encoding_round_trips(self):
+        data = {'method': 'blockchain.address.get_history', 'params': ['bTest/1'], 'id': 7,
+                'fee': 0.1 + 0.2, 'amount': 2 ** 70, 'name': u'caf\xe9'}
+        for codec_class in util.JSON_CODECS:
+            try:
+                codec = codec_class()
+            except ImportError:
+                continue
+            encoded = codec.encode(data)
+            self.assertNotIn(', ', encoded)
+            self.assertEqual(data, json.loads(encoded))
+
+    def test_socket_pipe_sends_compact_messages(self):
+        util.set_json_codec('json')
+        local, remote = socket.socketpair()
+        try:
+            SocketPipe(local).send_all([{'params': ['a', 'b']}, {'id': 1}])
+            self.assertEqual('{"params":["a","b"]}\n{"id":1}\n', remote.recv(1024))
+        finally:
+            local.close()
+            remote.close()
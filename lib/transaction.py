@@ -649,10 +649,11 @@ class Transaction:
     def sweep(klass, privkeys, network, to_address, fee):
         inputs = []
         keypairs = {}
-        for privkey in privkeys:
+        addresses = [address_from_private_key(privkey) for privkey in privkeys]
+        unspent = network.synchronous_get_many([('blockchain.address.listunspent', [address])
+                                                for address in addresses])
+        for privkey, address, u in zip(privkeys, addresses, unspent):
             pubkey = public_key_from_private_key(privkey)
-            address = address_from_private_key(privkey)
-            u = network.synchronous_get(('blockchain.address.listunspent',[address]))
             pay_script = klass.pay_script(TYPE_ADDRESS, address)
             for item in u:
                 item['scriptPubKey'] = pay_script
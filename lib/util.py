@@ -149,6 +149,81 @@ def print_msg(*args):
     sys.stdout.write(" ".join(args) + "\n")
     sys.stdout.flush()
 
+class JSONCodec(object):
+    '''JSON encoding and decoding for wire messages, RPCs and wallet
+    files, with the standard library json module.  dumps gives the same
+    bytes as json.dumps, encode compact output for messages whose bytes
+    do not matter.'''
+    name = 'json'
+
+    def loads(self, s, **kwargs):
+        return json.loads(s, **kwargs)
+
+    def dumps(self, obj, **kwargs):
+        return json.dumps(obj, **kwargs)
+
+    def encode(self, obj):
+        return json.dumps(obj, separators=(',', ':'))
+
+
+class UJSONCodec(JSONCodec):
+    '''Decodes with ujson, and encodes wire messages and RPC responses
+    with it if its floats round trip.  dumps stays with json, ujson
+    formats floats and escapes strings differently, and it cannot
+    reproduce indented output byte for byte.'''
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self.ujson = ujson
+        # older versions round floats to 9 digits
+        self.exact_floats = ujson.dumps(0.1 + 0.2) == repr(0.1 + 0.2)
+
+    def encode(self, obj):
+        if self.exact_floats:
+            try:
+                return self.ujson.dumps(obj, escape_forward_slashes=False)
+            except (TypeError, OverflowError):
+                # types ujson does not know, integers beyond 64 bits
+                pass
+        return JSONCodec.encode(self, obj)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return json.loads(s, **kwargs)
+        try:
+            return self.ujson.loads(s, precise_float=True)
+        except (ValueError, OverflowError):
+            # ujson rejects integers beyond 64 bits
+            return json.loads(s)
+
+
+JSON_CODECS = [UJSONCodec, JSONCodec]
+json_codec = JSONCodec()
+
+
+def set_json_codec(name='auto'):
+    '''Select the JSON codec by name, or the fastest one installed for
+    'auto'.  Returns the codec in use.'''
+    global json_codec
+    for codec in JSON_CODECS:
+        if name not in ('auto', codec.name):
+            continue
+        try:
+            json_codec = codec()
+            break
+        except ImportError:
+            if name != 'auto':
+                log.warning("json codec %s is not installed, using %s", name, json_codec.name)
+    if name not in ['auto'] + [codec.name for codec in JSON_CODECS]:
+        log.warning("unknown json codec %s, using %s", name, json_codec.name)
+    return json_codec
+
+
+def get_json_codec():
+    return json_codec
+
+
 def json_encode(obj):
     try:
         s = json.dumps(obj, sort_keys = True, indent = 4, cls=MyEncoder)
@@ -443,13 +518,88 @@ import json
 import ssl
 import time
 
+
+def make_socket_pair():
+    '''A connected pair of sockets, emulated over the loopback interface
+    where socket.socketpair() is missing (Windows)'''
+    if hasattr(socket, 'socketpair'):
+        return socket.socketpair()
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen(1)
+        writer = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        writer.connect(listener.getsockname())
+        reader, _ = listener.accept()
+    finally:
+        listener.close()
+    return reader, writer
+
+
+class Waker(object):
+    '''Wakes up a thread waiting in select() from other threads.  The
+    waiting thread selects on the Waker for reading and calls clear()
+    before handling the work it was woken for.'''
+
+    def __init__(self):
+        self.reader, self.writer = make_socket_pair()
+        self.reader.setblocking(0)
+        self.writer.setblocking(0)
+        self.lock = threading.Lock()
+        self.pending = False
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def wake(self):
+        with self.lock:
+            if self.pending:
+                return
+            self.pending = True
+        try:
+            self.writer.send('\0')
+        except socket.error:
+            # the pipe is full, so the reader is already awake
+            pass
+
+    def clear(self):
+        # drain before resetting pending: a wake() in between then either
+        # writes a byte that stays unread, or finds pending still set and
+        # its work is handled by the caller after clear() returns
+        try:
+            while self.reader.recv(4096):
+                pass
+        except socket.error:
+            pass
+        with self.lock:
+            self.pending = False
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+
+
+# bytes requested from the socket by each SocketPipe read
+RECV_SIZE = 65536
+# an empty receive buffer grown past this is given back
+MAX_IDLE_BUFFER = 1 << 20
+
+
 class SocketPipe:
 
     def __init__(self, socket):
         self.socket = socket
-        self.message = ''
+        # received data is buffer[start:end], and there is no newline in
+        # buffer[start:scanned], so frames are never scanned twice
+        self.buffer = bytearray(RECV_SIZE)
+        self.start = self.end = self.scanned = 0
         self.set_timeout(0.1)
         self.recv_time = time.time()
+        # output not yet accepted by a non-blocking socket
+        self.outgoing = ''
+        self.write_size = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
 
     def set_timeout(self, t):
         self.socket.settimeout(t)
@@ -457,13 +607,45 @@ class SocketPipe:
     def idle_time(self):
         return time.time() - self.recv_time
 
+    def next_frame(self):
+        '''The next complete line in the receive buffer, or None'''
+        n = self.buffer.find('\n', self.scanned, self.end)
+        if n == -1:
+            self.scanned = self.end
+            return None
+        frame = memoryview(self.buffer)[self.start:n].tobytes()
+        self.start = self.scanned = n + 1
+        if self.start == self.end:
+            self.start = self.end = self.scanned = 0
+            if len(self.buffer) > MAX_IDLE_BUFFER:
+                self.buffer = bytearray(RECV_SIZE)
+        return frame
+
+    def reserve(self):
+        '''Make room for a read at the end of the receive buffer, moving
+        a partial frame to the front or growing the buffer'''
+        if len(self.buffer) - self.end >= RECV_SIZE:
+            return
+        used = self.end - self.start
+        if self.start and used + RECV_SIZE <= len(self.buffer):
+            self.buffer[:used] = memoryview(self.buffer)[self.start:self.end].tobytes()
+            self.scanned -= self.start
+            self.start, self.end = 0, used
+        else:
+            self.buffer.extend(bytearray(max(len(self.buffer), RECV_SIZE)))
+
     def get(self):
         while True:
-            response, self.message = parse_json(self.message)
-            if response is not None:
-                return response
+            frame = self.next_frame()
+            if frame is not None:
+                try:
+                    return json_codec.loads(frame)
+                except ValueError:
+                    # skip malformed messages
+                    continue
+            self.reserve()
             try:
-                data = self.socket.recv(1024)
+                n = self.socket.recv_into(memoryview(self.buffer)[self.end:], len(self.buffer) - self.end)
             except socket.timeout:
                 raise timeout
             except ssl.SSLError:
@@ -472,33 +654,63 @@ class SocketPipe:
                 if err.errno == 60:
                     raise timeout
                 elif err.errno in [11, 35, 10035]:
-                    # print_error("socket errno %d (resource temporarily unavailable)"% err.errno)
-                    time.sleep(0.05)
+                    # resource temporarily unavailable, wait for select
                     raise timeout
                 else:
                     print_error("pipe: socket error", err)
-                    data = ''
+                    n = 0
             except:
                 traceback.print_exc(file=sys.stderr)
-                data = ''
+                n = 0
 
-            if not data:  # Connection closed remotely
+            if not n:  # Connection closed remotely
                 return None
-            self.message += data
+            self.end += n
+            self.bytes_received += n
             self.recv_time = time.time()
 
     def send(self, request):
-        out = json.dumps(request) + '\n'
+        out = json_codec.encode(request) + '\n'
         self._send(out)
 
     def send_all(self, requests):
-        out = ''.join(map(lambda x: json.dumps(x) + '\n', requests))
+        out = ''.join(map(lambda x: json_codec.encode(x) + '\n', requests))
         self._send(out)
 
+    def queue_all(self, requests):
+        '''Queue requests to be written by flush()'''
+        self.outgoing += ''.join(map(lambda x: json_codec.encode(x) + '\n', requests))
+
+    def has_output(self):
+        return bool(self.outgoing)
+
+    def flush(self):
+        '''Write as much queued output as a non-blocking socket accepts.
+        Returns True once all of it has been written.'''
+        while self.outgoing:
+            # an SSL write that would block must be retried with the same size
+            size = self.write_size or min(len(self.outgoing), 16384)
+            try:
+                sent = self.socket.send(self.outgoing[:size])
+            except (ssl.SSLWantWriteError, ssl.SSLWantReadError):
+                sent = 0
+            except socket.error as e:
+                if e[0] not in (errno.EWOULDBLOCK, errno.EAGAIN):
+                    raise
+                sent = 0
+            if not sent:
+                self.write_size = size
+                return False
+            self.write_size = 0
+            self.bytes_sent += sent
+            self.outgoing = self.outgoing[sent:]
+        return True
+
     def _send(self, out):
         while out:
             try:
                 sent = self.socket.send(out)
+                self.bytes_sent += sent
                 out = out[sent:]
             except ssl.SSLError as e:
                 print_error("SSLError:", e)
@@ -566,7 +778,7 @@ class StoreDict(dict):
     def load(self):
         try:
             with open(self.path, 'r') as f:
-                self.update(json.loads(f.read()))
+                self.update(json_codec.loads(f.read()))
         except:
             pass
 
@@ -30,6 +30,10 @@ class SPV(ThreadJob):
         # Keyed by tx hash.  Value is None if the merkle branch was
         # requested, and the merkle root once it has been verified
         self.merkle_roots = {}
+        network.register_callback(self.on_reorg, ['reorg'])
+
+    def release(self):
+        self.network.unregister_callback(self.on_reorg)
 
     def run(self):
         lh = self.network.get_local_height()
@@ -65,6 +69,7 @@ class SPV(ThreadJob):
             return
 
         # we passed all the tests
+        self.network.cache_response('blockchain.transaction.get_merkle', params, r, verified=True)
         self.merkle_roots[tx_hash] = merkle_root
         self.print_error("verified %s" % tx_hash)
         self.wallet.add_verified_tx(tx_hash, (tx_height, header.get('timestamp'), pos))
@@ -78,6 +83,10 @@ class SPV(ThreadJob):
         return hash_encode(h)
 
 
+    def on_reorg(self, event, height):
+        '''The blockchain replaced its headers from height upwards'''
+        self.undo_verifications(height)
+
     def undo_verifications(self, height):
         tx_hashes = self.wallet.undo_verifications(height)
         for tx_hash in tx_hashes:
@@ -31,7 +31,7 @@ from unicodedata import normalize
 from decimal import Decimal
 from i18n import _
 
-from util import NotEnoughFunds, PrintError, profiler
+from util import NotEnoughFunds, PrintError, profiler, get_json_codec
 
 from lbrycrd import *
 from account import *
@@ -70,7 +70,7 @@ class WalletStorage(PrintError):
         except IOError:
             return
         try:
-            self.data = json.loads(data)
+            self.data = get_json_codec().loads(data)
         except:
             try:
                 d = ast.literal_eval(data)  #parse raw data from reading wallet file
@@ -502,11 +502,15 @@ class Abstract_Wallet(PrintError):
         '''Used by the verifier when a reorg has happened'''
         txs = []
         with self.lock:
-            for tx_hash, item in self.verified_tx:
+            for tx_hash, item in self.verified_tx.items():
                 tx_height, timestamp, pos = item
                 if tx_height >= height:
                     self.verified_tx.pop(tx_hash, None)
+                    # verify it again against the new chain
+                    self.unverified_tx[tx_hash] = tx_height
                     txs.append(tx_hash)
+        if txs:
+            self.storage.put('verified_tx3', self.verified_tx)
         return txs
 
     def get_local_height(self):
@@ -1301,6 +1305,7 @@ class Abstract_Wallet(PrintError):
         if self.network:
             self.network.remove_jobs([self.synchronizer, self.verifier])
             self.synchronizer.release()
+            self.verifier.release()
             self.synchronizer = None
             self.verifier = None
             # Now no references to the syncronizer or verifier